@@ -0,0 +1,421 @@
+"""
+Runs a real Bot against a fake homeserver in the same process and measures
+how fast events go through Callbacks, the Listener's handlers and Api._send_room.
+
+Usage: python benchmarks/end_to_end.py [--rooms N] [--messages N] [--invites N]
+                                        [--dispatch-workers N] [--output FILE]
+
+The fake homeserver serves /sync, /send and /join (plus login, filter upload
+and versions) on 127.0.0.1 with aiohttp. It feeds messages to the bot's sync
+loop in batches and records when the bot's reply to each message arrives.
+
+Prints a JSON object with, per scenario:
+
+- throughput: messages handled per second and p50/p99 latency in milliseconds
+  from a message being available to /sync until the reply is received by /send
+- joins: invites accepted per second
+- memory: bytes allocated per joined room after the initial sync, measured
+  with tracemalloc in a separate run
+
+so numbers can be compared between commits.
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from aiohttp import web
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+import simplematrixbotlib as botlib  # noqa: E402
+
+USER_ID = "@bot:localhost"
+SENDER = "@alice:localhost"
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+class FakeHomeserver:
+    """
+    Just enough of the client-server API for a bot without encryption.
+
+    """
+
+    def __init__(self, rooms: int) -> None:
+        self.room_ids = [f"!room{i}:localhost" for i in range(rooms)]
+        self.next_batch = 0
+        self.pending: Dict[str, List[dict]] = {}
+        self.invites: List[str] = []
+        self.available_at: Dict[str, float] = {}
+        self.replied_at: Dict[str, float] = {}
+        self.joined_at: Dict[str, float] = {}
+        self.syncs = 0
+        self.on_first_sync = None
+        self._new_events = asyncio.Event()
+        self._progress = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+        self.url = ""
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/{path:.*}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self) -> None:
+        await self._runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        path = request.path
+        if path.endswith("/versions"):
+            return web.json_response({"versions": ["v1.1", "v1.11"]})
+        if path.endswith("/login"):
+            return web.json_response({
+                "user_id": USER_ID,
+                "access_token": "token",
+                "device_id": "BENCHMARK"
+            })
+        if path.endswith("/filter"):
+            return web.json_response({"filter_id": "1"})
+        if path.endswith("/sync"):
+            return await self.sync(request)
+        if "/send/" in path:
+            return await self.send(request)
+        if "/join/" in path or path.endswith("/join"):
+            room_id = request.match_info["path"].split("/")[-1]
+            self.joined_at[room_id] = time.perf_counter()
+            self._progress.set()
+            return web.json_response({"room_id": room_id})
+        return web.json_response({"errcode": "M_UNRECOGNIZED"}, status=404)
+
+    def push_messages(self, count: int, start: int = 0) -> None:
+        now = time.perf_counter()
+        for i in range(start, start + count):
+            room_id = self.room_ids[i % len(self.room_ids)]
+            event_id = f"$message{i}"
+            self.pending.setdefault(room_id, []).append({
+                "type": "m.room.message",
+                "event_id": event_id,
+                "sender": SENDER,
+                "origin_server_ts": int(time.time() * 1000),
+                "content": {
+                    "msgtype": "m.text",
+                    "body": f"ping {event_id}"
+                },
+            })
+            self.available_at[event_id] = now
+        self._new_events.set()
+
+    def push_invites(self, count: int) -> None:
+        self.invites.extend(f"!invite{i}:localhost" for i in range(count))
+        self._new_events.set()
+
+    async def wait_for(self, done, timeout: float = 120) -> None:
+        deadline = time.perf_counter() + timeout
+        while not done():
+            self._progress.clear()
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                raise TimeoutError("The bot did not answer in time")
+            try:
+                await asyncio.wait_for(self._progress.wait(), remaining)
+            except asyncio.TimeoutError:
+                pass
+
+    async def sync(self, request: web.Request) -> web.Response:
+        self.syncs += 1
+        self._progress.set()
+        since = request.query.get("since")
+        if since is None:
+            if self.on_first_sync is not None:
+                self.on_first_sync()
+            return web.json_response(self._initial_sync())
+
+        if not (self.pending or self.invites):
+            self._new_events.clear()
+            timeout = int(request.query.get("timeout", 0)) / 1000
+            try:
+                await asyncio.wait_for(self._new_events.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+        rooms: dict = {"join": {}, "invite": {}, "leave": {}}
+        pending, self.pending = self.pending, {}
+        for room_id, events in pending.items():
+            rooms["join"][room_id] = {
+                "timeline": {
+                    "events": events,
+                    "limited": False
+                }
+            }
+        invites, self.invites = self.invites, []
+        for room_id in invites:
+            rooms["invite"][room_id] = {
+                "invite_state": {
+                    "events": [{
+                        "type": "m.room.member",
+                        "state_key": USER_ID,
+                        "sender": SENDER,
+                        "content": {
+                            "membership": "invite"
+                        },
+                    }]
+                }
+            }
+        self.next_batch += 1
+        return web.json_response({
+            "next_batch": f"s{self.next_batch}",
+            "rooms": rooms
+        })
+
+    def _initial_sync(self) -> dict:
+        join = {}
+        for room_id in self.room_ids:
+            join[room_id] = {
+                "summary": {
+                    "m.joined_member_count": 2,
+                    "m.invited_member_count": 0
+                },
+                "state": {
+                    "events": [
+                        {
+                            "type": "m.room.create",
+                            "state_key": "",
+                            "event_id": f"$create{room_id}",
+                            "sender": SENDER,
+                            "origin_server_ts": 0,
+                            "content": {
+                                "creator": SENDER,
+                                "room_version": "10"
+                            },
+                        },
+                        {
+                            "type": "m.room.name",
+                            "state_key": "",
+                            "event_id": f"$name{room_id}",
+                            "sender": SENDER,
+                            "origin_server_ts": 0,
+                            "content": {
+                                "name": f"Benchmark room {room_id}"
+                            },
+                        },
+                    ] + [{
+                        "type": "m.room.member",
+                        "state_key": user_id,
+                        "event_id": f"$member{user_id}{room_id}",
+                        "sender": user_id,
+                        "origin_server_ts": 0,
+                        "content": {
+                            "membership": "join"
+                        },
+                    } for user_id in (SENDER, USER_ID)]
+                },
+                "timeline": {
+                    "events": [],
+                    "limited": False
+                },
+            }
+        self.next_batch += 1
+        return {
+            "next_batch": f"s{self.next_batch}",
+            "rooms": {
+                "join": join
+            }
+        }
+
+    async def send(self, request: web.Request) -> web.Response:
+        content = await request.json()
+        body = content.get("body", "")
+        if body.startswith("pong "):
+            self.replied_at[body[len("pong "):]] = time.perf_counter()
+            self._progress.set()
+        return web.json_response({"event_id": f"$reply{len(self.replied_at)}"})
+
+
+def make_bot(url: str, store: str, dispatch_workers: int) -> botlib.Bot:
+    config = botlib.Config()
+    config.encryption_enabled = False
+    config.emoji_verify = False
+    config.store_path = store
+    config.dispatch_workers = dispatch_workers
+    config.join_concurrency = 0
+    config.allowlist = []
+    bot = botlib.Bot(
+        botlib.Creds(url, "bot", "password", session_stored_file=None),
+        config)
+
+    @bot.listener.on_message_event
+    async def pong(room, message):
+        await bot.api.send_text_message(room.room_id,
+                                        f"pong {message.event_id}")
+
+    return bot
+
+
+async def run_bot(homeserver: FakeHomeserver, dispatch_workers: int,
+                  scenario) -> dict:
+    with tempfile.TemporaryDirectory() as store:
+        bot = make_bot(homeserver.url, store, dispatch_workers)
+        task = asyncio.ensure_future(bot.main())
+        try:
+            # the bot is in the sync loop once it asks for more than the initial sync
+            await homeserver.wait_for(lambda: homeserver.syncs > 1 or task.
+                                      done())
+            if task.done():
+                task.result()
+            return await scenario()
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await bot.api.close()
+
+
+async def throughput(rooms: int, messages: int, batch: int,
+                     dispatch_workers: int) -> dict:
+    homeserver = FakeHomeserver(rooms)
+    await homeserver.start()
+
+    async def scenario():
+        start = time.perf_counter()
+        for sent in range(0, messages, batch):
+            homeserver.push_messages(min(batch, messages - sent), sent)
+            await homeserver.wait_for(
+                lambda: len(homeserver.replied_at) >= sent + batch // 2 or len(
+                    homeserver.replied_at) >= messages)
+        await homeserver.wait_for(
+            lambda: len(homeserver.replied_at) >= messages)
+        elapsed = time.perf_counter() - start
+
+        latencies = [(homeserver.replied_at[event_id] - available) * 1000
+                     for event_id, available in
+                     homeserver.available_at.items()]
+        return {
+            "rooms": rooms,
+            "messages": messages,
+            "batch": batch,
+            "dispatch_workers": dispatch_workers,
+            "seconds": round(elapsed, 3),
+            "events_per_second": round(messages / elapsed, 1),
+            "latency_ms_p50": round(percentile(latencies, 0.5), 3),
+            "latency_ms_p99": round(percentile(latencies, 0.99), 3),
+            "latency_ms_mean": round(statistics.fmean(latencies), 3),
+        }
+
+    try:
+        return await run_bot(homeserver, dispatch_workers, scenario)
+    finally:
+        await homeserver.stop()
+
+
+async def joins(invites: int) -> dict:
+    homeserver = FakeHomeserver(1)
+    await homeserver.start()
+
+    async def scenario():
+        start = time.perf_counter()
+        homeserver.push_invites(invites)
+        await homeserver.wait_for(lambda: len(homeserver.joined_at) >= invites)
+        elapsed = time.perf_counter() - start
+        return {
+            "invites": invites,
+            "seconds": round(elapsed, 3),
+            "joins_per_second": round(invites / elapsed, 1),
+        }
+
+    try:
+        return await run_bot(homeserver, 0, scenario)
+    finally:
+        await homeserver.stop()
+
+
+async def memory(rooms: int) -> dict:
+    homeserver = FakeHomeserver(rooms)
+    await homeserver.start()
+    before = {}
+
+    def on_first_sync():
+        before["bytes"] = tracemalloc.get_traced_memory()[0]
+
+    homeserver.on_first_sync = on_first_sync
+
+    async def scenario():
+        after = tracemalloc.get_traced_memory()[0]
+        return {
+            "rooms": rooms,
+            "bytes_per_room": round((after - before["bytes"]) / rooms),
+        }
+
+    tracemalloc.start()
+    try:
+        return await run_bot(homeserver, 0, scenario)
+    finally:
+        tracemalloc.stop()
+        await homeserver.stop()
+
+
+def commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"],
+                              capture_output=True,
+                              text=True,
+                              check=True,
+                              cwd=os.path.dirname(
+                                  os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def main(args) -> dict:
+    return {
+        "commit": commit(),
+        "python": platform.python_version(),
+        "throughput":
+        await throughput(args.rooms, args.messages, args.batch,
+                         args.dispatch_workers),
+        "joins":
+        await joins(args.invites),
+        "memory":
+        await memory(args.memory_rooms),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rooms", type=int, default=100)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--batch",
+                        type=int,
+                        default=100,
+                        help="messages per sync response")
+    parser.add_argument("--dispatch-workers", type=int, default=0)
+    parser.add_argument("--invites", type=int, default=200)
+    parser.add_argument("--memory-rooms", type=int, default=1000)
+    parser.add_argument("--output", help="also write the results to FILE")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = asyncio.run(main(args))
+    text = json.dumps(results, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
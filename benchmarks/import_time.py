@@ -0,0 +1,82 @@
+"""
+Measures how long importing simplematrixbotlib takes, using `python -X importtime`.
+
+Usage: python benchmarks/import_time.py [--runs N] [--output FILE]
+
+Prints a JSON object mapping each import statement to the median cumulative
+import time in microseconds, and to the heavy dependencies it pulled in, so
+numbers can be compared release to release.
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+TARGETS = [
+    "import simplematrixbotlib",
+    "from simplematrixbotlib import MessageMatch",
+    "from simplematrixbotlib import Config",
+    "from simplematrixbotlib import Bot",
+]
+
+HEAVY_MODULES = ["nio", "aiohttp", "markdown", "cryptography", "toml"]
+
+
+def import_time(statement: str, startup_modules=frozenset()) -> dict:
+    """
+    Returns
+    -------
+    dict
+        The cumulative import time in microseconds of all top-level modules
+        imported by the statement except startup_modules, the names of all
+        imported modules, and which of HEAVY_MODULES were imported.
+    """
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", statement],
+                            capture_output=True,
+                            text=True,
+                            check=True)
+    total = 0
+    modules = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # nested imports are indented and already part of their parent's time
+        if not name.startswith("  ") and name.strip() not in startup_modules:
+            total += int(cumulative)
+        modules.add(name.strip())
+    return {
+        "us": total,
+        "modules": modules,
+        "heavy_modules": [module for module in HEAVY_MODULES if module in modules],
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    # interpreter startup imports modules like encodings and site, which are not ours
+    startup_modules = import_time("pass")["modules"]
+
+    results = {}
+    for statement in TARGETS:
+        runs = [import_time(statement, startup_modules) for _ in range(args.runs)]
+        results[statement] = {
+            "median_us": statistics.median(run["us"] for run in runs),
+            "heavy_modules": runs[0]["heavy_modules"],
+        }
+
+    report = json.dumps({"python": sys.version.split()[0], "imports": results}, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+    print(report)
+
+
+if __name__ == "__main__":
+    main()
@@ -34,7 +34,7 @@ except FileNotFoundError:
     bot.total_high_fives = 0
 
 
-@bot.listener.on_message_event
+@bot.listener.command("help", aliases=["?", "h"], prefix=PREFIX)
 async def bot_help(room, message):
     bot_help_message = f"""
     Help Message:
@@ -51,16 +51,14 @@ async def bot_help(room, message):
                 description: show amount of high fives
                 """
     match = botlib.MessageMatch(room, message, bot, PREFIX)
-    if match.is_not_from_this_bot() and match.prefix() and (
-            match.command("help") or match.command("?") or match.command("h")):
+    if match.is_not_from_this_bot():
         await bot.api.send_text_message(room.room_id, bot_help_message)
 
 
-@bot.listener.on_message_event
+@bot.listener.command("high_five", aliases=["hf"], prefix=PREFIX)
 async def high_five(room, message):
     match = botlib.MessageMatch(room, message, bot, PREFIX)
-    if match.is_not_from_this_bot() and match.prefix() and (
-            match.command("high_five") or match.command("hf")):
+    if match.is_not_from_this_bot():
 
         bot.total_high_fives += 1
         with open("high_fives.txt", "w") as f:
@@ -70,12 +68,10 @@ async def high_five(room, message):
             room.room_id, f"{message.sender} high-fived the bot!")
 
 
-@bot.listener.on_message_event
+@bot.listener.command("count", aliases=["how_many", "c"], prefix=PREFIX)
 async def high_five_count(room, message):
     match = botlib.MessageMatch(room, message, bot, PREFIX)
-    if match.is_not_from_this_bot() and match.prefix() and (
-            match.command("count") or match.command("how_many")
-            or match.command("c")):
+    if match.is_not_from_this_bot():
         await bot.api.send_text_message(
             room.room_id,
             f"The bot has been high-fived {str(bot.total_high_fives)} times!")
@@ -1,7 +1,46 @@
-from simplematrixbotlib.api import Api as Api
-from simplematrixbotlib.auth import Creds as Creds
-from simplematrixbotlib.bot import Bot as Bot
-from simplematrixbotlib.callbacks import Callbacks
-from simplematrixbotlib.match import MessageMatch as MessageMatch
-from simplematrixbotlib.listener import Listener as Listener
-from simplematrixbotlib.config import Config as Config
\ No newline at end of file
+import importlib
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from simplematrixbotlib.api import Api as Api
+    from simplematrixbotlib.auth import Creds as Creds
+    from simplematrixbotlib.bot import Bot as Bot
+    from simplematrixbotlib.callbacks import Callbacks
+    from simplematrixbotlib.match import MessageMatch as MessageMatch
+    from simplematrixbotlib.listener import Listener as Listener
+    from simplematrixbotlib.config import Config as Config
+    from simplematrixbotlib.group import BotGroup as BotGroup
+
+# submodules are imported on first access, as matrix-nio, aiohttp and
+# cryptography take a long time to import
+_exports = {
+    'Api': 'api',
+    'Creds': 'auth',
+    'Bot': 'bot',
+    'Callbacks': 'callbacks',
+    'MessageMatch': 'match',
+    'Listener': 'listener',
+    'Config': 'config',
+    'BotGroup': 'group',
+}
+
+__all__ = list(_exports)
+
+
+def __getattr__(name: str):
+    if name in _exports:
+        module = importlib.import_module(f'{__name__}.{_exports[name]}')
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    try:
+        return importlib.import_module(f'{__name__}.{name}')
+    except ModuleNotFoundError as e:
+        if e.name != f'{__name__}.{name}':
+            raise
+        raise AttributeError(
+            f"module '{__name__}' has no attribute '{name}'") from None
+
+
+def __dir__():
+    return sorted(set(globals()) | set(_exports))
@@ -1,31 +1,43 @@
+import asyncio
+import functools
 import json
+import time
 from nio import (AsyncClient, AsyncClientConfig)
+from nio.client.async_client import connect_wrapper, on_request_chunk_sent
 from nio.exceptions import OlmUnverifiedDeviceError
 import nio
-import markdown
 import aiohttp
-from typing import List, Tuple, Union
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple, Union
 import re
 import simplematrixbotlib
+from simplematrixbotlib.devicetrust import DeviceTrustCache
+from simplematrixbotlib.metrics import BotMetrics
+from simplematrixbotlib.ratelimit import RateLimitPause, SendQueue, concurrency_limit
+from simplematrixbotlib.renderer import MarkdownRenderer
 
 import logging
 
 logger = logging.getLogger(__name__)
 
 
-async def check_valid_homeserver(homeserver: str) -> bool:
+async def check_valid_homeserver(
+        homeserver: str,
+        session: Optional[aiohttp.ClientSession] = None) -> bool:
     if not (homeserver.startswith('http://')
             or homeserver.startswith('https://')):
         return False
 
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(
-                    f'{homeserver}/_matrix/client/versions') as response:
-                if response.status == 200:
-                    return True
-        except aiohttp.client_exceptions.ClientConnectorError:
-            return False
+    if session is None:
+        async with aiohttp.ClientSession() as session:
+            return await check_valid_homeserver(homeserver, session)
+
+    try:
+        async with session.get(
+                f'{homeserver}/_matrix/client/versions') as response:
+            if response.status == 200:
+                return True
+    except aiohttp.client_exceptions.ClientConnectorError:
+        return False
 
     return False
 
@@ -43,6 +55,63 @@ def split_mxid(mxid: str) -> Union[Tuple[str, str], Tuple[None, None]]:
     return match.group('localpart'), match.group('hostname')
 
 
+# attribute of aiohttp responses with the time.perf_counter() their headers were received at
+_RECEIVED_AT_ATTRIBUTE = '_simplematrixbotlib_received_at'
+
+
+async def _on_request_end(session, context, params) -> None:
+    setattr(params.response, _RECEIVED_AT_ATTRIBUTE, time.perf_counter())
+
+
+def received_at(response: Optional[aiohttp.ClientResponse]) -> Optional[float]:
+    """
+    Returns
+    -------
+    Optional[float]
+        The time.perf_counter() at which the headers of a response of a session made by
+        create_http_session were received, or None for other responses.
+    """
+    return getattr(response, _RECEIVED_AT_ATTRIBUTE, None)
+
+
+def create_http_session(connection_limit: int = 100) -> aiohttp.ClientSession:
+    """
+    Returns
+    -------
+    aiohttp.ClientSession
+        A session set up like the one nio creates for itself, with its default timeout,
+        upload progress tracing and small write buffers, but with a connection limit.
+        Responses record when they were received, see received_at.
+    """
+    trace = aiohttp.TraceConfig()
+    trace.on_request_chunk_sent.append(on_request_chunk_sent)
+    trace.on_request_end.append(_on_request_end)
+    session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(
+            total=AsyncClientConfig().request_timeout),
+        trace_configs=[trace],
+        connector=aiohttp.TCPConnector(limit=connection_limit))
+    session.connector.connect = functools.partial(connect_wrapper,
+                                                  session.connector)
+    return session
+
+
+class BroadcastReport(NamedTuple):
+    """
+    The result of Api.broadcast.
+
+    Attributes
+    ----------
+    sent : Dict[str, str]
+        The event id of the sent event, by room id.
+
+    failed : Dict[str, Union[nio.ErrorResponse, Exception]]
+        The error response or exception, by room id of the rooms the event could not be sent to.
+    """
+    sent: Dict[str, str]
+    failed: Dict[str, Any]
+
+
 class Api:
     """
     A class to interact with the matrix-nio library. Usually used by the Bot class, and sparingly by the bot developer.
@@ -71,6 +140,60 @@ class Api:
         self.creds = creds
         self.config = config
         self.async_client: AsyncClient = None
+        self._send_queue: SendQueue = None
+        self._markdown_renderer: MarkdownRenderer = None
+        self._http_session: aiohttp.ClientSession = None
+        self._shares_http_session = False
+        self._device_trust: DeviceTrustCache = None
+        self.metrics: BotMetrics = None
+
+    @property
+    def http_session(self) -> aiohttp.ClientSession:
+        """
+        Returns
+        -------
+        aiohttp.ClientSession
+            The keep-alive HTTP session shared by the nio client and all other requests to the homeserver.
+            Must be accessed from within the running event loop.
+        """
+        if self._http_session is None or self._http_session.closed:
+            self._http_session = create_http_session(
+                self.config.http_connection_limit)
+            self._shares_http_session = False
+        return self._http_session
+
+    @http_session.setter
+    def http_session(self, session: aiohttp.ClientSession) -> None:
+        # a session set from outside, e.g. by a BotGroup, is shared with other bots and not closed by close()
+        self._http_session = session
+        self._shares_http_session = True
+
+    @property
+    def device_trust(self) -> DeviceTrustCache:
+        """
+        Returns
+        -------
+        simplematrixbotlib.devicetrust.DeviceTrustCache
+            The devices already checked when blacklisting unverified devices.
+        """
+        if self._device_trust is None:
+            self._device_trust = DeviceTrustCache()
+        return self._device_trust
+
+    async def close(self):
+        """
+        Close the nio client and the HTTP session, unless the session is shared.
+
+        """
+        if self.async_client is not None:
+            if self._shares_http_session:
+                # nio closes its session on close
+                self.async_client.client_session = None
+            await self.async_client.close()
+        if self._http_session is not None:
+            if not self._shares_http_session:
+                await self._http_session.close()
+            self._http_session = None
 
     async def login(self):
         """
@@ -99,32 +222,32 @@ class Api:
                                         device_id=self.creds.device_id,
                                         store_path=self.config.store_path,
                                         config=client_config)
+        self.async_client.client_session = self.http_session
 
         if self.creds.access_token:
             self.async_client.access_token = self.creds.access_token
 
-            async with aiohttp.ClientSession() as session:
-                async with session.get(
-                        f'{self.creds.homeserver}/_matrix/client/r0/account/whoami',
-                        headers={
-                            'Authorization':
-                            f'Bearer {self.creds.access_token}'
-                        }) as response:
-                    if isinstance(response, nio.responses.LoginError):
-                        raise Exception(response)
-
-                    r = json.loads(
-                        (await
-                         response.text()).replace(":false,", ":\"false\","))
-                    # This assumes there was an error that needs to be communicated to the user. A key error happens in
-                    # the absence of an error code -> everything fine, we pass
-                    try:
-                        raise ConnectionError(f"{r['errcode']}: {r['error']}")
-                    except KeyError:
-                        pass
-                    device_id = r['device_id']
-                    self.async_client.user_id, user_id = (r['user_id'],
-                                                          r['user_id'])
+            async with self.http_session.get(
+                    f'{self.creds.homeserver}/_matrix/client/r0/account/whoami',
+                    headers={
+                        'Authorization':
+                        f'Bearer {self.creds.access_token}'
+                    }) as response:
+                if isinstance(response, nio.responses.LoginError):
+                    raise Exception(response)
+
+                r = json.loads(
+                    (await
+                     response.text()).replace(":false,", ":\"false\","))
+                # This assumes there was an error that needs to be communicated to the user. A key error happens in
+                # the absence of an error code -> everything fine, we pass
+                try:
+                    raise ConnectionError(f"{r['errcode']}: {r['error']}")
+                except KeyError:
+                    pass
+                device_id = r['device_id']
+                self.async_client.user_id, user_id = (r['user_id'],
+                                                      r['user_id'])
 
             if self.creds.username == split_mxid(user_id)[0]:
                 # save full MXID
@@ -209,10 +332,55 @@ class Api:
         ignore_unverified_devices : bool, optional
             Whether to ignore that devices are not verified and send the
             message to them regardless on a per-message basis.
+
+        Returns
+        -------
+        nio.responses.RoomSendResponse or nio.responses.RoomSendError
+            The homeserver's response. If send_queue is enabled in the config,
+            this waits until the event was accepted or rejected for a reason
+            other than rate limiting.
         """
 
+        if self.metrics is None:
+            return await self._send_room_queued(room_id, content,
+                                                message_type,
+                                                ignore_unverified_devices)
+
+        start = time.perf_counter()
+        try:
+            response = await self._send_room_queued(room_id, content,
+                                                    message_type,
+                                                    ignore_unverified_devices)
+        except Exception:
+            self.metrics.send_failures.inc()
+            raise
+        finally:
+            self.metrics.send_duration.observe(time.perf_counter() - start)
+        if not isinstance(response, nio.RoomSendResponse):
+            self.metrics.send_failures.inc()
+        return response
+
+    async def _send_room_queued(self, room_id: str, content: dict,
+                                message_type: str,
+                                ignore_unverified_devices: bool):
+        if self.config.send_queue:
+            if self._send_queue is None:
+                self._send_queue = SendQueue(self._room_send,
+                                             self.config.send_rate,
+                                             self.config.send_burst,
+                                             self.config.room_send_rate,
+                                             self.config.room_send_burst)
+            return await self._send_queue.submit(room_id, content,
+                                                 message_type,
+                                                 ignore_unverified_devices)
+
+        return await self._room_send(room_id, content, message_type,
+                                     ignore_unverified_devices)
+
+    async def _room_send(self, room_id: str, content: dict, message_type: str,
+                         ignore_unverified_devices: bool):
         try:
-            await self.async_client.room_send(
+            return await self.async_client.room_send(
                 room_id=room_id,
                 message_type=message_type,
                 content=content,
@@ -224,19 +392,14 @@ class Api:
                 "Set ignore_unverified_devices = True to allow sending to unverified devices."
             )
             logger.info("Automatically blacklisting the following devices:")
-            for user in self.async_client.rooms[room_id].users:
-                unverified: List[str] = list()
-                for device_id, device in self.async_client.olm.device_store[
-                        user].items():
-                    if not (self.async_client.olm.is_device_verified(device) or
-                            self.async_client.olm.is_device_blacklisted(device)
-                            ):
-                        self.async_client.olm.blacklist_device(device)
-                        unverified.append(device_id)
-                if len(unverified) > 0:
-                    logger.info(f"\tUser {user}: {', '.join(unverified)}")
-
-            await self.async_client.room_send(
+            # the device may have been checked while it was still trusted
+            self.device_trust.forget([e.device.user_id])
+            blacklisted = self.device_trust.blacklist_unverified(
+                self.async_client.olm, self.async_client.rooms[room_id].users)
+            for user, unverified in blacklisted.items():
+                logger.info(f"\tUser {user}: {', '.join(unverified)}")
+
+            return await self.async_client.room_send(
                 room_id=room_id,
                 message_type=message_type,
                 content=content,
@@ -274,7 +437,7 @@ class Api:
         if reply_to != "":
             content['m.relates_to'] = {"m.in_reply_to": {"event_id": reply_to}}
 
-        await self._send_room(room_id=room_id, content=content)
+        return await self._send_room(room_id=room_id, content=content)
 
     async def send_markdown_message(self,
                                     room_id: str,
@@ -306,13 +469,38 @@ class Api:
             "format":
             "org.matrix.custom.html",
             "formatted_body":
-            markdown.markdown(message, extensions=['fenced_code', 'nl2br'])
+            await self._render_markdown(message)
         }
 
         if reply_to:
             content['m.relates_to'] = {"m.in_reply_to": {"event_id": reply_to}}
 
-        await self._send_room(room_id=room_id, content=content)
+        return await self._send_room(room_id=room_id, content=content)
+
+    @property
+    def markdown_renderer(self) -> MarkdownRenderer:
+        """
+        Returns
+        -------
+        simplematrixbotlib.renderer.MarkdownRenderer
+            The renderer used by send_markdown_message, e.g. to inspect its cache_info().
+        """
+        if self._markdown_renderer is None:
+            self._markdown_renderer = MarkdownRenderer(
+                self.config.markdown_cache_size)
+        return self._markdown_renderer
+
+    async def _render_markdown(self, message: str) -> str:
+        renderer = self.markdown_renderer
+        threshold = self.config.markdown_executor_threshold
+        if threshold and len(message) > threshold:
+            html = renderer.lookup(message)
+            if html is not None:
+                return html
+            # rendering large messages takes long enough to hold up other rooms
+            return await asyncio.get_running_loop().run_in_executor(
+                None, renderer.render, message)
+        return renderer.render(message)
 
     async def send_reaction(self, room_id: str,
                             event: str | nio.events.room_events.Event,
@@ -337,15 +525,15 @@ class Api:
         else:
             event_id = event
 
-        await self._send_room(room_id=room_id,
-                              content={
-                                  "m.relates_to": {
-                                      "event_id": event_id,
-                                      "key": key,
-                                      "rel_type": "m.annotation"
-                                  }
-                              },
-                              message_type="m.reaction")
+        return await self._send_room(room_id=room_id,
+                                     content={
+                                         "m.relates_to": {
+                                             "event_id": event_id,
+                                             "key": key,
+                                             "rel_type": "m.annotation"
+                                         }
+                                     },
+                                     message_type="m.reaction")
 
     async def leave_room(self, room_id: str):
         """
@@ -462,7 +650,7 @@ class Api:
             The type of new message to send: m.text (default), m.notice, etc
         """
 
-        await self._send_room(
+        return await self._send_room(
             room_id, {
                 "msgtype": "m.text",
                 "body": "* " + message,
@@ -475,3 +663,114 @@ class Api:
                     "body": message
                 }
             })
+
+    async def broadcast(self,
+                        room_ids: Iterable[str],
+                        content: dict,
+                        message_type: str = "m.room.message",
+                        concurrency: int = 10,
+                        ignore_unverified_devices: bool = None
+                        ) -> BroadcastReport:
+        """
+        Send the same event to many Matrix rooms in parallel.
+
+        An error in one room does not stop the others. When the homeserver responds
+        with M_LIMIT_EXCEEDED, all sending is paused for the requested time and the
+        event is sent again. If send_queue is enabled in the config, its rate limits apply.
+
+        Parameters
+        -----------
+        room_ids : Iterable[str]
+            The room ids of the destinations of the event.
+
+        content : dict
+            The content block of the event to be sent.
+
+        message_type : str, optional
+            The type of event to send, default m.room.message.
+
+        concurrency : int, optional
+            How many events may be sent at the same time, default 10. 0 means no limit.
+
+        ignore_unverified_devices : bool, optional
+            Whether to ignore that devices are not verified and send the
+            message to them regardless.
+
+        Returns
+        -------
+        simplematrixbotlib.api.BroadcastReport
+            The event ids of the sent events and the errors of the failed rooms.
+        """
+        room_ids = list(dict.fromkeys(room_ids))
+        report = BroadcastReport({}, {})
+        limit = concurrency_limit(concurrency)
+        pause = RateLimitPause()
+
+        async def send(room_id):
+            while True:
+                await pause.wait()
+                response = await self._send_room(room_id, content,
+                                                 message_type,
+                                                 ignore_unverified_devices)
+                if not pause.check(response, f"broadcasting to {room_id}"):
+                    return response
+
+        async def run(room_id):
+            try:
+                async with limit:
+                    response = await send(room_id)
+            except Exception as e:
+                report.failed[room_id] = e
+                return
+            if isinstance(response, nio.RoomSendResponse):
+                report.sent[room_id] = response.event_id
+            else:
+                report.failed[room_id] = response
+
+        await self._prepare_encrypted_rooms(room_ids, concurrency)
+        await asyncio.gather(*(run(room_id) for room_id in room_ids))
+        return report
+
+    async def _prepare_encrypted_rooms(self, room_ids: List[str],
+                                       concurrency: int) -> None:
+        # room_send would query and claim keys separately for every room,
+        # do it once for all rooms instead
+        client = self.async_client
+        if not client.olm:
+            return
+
+        rooms = [
+            client.rooms[room_id] for room_id in room_ids
+            if room_id in client.rooms and client.rooms[room_id].encrypted
+        ]
+        limit = concurrency_limit(concurrency)
+
+        async def sync_members(room_id):
+            try:
+                async with limit:
+                    await client.joined_members(room_id)
+            except Exception:
+                logger.exception(f"Could not load the members of {room_id}")
+
+        await asyncio.gather(*(sync_members(room.room_id) for room in rooms
+                               if not room.members_synced))
+
+        try:
+            if client.should_query_keys:
+                await client.keys_query()
+
+            missing_sessions: Dict[str, List[str]] = {}
+            for room in rooms:
+                if client.olm.should_share_group_session(room.room_id):
+                    for user_id, device_ids in client.get_missing_sessions(
+                            room.room_id).items():
+                        missing_sessions.setdefault(user_id,
+                                                    []).extend(device_ids)
+            if missing_sessions:
+                await client.keys_claim({
+                    user_id: list(dict.fromkeys(device_ids))
+                    for user_id, device_ids in missing_sessions.items()
+                })
+        except Exception:
+            # room_send retries whatever is still missing for every room
+            logger.exception("Could not set up encryption for the broadcast")
@@ -1,3 +1,5 @@
+import asyncio
+
 from .crypto import Wrapper as fw
 
 import logging
@@ -31,7 +33,8 @@ class Creds:
                  login_token=None,
                  access_token=None,
                  session_stored_file='session.txt',
-                 device_name="Bot Client using Simple-Matrix-Bot-Lib"):
+                 device_name="Bot Client using Simple-Matrix-Bot-Lib",
+                 session_key=None):
         """
         Initializes the simplematrixbotlib.Creds class.
 
@@ -57,6 +60,9 @@ class Creds:
 
         device_name : str, optional
             Name display in the list of sessions. Useful to identified the device.
+
+        session_key : bytes, optional
+            Key to encrypt and decrypt the session_stored_file with, as previously returned by derive_key. Skips deriving the key from the password, login_token, or access_token, which is slow by design.
         """
 
         self.homeserver = homeserver
@@ -68,16 +74,33 @@ class Creds:
         self.device_name = device_name
         self.device_id = ""
 
-        if self.password:
-            self._key = fw.key_from_pass(self.password)
-        elif self.login_token:
-            self._key = fw.key_from_pass(self.login_token)
-        elif self.access_token:
-            self._key = fw.key_from_pass(self.access_token)
-        else:
+        # the key is derived on first use, as it takes 100000 PBKDF2 iterations
+        self._session_key = session_key
+        self._key_secret = self.password or self.login_token or self.access_token
+        if not self._key_secret:
             raise ValueError(
                 "password or login_token or access_token is required")
 
+    @property
+    def _key(self):
+        if self._session_key is None:
+            self._session_key = fw.key_from_pass(self._key_secret)
+        return self._session_key
+
+    async def derive_key(self):
+        """
+        Derives the key for encrypting the session_stored_file in a thread, without blocking the event loop.
+
+        Returns
+        -------
+        bytes
+            The key, which can be passed as session_key to skip deriving it the next time.
+        """
+        if self._session_key is None:
+            await asyncio.get_running_loop().run_in_executor(
+                None, lambda: self._key)
+        return self._session_key
+
     def session_read_file(self):
         """
         Reads and decrypts the device_id and access_token from file
@@ -1,9 +1,11 @@
 import asyncio
-from typing import Optional
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
 import simplematrixbotlib as botlib
-from nio import SyncResponse, AsyncClient
+from nio import SyncResponse, AsyncClient, UploadFilterResponse
 import cryptography
 import os
+import time
 
 import logging
 
@@ -11,6 +13,13 @@ logger = logging.getLogger(__name__)
 
 from simplematrixbotlib.auth import Creds
 from simplematrixbotlib.config import Config
+from simplematrixbotlib.metrics import BotMetrics
+from simplematrixbotlib.profiling import HandlerProfiler
+from simplematrixbotlib.ratelimit import concurrency_limit
+from simplematrixbotlib.replay import SyncRecorder
+from simplematrixbotlib.sharding import ShardPool
+from simplematrixbotlib.syncfilter import build_sync_filter
+from simplematrixbotlib.syncstate import SyncState
 
 
 class Bot:
@@ -48,11 +57,73 @@ class Bot:
         self.listener = botlib.Listener(self)
         self.async_client: AsyncClient = None
         self.callbacks: botlib.Callbacks = None
+        self._process_pool: ProcessPoolExecutor = None
+        self._startup_task: asyncio.Task = None
+        self._sync_state: SyncState = None
+        self.metrics: BotMetrics = None
+        self.profiler: HandlerProfiler = None
+        self._recorder: SyncRecorder = None
+        self._metrics_runner = None
+        self.shards: ShardPool = None
 
     async def setup(self):
         ...  # XDG_CONFIG_HOME
 
     async def main(self) -> None:
+        if self.config.shard_workers > 0:
+            # fork the workers first, forking after other threads were started can deadlock them
+            self.shards = ShardPool(self, self.config.shard_workers)
+            self.shards.start()
+        try:
+            if self.config.metrics_port:
+                await self._start_metrics()
+            await self._main()
+        finally:
+            # also if logging in or the initial sync failed, so the port is free for a restart
+            if self._metrics_runner is not None:
+                await self._metrics_runner.cleanup()
+                self._metrics_runner = None
+            if self.shards is not None:
+                await self.shards.stop()
+                self.shards = None
+
+    async def _reset(self) -> None:
+        """
+        Stops and drops what a previous run of main() left behind, so main() can be run again.
+        """
+        if self._startup_task is not None:
+            self._startup_task.cancel()
+            await asyncio.gather(self._startup_task, return_exceptions=True)
+            self._startup_task = None
+        callbacks, self.callbacks = self.callbacks, None
+        if callbacks is not None:
+            if callbacks.dispatcher is not None:
+                await callbacks.dispatcher.stop()
+            if callbacks.join_scheduler is not None:
+                await callbacks.join_scheduler.stop()
+            if callbacks.decryption_failures is not None:
+                await callbacks.decryption_failures.stop()
+        if self.api._send_queue is not None:
+            await self.api._send_queue.stop()
+            self.api._send_queue = None
+        if self._metrics_runner is not None:
+            await self._metrics_runner.cleanup()
+            self._metrics_runner = None
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+        self.metrics = self.api.metrics = None
+        self.profiler = None
+        self._sync_state = None
+
+    async def _main(self) -> None:
+        if self.config.profile_handlers:
+            self.profiler = HandlerProfiler(self.config.slow_handler_threshold,
+                                            self.config.profile_slowest)
+
+        if self.creds._session_stored_file:
+            await self.creds.derive_key()
+
         try:
             self.creds.session_read_file()
         except cryptography.fernet.InvalidToken:
@@ -61,18 +132,35 @@ class Bot:
             os.remove(self.creds._session_stored_file)
             self.creds.session_read_file()
 
-        if not (await botlib.api.check_valid_homeserver(self.creds.homeserver
-                                                        )):
+        if not (await botlib.api.check_valid_homeserver(
+                self.creds.homeserver, self.api.http_session)):
             raise ValueError("Invalid Homeserver")
 
         await self.api.login()
 
         self.async_client = self.api.async_client
 
-        resp = await self.async_client.sync(
-            timeout=self.config.timeout,
-            full_state=self.config.first_sync_full
-        )  #Ignore prior messages if full_state=False (default)
+        sync_filter = await self._upload_sync_filter()
+
+        resp = None
+        if self.config.warm_restart:
+            self._sync_state = SyncState.for_client(self.async_client,
+                                                    self.config.store_path)
+            resp = await self._resume_sync(sync_filter)
+
+        if resp is None:
+            resp = await self.async_client.sync(
+                timeout=self.config.timeout,
+                sync_filter=sync_filter,
+                full_state=self.config.first_sync_full
+            )  #Ignore prior messages if full_state=False (default)
+
+        if self.config.record_sync_path:
+            self._recorder = SyncRecorder(self.config.record_sync_path,
+                                          self.config.record_sync_redact)
+            self._recorder.open(self.async_client)
+            if isinstance(resp, SyncResponse):
+                await self._recorder.record(resp, initial=True)
 
         if isinstance(resp, SyncResponse):
             logger.info(
@@ -93,21 +181,185 @@ class Bot:
             _, hs = botlib.api.split_mxid(self.api.async_client.user_id)
             self.config.allowlist = set([f"(.+):{hs}"])
 
+        if self.shards is not None:
+            await self.shards.connect(self.async_client)
+
         self.callbacks = botlib.Callbacks(self.async_client, self)
         await self.callbacks.setup_callbacks()
 
-        for action in self.listener._startup_registry:
-            for room_id in self.async_client.rooms:
-                await action(room_id)
+        if self.config.startup_in_background:
+            self._startup_task = asyncio.ensure_future(
+                self._run_startup_actions())
+        else:
+            await self._run_startup_actions()
+
+        if self._sync_state is not None:
+            self.async_client.add_response_callback(
+                self._sync_state.sync_callback, SyncResponse)
+        if self._recorder is not None:
+            self.async_client.add_response_callback(
+                self._recorder.sync_callback, SyncResponse)
+        if self.metrics is not None:
+            # last, so the time spent in the other callbacks is included
+            self.async_client.add_response_callback(self._observe_sync,
+                                                    SyncResponse)
+
+        try:
+            # continue from the initial sync instead of requesting all state again
+            await self.async_client.sync_forever(
+                timeout=self.config.sync_timeout,
+                sync_filter=sync_filter,
+                since=self.async_client.next_batch,
+                full_state=self.config.sync_full_state,
+                set_presence=self.config._set_presence)
+        finally:
+            if self._sync_state is not None:
+                await self._sync_state.close()
+            if self._recorder is not None:
+                self._recorder.close()
+            if self.callbacks is not None and self.callbacks.dedup is not None:
+                await self.callbacks.dedup.close()
+            if self.api._send_queue is not None:
+                await self.api._send_queue.stop()
+                self.api._send_queue = None
+            if self.callbacks is not None and self.callbacks.dispatcher is not None:
+                await self.callbacks.dispatcher.stop()
+
+    async def _start_metrics(self) -> None:
+        self.metrics = self.api.metrics = BotMetrics()
+
+        def callbacks_attribute(name):
+            return getattr(self.callbacks, name, None)
+
+        self.metrics.gauge(
+            'dispatch_queue_depth', 'Events waiting for a dispatch worker.',
+            lambda: (dispatcher := callbacks_attribute('dispatcher')) and
+            dispatcher.depth())
+        self.metrics.gauge(
+            'send_queue_depth', 'Events waiting in the send queue.',
+            lambda: self.api._send_queue and self.api._send_queue.depth())
+        self.metrics.gauge(
+            'pending_joins', 'Rooms being joined after an invite.',
+            lambda: (scheduler := callbacks_attribute('join_scheduler')) and
+            scheduler.pending())
+        self.metrics.gauge(
+            'pending_decryption_failures',
+            'Undecryptable events waiting to be reported.',
+            lambda: (failures := callbacks_attribute('decryption_failures'))
+            and failures.pending())
+        self.metrics.gauge(
+            'shard_events_pending',
+            'Events passed to shard workers and not handled yet.',
+            lambda: self.shards and self.shards.depth())
+        self._metrics_runner = await self.metrics.start_server(
+            self.config.metrics_host, self.config.metrics_port)
+
+    async def _observe_sync(self, response: SyncResponse) -> None:
+        received = botlib.api.received_at(response.transport_response)
+        if received is not None:
+            self.metrics.sync_duration.observe(time.perf_counter() - received)
+
+    async def _resume_sync(self, sync_filter: Optional[str]) -> Optional[SyncResponse]:
+        if not self._sync_state.load():
+            return None
+
+        logger.info(
+            f"Resuming from saved sync state with {len(self.async_client.rooms)} rooms"
+        )
+        resp = await self.async_client.sync(timeout=0,
+                                            sync_filter=sync_filter)
+        if isinstance(resp, SyncResponse):
+            return resp
 
-        await self.async_client.sync_forever(
-            timeout=3000,
-            full_state=True,
-            set_presence=self.config._set_presence)
+        logger.warning(
+            f"Could not resume from saved sync state, doing an initial sync: {resp}"
+        )
+        self.async_client.rooms.clear()
+        self.async_client.encrypted_rooms.clear()
+        self.async_client.next_batch = ""
+        self.async_client.loaded_sync_token = None
+        return None
+
+    async def _upload_sync_filter(self) -> Optional[str]:
+        if not self.config.sync_filter:
+            return None
+
+        resp = await self.async_client.upload_filter(
+            **build_sync_filter(self))
+        if isinstance(resp, UploadFilterResponse):
+            return resp.filter_id
+
+        logger.warning(
+            f"Could not upload sync filter, syncing without it: {resp}")
+        return None
+
+    async def _run_startup_actions(self) -> None:
+        if not self.listener._startup_registry:
+            return
+
+        limit = concurrency_limit(self.config.startup_concurrency)
+
+        if self.profiler is not None:
+            profiler = self.profiler
+
+            def call(action, room_id):
+                return profiler.run(action, room_id, room_id=room_id)
+        else:
+
+            def call(action, room_id):
+                return action(room_id)
+
+        async def run(action, room_id):
+            try:
+                async with limit:
+                    await call(action, room_id)
+            except Exception:
+                logger.exception(
+                    f"Error in startup action {getattr(action, '__name__', action)} for {room_id}"
+                )
+
+        await asyncio.gather(*(run(action, room_id)
+                               for action in self.listener._startup_registry
+                               for room_id in list(self.async_client.rooms)))
+
+    async def run_in_executor(self,
+                              func: Callable[..., Any],
+                              *args,
+                              executor: str = "thread") -> Any:
+        """
+        Runs a function outside of the event loop, so CPU-bound work does not block other handlers.
+
+        Parameters
+        ----------
+        func : Callable[..., Any]
+            The function to run with args.
+
+        executor : str, optional
+            "thread" (default) to run it in the event loop's thread pool,
+            "process" to run it in a process pool. Functions run in a process pool
+            and their arguments and return value must be picklable.
+
+        Returns
+        -------
+        Any
+            The return value of func.
+        """
+        loop = asyncio.get_running_loop()
+        if executor == "process":
+            if self._process_pool is None:
+                self._process_pool = ProcessPoolExecutor(
+                    self.config.process_workers or None)
+            return await loop.run_in_executor(self._process_pool, func, *args)
+        return await loop.run_in_executor(None, func, *args)
 
     def run(self) -> None:
         """
         Runs the bot.
 
         """
-        asyncio.run(self.main())
+        try:
+            asyncio.run(self.main())
+        finally:
+            if self._process_pool is not None:
+                self._process_pool.shutdown(cancel_futures=True)
+                self._process_pool = None
@@ -1,8 +1,15 @@
+import time
 import nio.events.room_events
 import nio.events.to_device
-from nio import InviteMemberEvent
+from nio import InviteMemberEvent, KeysQueryResponse, SyncResponse
 from nio import MegolmEvent, KeyVerificationStart, KeyVerificationCancel, KeyVerificationKey, KeyVerificationMac, ToDeviceError, KeyVerificationEvent, LocalProtocolError
 
+from simplematrixbotlib.decryption import DecryptionFailures
+from simplematrixbotlib.dedup import EventDeduplicator
+from simplematrixbotlib.dispatch import Dispatcher
+from simplematrixbotlib.joins import JoinScheduler
+from simplematrixbotlib.metrics import handler_name
+
 import logging
 
 logger = logging.getLogger(__name__)
@@ -19,6 +26,11 @@ class Callbacks:
     def __init__(self, async_client, bot):
         self.async_client = async_client
         self.bot = bot
+        self.dispatcher: Dispatcher = None
+        self.join_scheduler: JoinScheduler = None
+        self.decryption_failures: DecryptionFailures = None
+        self.dedup: EventDeduplicator = None
+        self._handlers = {}
 
     async def setup_callbacks(self):
         """
@@ -32,49 +44,166 @@ class Callbacks:
         self.async_client.add_event_callback(self.decryption_failure,
                                              MegolmEvent)
 
+        if self.bot.config.encryption_enabled:
+            self.async_client.add_response_callback(
+                self.bot.api.device_trust.response_callback,
+                (SyncResponse, KeysQueryResponse))
+
         if self.bot.config.emoji_verify:
             self.async_client.add_to_device_callback(self.emoji_verification,
                                                      (KeyVerificationEvent, ))
 
+        # with shard_workers, each worker has its own dispatcher
+        if self.bot.config.dispatch_workers > 0 and self.bot.shards is None:
+            self.dispatcher = Dispatcher(self.bot.config.dispatch_workers,
+                                         self.bot.config.dispatch_queue_size)
+            self.dispatcher.start()
+
+        config = self.bot.config
+        if config.event_dedup_size > 0:
+            if config.event_dedup_persist:
+                self.dedup = EventDeduplicator.for_client(
+                    self.async_client,
+                    config.store_path,
+                    size=config.event_dedup_size)
+                self.dedup.load()
+                self.async_client.add_response_callback(
+                    self.dedup.sync_callback, SyncResponse)
+            else:
+                self.dedup = EventDeduplicator(config.event_dedup_size)
+
+        event_types = []
         for event_listener in self.bot.listener._registry:
             if issubclass(event_listener[1],
                           nio.events.to_device.ToDeviceEvent):
                 self.async_client.add_to_device_callback(
                     event_listener[0], event_listener[1])
+            elif event_listener[1] not in event_types:
+                event_types.append(event_listener[1])
+
+        # a single callback, so each room event is queued once for all of its handlers
+        if event_types:
+            self.async_client.add_event_callback(self.event_callback,
+                                                 tuple(event_types))
+
+    def _get_handlers(self, event):
+        event_type = type(event)
+        try:
+            return self._handlers[event_type]
+        except KeyError:
+            handlers = self._handlers[event_type] = [
+                handler for handler, handled_type in self.bot.listener._registry
+                if not issubclass(handled_type,
+                                  nio.events.to_device.ToDeviceEvent)
+                and isinstance(event, handled_type)
+            ]
+            return handlers
+
+    async def event_callback(self, room, event):
+        """
+        Callback for passing room events to the handlers registered with the listener.
+        Handlers run in the sync loop, on the dispatcher's workers if dispatch_workers is set,
+        or in the worker process owning the room if shard_workers is set.
+
+        Parameters
+        ----------
+        room : nio.rooms.MatrixRoom
+        event : nio.events.room_events.Event
+
+        """
+        # recorded before handling, so each event is handled at most once even if a handler fails
+        if self.dedup is not None:
+            event_id = getattr(event, 'event_id', None)
+            if event_id is not None and self.dedup.seen(event_id):
+                logger.debug(f"Skipping already handled event {event_id}")
+                return
+
+        if self.bot.metrics is not None:
+            self.bot.metrics.events_received.inc(type(event).__name__)
+
+        if self.bot.shards is not None:
+            await self.bot.shards.submit(room, event)
+        elif self.dispatcher is None:
+            await self._run_handlers(room, event)
+        else:
+            await self.dispatcher.submit(room.room_id, self._run_handlers,
+                                         room, event)
+
+    async def _run_handlers(self, room, event):
+        if self.bot.metrics is None and self.bot.profiler is None:
+            for handler in self._get_handlers(event):
+                await handler(room, event)
+            return
+
+        listener = self.bot.listener
+        for handler in self._get_handlers(event):
+            if handler == listener._dispatch_command:
+                # each command's handlers are profiled and timed on their own
+                for command_handler in listener._command_handlers(
+                        room, event):
+                    await self._run_handler(command_handler, room, event)
             else:
-                self.async_client.add_event_callback(event_listener[0],
-                                                     event_listener[1])
+                await self._run_handler(handler, room, event)
 
-    async def invite_callback(self, room, event, tries=1):
+    async def _run_handler(self, handler, room, event):
+        """
+        Runs a handler, through the profiler if profiling is enabled, and records its duration if metrics are enabled.
         """
-        Callback for handling invites.
+        metrics = self.bot.metrics
+        profiler = self.bot.profiler
+        if profiler is None:
+            call = handler(room, event)
+        else:
+            call = profiler.run(handler,
+                                room,
+                                event,
+                                room_id=room.room_id,
+                                event_id=getattr(event, 'event_id', None))
+        if metrics is None:
+            await call
+            return
+
+        name = handler_name(handler)
+        start = time.perf_counter()
+        try:
+            await call
+        except Exception:
+            self._observe_handler(name, time.perf_counter() - start, True)
+            raise
+        self._observe_handler(name, time.perf_counter() - start, False)
+
+    def _observe_handler(self, name: str, duration: float,
+                         failed: bool) -> None:
+        metrics = self.bot.metrics
+        metrics.handler_calls.inc(name)
+        if failed:
+            metrics.handler_errors.inc(name)
+        metrics.handler_duration.observe(duration, name)
+
+    async def invite_callback(self, room, event):
+        """
+        Callback for handling invites. Joins the room in the background,
+        retrying with increasing delays if joining fails.
 
         Parameters
         ----------
         room : nio.rooms.MatrixRoom
         event : nio.events.room_events.InviteMemberEvent
-        tries : int, optional
-            Amount of times that this function has been called in a row for the same exact event.
 
         """
         if not event.membership == "invite":
             return
 
-        try:
-            await self.async_client.join(room.room_id)
-            logger.info(f"Joined {room.room_id}")
-        except Exception as e:
-            logger.warning(f"Error joining {room.room_id}: {e}")
-            tries += 1
-            if not tries == 3:
-                logger.debug("Trying again...")
-                await self.invite_callback(room, event, tries)
-            else:
-                logger.error(f"Failed to join {room.room_id} after 3 tries")
+        if self.join_scheduler is None:
+            self.join_scheduler = JoinScheduler(
+                self.async_client.join, self.bot.config.join_concurrency)
+        self.join_scheduler.schedule(room.room_id)
 
     async def decryption_failure(self, room, event):
         """
         Callback for handling decryption errors.
+        Failures are reported and the missing room keys requested once per
+        decryption_failure_window for every room and session.
 
         Parameters
         ----------
@@ -85,15 +214,28 @@ class Callbacks:
         if not isinstance(event, MegolmEvent):
             return
 
+        if self.decryption_failures is None:
+            self.decryption_failures = DecryptionFailures(
+                self._report_decryption_failures,
+                self.async_client.request_room_key,
+                self.bot.config.decryption_failure_window)
+        self.decryption_failures.add(room.room_id, event)
+
+    async def _report_decryption_failures(self, room_id, session_id, events):
+        senders = ', '.join(sorted(set(event.sender for event in events)))
         logger.warning(
-            f"\nFailed to decrypt message: {event.event_id} from {event.sender} in {room.room_id}. "
+            f"\nFailed to decrypt {len(events)} message(s) of session {session_id} from {senders} in {room_id}, "
+            f"first: {events[0].event_id}. "
             "If this error persists despite verification, reset the crypto session by deleting "
             f"{self.bot.config.store_path} and {self.bot.creds._session_stored_file}. "
             "You will have to verify any verified devices anew.\n")
         if self.bot.config._decrypt_failure_msg:
+            if len(events) == 1:
+                failed = "Failed to decrypt your message. "
+            else:
+                failed = f"Failed to decrypt {len(events)} messages. "
             await self.bot.api.send_text_message(
-                room.room_id, "Failed to decrypt your message. "
+                room_id, failed +
                 "Make sure encryption is enabled in my config and "
                 "either enable sending messages to unverified devices or verify me if possible.",
                 msgtype='m.notice')
-
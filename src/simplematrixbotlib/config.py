@@ -1,9 +1,8 @@
+from collections import OrderedDict
 from dataclasses import dataclass, field, fields, asdict
 import os
-import toml
 import re
-from typing import Set, Union
-from nio.crypto import ENCRYPTION_ENABLED
+from typing import Callable, List, Optional, Set, Union
 from pathlib import Path
 
 import logging
@@ -37,6 +36,12 @@ def _strip_leading_underscore(tmp: str) -> str:
     return tmp[1:] if tmp[0] == '_' else tmp
 
 
+def _encryption_enabled_default() -> bool:
+    # imported here, as importing matrix-nio takes long
+    from nio.crypto import ENCRYPTION_ENABLED
+    return ENCRYPTION_ENABLED
+
+
 def _check_set_regex(value: Set[str]) -> Union[Set[re.Pattern[str]], None]:
     new_list = set()
     for v in value:
@@ -51,6 +56,58 @@ def _check_set_regex(value: Set[str]) -> Union[Set[re.Pattern[str]], None]:
     return new_list
 
 
+def _combine_regex(
+        value: Set[re.Pattern[str]]) -> Optional[Callable[[str], object]]:
+    """
+    Returns a fullmatch function matching any of the given regular expressions, or None for an empty set.
+    """
+    if not value:
+        return None
+    patterns = sorted(value, key=lambda regex: regex.pattern)
+    # numbered or named backreferences would refer to the wrong group once combined
+    if not any(re.search(r'\\\d|\(\?P=', regex.pattern) for regex in patterns):
+        try:
+            return re.compile('|'.join(f'(?:{regex.pattern})'
+                                       for regex in patterns)).fullmatch
+        except re.error:
+            pass
+    return lambda sender: any(regex.fullmatch(sender) for regex in patterns)
+
+
+class _AccessList:
+    """
+    Allowlist and blocklist compiled into a single regular expression each,
+    with an LRU cache of the decision per sender.
+    """
+
+    __slots__ = ('_allowed', '_blocked', '_cache')
+
+    cache_size = 4096
+
+    def __init__(self, allowlist: Set[re.Pattern[str]],
+                 blocklist: Set[re.Pattern[str]]) -> None:
+        self._allowed = _combine_regex(allowlist)
+        self._blocked = _combine_regex(blocklist)
+        self._cache: OrderedDict[str, bool] = OrderedDict()
+
+    def is_allowed(self, sender: str) -> bool:
+        try:
+            self._cache.move_to_end(sender)
+            return self._cache[sender]
+        except KeyError:
+            pass
+
+        # if there is no explicit allowlist, default to allow
+        is_allowed = self._allowed is None or bool(self._allowed(sender))
+        if is_allowed and self._blocked is not None and self._blocked(sender):
+            is_allowed = False
+
+        self._cache[sender] = is_allowed
+        if len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return is_allowed
+
+
 @dataclass
 class Config:
     """
@@ -61,7 +118,8 @@ class Config:
     send_decryption_error_message_in_room = True
     _timeout: int = 65536
     _join_on_invite: bool = True
-    _encryption_enabled: bool = ENCRYPTION_ENABLED
+    _encryption_enabled: bool = field(
+        default_factory=_encryption_enabled_default)
     _emoji_verify: bool = False  # So users who enable it are aware of required interactivity
     _ignore_unverified_devices: bool = True  # True by default in Element
     _store_path: Path = None
@@ -71,7 +129,38 @@ class Config:
     _decrypt_failure_msg = True
     _set_presence = "online"
     _first_sync_full: bool = False
+    _send_queue: bool = False
+    _send_rate: float = 0.2
+    _send_burst: int = 10
+    _room_send_rate: float = 1.0
+    _room_send_burst: int = 5
+    _dispatch_workers: int = 0
+    _dispatch_queue_size: int = 1000
+    _process_workers: int = 0
+    _markdown_executor_threshold: int = 4096
+    _markdown_cache_size: int = 256
+    _startup_concurrency: int = 10
+    _startup_in_background: bool = False
+    _http_connection_limit: int = 100
+    _sync_timeout: int = 30000
+    _sync_full_state: bool = False
+    _sync_filter: bool = True
+    _warm_restart: bool = False
+    _join_concurrency: int = 5
+    _decryption_failure_window: float = 60.0
+    _metrics_port: int = 0
+    _metrics_host: str = "127.0.0.1"
+    _profile_handlers: bool = False
+    _slow_handler_threshold: float = 1.0
+    _profile_slowest: int = 0
+    _record_sync_path: Path = None
+    _record_sync_redact: List[str] = field(
+        default_factory=lambda: ["body", "formatted_body"])
+    _shard_workers: int = 0
+    _event_dedup_size: int = 10000
+    _event_dedup_persist: bool = False
     config_dir: Path = None
+    _access_list = None  # not a field, built on demand from allowlist and blocklist
 
     def setup_config_dir(self):
         if self.config_dir is None:
@@ -91,11 +180,13 @@ class Config:
             setattr(self, key, value)
 
     def load_toml(self, file_path: str) -> None:
+        import toml
         with open(file_path, 'r') as file:
             config_dict: dict = toml.load(file)['simplematrixbotlib']['config']
             self._load_config_dict(config_dict)
 
     def save_toml(self, file_path: str) -> None:
+        import toml
         tmp = asdict(self, dict_factory=_config_dict_factory)
         with open(file_path, 'w') as file:
             toml.dump(tmp, file)
@@ -212,6 +303,7 @@ class Config:
         if checked is None:
             return
         self._allowlist = checked
+        self._access_list = None
 
     def add_allowlist(self, value: Set[str]) -> None:
         """
@@ -224,6 +316,7 @@ class Config:
         if checked is None:
             return
         self._allowlist = self._allowlist.union(checked)
+        self._access_list = None
 
     def remove_allowlist(self, value: Set[str]) -> None:
         """
@@ -236,6 +329,7 @@ class Config:
         if checked is None:
             return
         self._allowlist = self._allowlist - checked
+        self._access_list = None
 
     @property
     def blocklist(self) -> Set[re.Pattern[str]]:
@@ -254,6 +348,7 @@ class Config:
         if checked is None:
             return
         self._blocklist = checked
+        self._access_list = None
 
     def add_blocklist(self, value: Set[str]) -> None:
         """
@@ -266,6 +361,7 @@ class Config:
         if checked is None:
             return
         self._blocklist = self._blocklist.union(checked)
+        self._access_list = None
 
     def remove_blocklist(self, value: Set[str]) -> None:
         """
@@ -278,6 +374,23 @@ class Config:
         if checked is None:
             return
         self._blocklist = self._blocklist - checked
+        self._access_list = None
+
+    def _is_allowed_user(self, sender: str) -> bool:
+        """
+        Parameters
+        ----------
+        sender : str
+            The Matrix ID to check against the allowlist and blocklist.
+
+        Returns
+        -------
+        boolean
+            Returns True if the Matrix ID is allowed by the allowlist and not blocked by the blocklist.
+        """
+        if self._access_list is None:
+            self._access_list = _AccessList(self._allowlist, self._blocklist)
+        return self._access_list.is_allowed(sender)
 
     @property
     def first_sync_full(self) -> bool:
@@ -293,3 +406,455 @@ class Config:
     @first_sync_full.setter
     def first_sync_full(self, value: bool) -> None:
         self._first_sync_full = value
+
+    @property
+    def send_queue(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            If True, outgoing events are queued and sent according to send_rate and room_send_rate.
+            Events rejected by the homeserver due to rate limiting are retried after the requested time.
+            Default: False
+        """
+        return self._send_queue
+
+    @send_queue.setter
+    def send_queue(self, value: bool) -> None:
+        self._send_queue = value
+
+    @property
+    def send_rate(self) -> float:
+        """
+        Returns
+        -------
+        float
+            Events per second the send queue sends in total. 0 disables the limit.
+            Default: 0.2, matching the default message rate limit of Synapse
+        """
+        return self._send_rate
+
+    @send_rate.setter
+    def send_rate(self, value: float) -> None:
+        self._send_rate = value
+
+    @property
+    def send_burst(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Events the send queue may send at once before send_rate applies.
+            Default: 10
+        """
+        return self._send_burst
+
+    @send_burst.setter
+    def send_burst(self, value: int) -> None:
+        self._send_burst = value
+
+    @property
+    def room_send_rate(self) -> float:
+        """
+        Returns
+        -------
+        float
+            Events per second the send queue sends to a single room. 0 disables the limit.
+            Default: 1.0
+        """
+        return self._room_send_rate
+
+    @room_send_rate.setter
+    def room_send_rate(self, value: float) -> None:
+        self._room_send_rate = value
+
+    @property
+    def room_send_burst(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Events the send queue may send to a single room at once before room_send_rate applies.
+            Default: 5
+        """
+        return self._room_send_burst
+
+    @room_send_burst.setter
+    def room_send_burst(self, value: int) -> None:
+        self._room_send_burst = value
+
+    @property
+    def dispatch_workers(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of events that listener handlers may handle at the same time, outside of the sync loop.
+            Events of one room are always handled in order. 0 runs handlers inside the sync loop.
+            Default: 0
+        """
+        return self._dispatch_workers
+
+    @dispatch_workers.setter
+    def dispatch_workers(self, value: int) -> None:
+        self._dispatch_workers = value
+
+    @property
+    def dispatch_queue_size(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Maximum number of events waiting for a dispatch worker before the sync loop waits. 0 means unbounded.
+            Default: 1000
+        """
+        return self._dispatch_queue_size
+
+    @dispatch_queue_size.setter
+    def dispatch_queue_size(self, value: int) -> None:
+        self._dispatch_queue_size = value
+
+    @property
+    def process_workers(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of processes for handlers registered with executor="process". 0 uses the number of CPUs.
+            Default: 0
+        """
+        return self._process_workers
+
+    @process_workers.setter
+    def process_workers(self, value: int) -> None:
+        self._process_workers = value
+
+    @property
+    def markdown_executor_threshold(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Markdown messages longer than this many characters are rendered in a thread instead of the event loop.
+            0 always renders in the event loop.
+            Default: 4096
+        """
+        return self._markdown_executor_threshold
+
+    @markdown_executor_threshold.setter
+    def markdown_executor_threshold(self, value: int) -> None:
+        self._markdown_executor_threshold = value
+
+    @property
+    def markdown_cache_size(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of rendered Markdown messages to keep, so sending the same message again skips rendering.
+            0 disables caching.
+            Default: 256
+        """
+        return self._markdown_cache_size
+
+    @markdown_cache_size.setter
+    def markdown_cache_size(self, value: int) -> None:
+        self._markdown_cache_size = value
+
+    @property
+    def startup_concurrency(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of on_startup actions that may run at the same time, e.g. for different rooms. 0 means unlimited.
+            Default: 10
+        """
+        return self._startup_concurrency
+
+    @startup_concurrency.setter
+    def startup_concurrency(self, value: int) -> None:
+        self._startup_concurrency = value
+
+    @property
+    def startup_in_background(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            If True, the sync loop starts while on_startup actions are still running.
+            Default: False
+        """
+        return self._startup_in_background
+
+    @startup_in_background.setter
+    def startup_in_background(self, value: bool) -> None:
+        self._startup_in_background = value
+
+    @property
+    def http_connection_limit(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Maximum number of simultaneous connections of the HTTP session shared by all requests to the homeserver.
+            0 means unlimited.
+            Default: 100
+        """
+        return self._http_connection_limit
+
+    @http_connection_limit.setter
+    def http_connection_limit(self, value: int) -> None:
+        self._http_connection_limit = value
+
+    @property
+    def sync_timeout(self) -> int:
+        """
+        Returns
+        -------
+        int
+            How long the homeserver may wait for new events before answering a sync request (in milliseconds).
+            New events are always delivered immediately, a longer timeout only means fewer requests while idle.
+            Default: 30000
+        """
+        return self._sync_timeout
+
+    @sync_timeout.setter
+    def sync_timeout(self, value: int) -> None:
+        self._sync_timeout = value
+
+    @property
+    def sync_full_state(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            If True, the first sync of the sync loop after startup requests the full state of all rooms again.
+            Following syncs are always incremental.
+            Default: False
+        """
+        return self._sync_full_state
+
+    @sync_full_state.setter
+    def sync_full_state(self, value: bool) -> None:
+        self._sync_full_state = value
+
+    @property
+    def sync_filter(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            If True, syncs only request the events handled by the bot's listeners.
+            Presence, typing notifications, read receipts and account data are never requested,
+            and room members are loaded lazily.
+            Default: True
+        """
+        return self._sync_filter
+
+    @sync_filter.setter
+    def sync_filter(self, value: bool) -> None:
+        self._sync_filter = value
+
+    @property
+    def warm_restart(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            If True, the sync token and the joined rooms are saved next to store_path,
+            so after a restart the bot continues with an incremental sync instead of an initial sync.
+            Default: False
+        """
+        return self._warm_restart
+
+    @warm_restart.setter
+    def warm_restart(self, value: bool) -> None:
+        self._warm_restart = value
+
+    @property
+    def join_concurrency(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of rooms that may be joined at the same time after being invited. 0 means unlimited.
+            Default: 5
+        """
+        return self._join_concurrency
+
+    @join_concurrency.setter
+    def join_concurrency(self, value: int) -> None:
+        self._join_concurrency = value
+
+    @property
+    def decryption_failure_window(self) -> float:
+        """
+        Returns
+        -------
+        float
+            Number of seconds messages that could not be decrypted are collected for,
+            before they are reported with one notice per room and session and their room keys are requested.
+            Default: 60.0
+        """
+        return self._decryption_failure_window
+
+    @decryption_failure_window.setter
+    def decryption_failure_window(self, value: float) -> None:
+        self._decryption_failure_window = value
+
+    @property
+    def metrics_port(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Port to serve metrics in the Prometheus text format on, at /metrics.
+            0 disables collecting metrics.
+            Default: 0
+        """
+        return self._metrics_port
+
+    @metrics_port.setter
+    def metrics_port(self, value: int) -> None:
+        self._metrics_port = value
+
+    @property
+    def metrics_host(self) -> str:
+        """
+        Returns
+        -------
+        str
+            Address to serve metrics on.
+            Default: "127.0.0.1"
+        """
+        return self._metrics_host
+
+    @metrics_host.setter
+    def metrics_host(self, value: str) -> None:
+        self._metrics_host = value
+
+    @property
+    def profile_handlers(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            If True, the wall and CPU time of every call of a handler registered with the listener is recorded in bot.profiler.
+            Default: False
+        """
+        return self._profile_handlers
+
+    @profile_handlers.setter
+    def profile_handlers(self, value: bool) -> None:
+        self._profile_handlers = value
+
+    @property
+    def slow_handler_threshold(self) -> float:
+        """
+        Returns
+        -------
+        float
+            Handler calls taking longer than this many seconds are logged with their room and event id,
+            if profile_handlers is True. 0 disables logging.
+            Default: 1.0
+        """
+        return self._slow_handler_threshold
+
+    @slow_handler_threshold.setter
+    def slow_handler_threshold(self, value: float) -> None:
+        self._slow_handler_threshold = value
+
+    @property
+    def profile_slowest(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of slowest handler calls to keep a cProfile profile of, if profile_handlers is True.
+            0 disables cProfile, which is expensive.
+            Default: 0
+        """
+        return self._profile_slowest
+
+    @profile_slowest.setter
+    def profile_slowest(self, value: int) -> None:
+        self._profile_slowest = value
+
+    @property
+    def record_sync_path(self) -> Path:
+        """
+        Returns
+        -------
+        Path
+            File to record the bot's sync responses to, for replaying them with simplematrixbotlib.replay.replay.
+            None disables recording.
+            Default: None
+        """
+        return self._record_sync_path
+
+    @record_sync_path.setter
+    def record_sync_path(self, value: Path | str) -> None:
+        self._record_sync_path = Path(value) if value else None
+
+    @property
+    def record_sync_redact(self) -> List[str]:
+        """
+        Returns
+        -------
+        List[str]
+            Keys whose values are replaced with x's in recorded sync responses.
+            Default: ["body", "formatted_body"]
+        """
+        return self._record_sync_redact
+
+    @record_sync_redact.setter
+    def record_sync_redact(self, value: List[str]) -> None:
+        self._record_sync_redact = list(value)
+
+    @property
+    def shard_workers(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of worker processes that run the listener's handlers, each for a share of the rooms.
+            0 runs the handlers in the process that syncs.
+            Default: 0
+        """
+        return self._shard_workers
+
+    @shard_workers.setter
+    def shard_workers(self, value: int) -> None:
+        self._shard_workers = value
+
+    @property
+    def event_dedup_size(self) -> int:
+        """
+        Returns
+        -------
+        int
+            Number of recently handled event IDs to remember, so the same event is not passed to handlers twice.
+            0 disables deduplication.
+            Default: 10000
+        """
+        return self._event_dedup_size
+
+    @event_dedup_size.setter
+    def event_dedup_size(self, value: int) -> None:
+        self._event_dedup_size = value
+
+    @property
+    def event_dedup_persist(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            Whether the remembered event IDs are saved to a file in store_path, to deduplicate events across restarts.
+            Default: False
+        """
+        return self._event_dedup_persist
+
+    @event_dedup_persist.setter
+    def event_dedup_persist(self, value: bool) -> None:
+        self._event_dedup_persist = value
@@ -12,6 +12,18 @@ from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
 # i am unsure this is even needed? why is the salt a fixed value? is this
 # just to "secure" a session key? the heck is this
 
+_SALT = b'0\xc03T\xb8\x9a\xf9\xcb\xf4\xf8\xc7\x00a\xd6\xa7M'
+
+
+def _derive(password: bytes, salt: bytes) -> bytes:
+    # not cached here, Creds keeps the key it derived
+    kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
+                     length=32,
+                     salt=salt,
+                     iterations=100000,
+                     backend=default_backend())
+    return base64.urlsafe_b64encode(kdf.derive(password))
+
 
 class Wrapper:
 
@@ -22,16 +34,8 @@ class Wrapper:
     def key_from_pass(password, unique=False):
         password = bytes(password, 'utf-8')
         if unique:
-            salt = os.urandom(16)
-        else:
-            salt = b'0\xc03T\xb8\x9a\xf9\xcb\xf4\xf8\xc7\x00a\xd6\xa7M'
-        kdf = PBKDF2HMAC(algorithm=hashes.SHA256(),
-                         length=32,
-                         salt=salt,
-                         iterations=100000,
-                         backend=default_backend())
-        key = base64.urlsafe_b64encode(kdf.derive(password))
-        return key
+            return _derive(password, os.urandom(16))
+        return _derive(password, _SALT)
 
     def encrypt(data, key):
         f = Fernet(key)
@@ -0,0 +1,103 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from nio import MegolmEvent
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DecryptionFailures:
+    """
+    Collects events that could not be decrypted and reports them once per time window,
+    grouped by room and megolm session, instead of once per event.
+
+    The room keys of all sessions with failures in a window are requested together
+    when the window ends, once per session. Sessions whose keys were already requested
+    are skipped by nio.
+
+    """
+
+    def __init__(self,
+                 report: Callable[[str, str, List[MegolmEvent]],
+                                  Awaitable[Any]],
+                 request_key: Optional[Callable[[MegolmEvent],
+                                                Awaitable[Any]]] = None,
+                 window: float = 60) -> None:
+        """
+        Parameters
+        ----------
+        report : Callable[[str, str, List[MegolmEvent]], Awaitable[Any]]
+            Coroutine function called with the room id, the session id and the events of
+            that room and session that could not be decrypted in a window.
+
+        request_key : Callable[[MegolmEvent], Awaitable[Any]], optional
+            Coroutine function called with an event to request the room key of its session,
+            e.g. nio.AsyncClient.request_room_key.
+
+        window : float, optional
+            Number of seconds to collect failures for before reporting them.
+        """
+        self._report = report
+        self._request_key = request_key
+        self.window = window
+        self._failures: Dict[Tuple[str, str], List[MegolmEvent]] = {}
+        self._flush_task: asyncio.Task = None
+
+    def add(self, room_id: str, event: MegolmEvent) -> None:
+        """
+        Adds an event that could not be decrypted, starting a window if none is running.
+        """
+        self._failures.setdefault((room_id, event.session_id),
+                                  []).append(event)
+        if self._flush_task is None:
+            self._flush_task = asyncio.ensure_future(self._flush_later())
+
+    def pending(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The number of events that were not reported yet.
+        """
+        return sum(len(events) for events in self._failures.values())
+
+    async def _flush_later(self) -> None:
+        try:
+            await asyncio.sleep(self.window)
+        finally:
+            self._flush_task = None
+        await self.flush()
+
+    async def stop(self) -> None:
+        """
+        Drops the collected failures without reporting them.
+        """
+        task, self._flush_task = self._flush_task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        self._failures.clear()
+
+    async def flush(self) -> None:
+        """
+        Requests the missing room keys and reports the collected failures.
+        """
+        failures, self._failures = self._failures, {}
+
+        if self._request_key is not None:
+            for (_, session_id), events in failures.items():
+                try:
+                    await self._request_key(events[0])
+                except Exception as e:
+                    logger.debug(
+                        f"Could not request the room key of session {session_id}: {e}"
+                    )
+
+        for (room_id, session_id), events in failures.items():
+            try:
+                await self._report(room_id, session_id, events)
+            except Exception:
+                logger.exception(
+                    f"Error while reporting decryption failures in {room_id}")
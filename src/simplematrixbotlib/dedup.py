@@ -0,0 +1,126 @@
+import asyncio
+import json
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from nio import AsyncClient
+
+from simplematrixbotlib.statefile import StateFile, client_file_path
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class EventDeduplicator(StateFile):
+    """
+    Remembers the IDs of the latest events passed to handlers, so an event received again,
+    e.g. after a retried sync or a restart, is not handled twice.
+
+    """
+
+    def __init__(self,
+                 size: int = 10000,
+                 path: Optional[Path] = None,
+                 save_interval: float = 0) -> None:
+        """
+        Parameters
+        ----------
+        size : int
+            Number of event IDs to remember. The least recently seen IDs are forgotten first.
+
+        path : Path, optional
+            The file to save the IDs to and load them from. By default they are only kept in memory.
+
+        save_interval : float, optional
+            Minimum number of seconds between saves after syncs. By default the IDs are saved
+            after every sync that passed new events to handlers.
+        """
+        super().__init__(path, save_interval)
+        self.size = size
+        self._ids: "OrderedDict[str, None]" = OrderedDict()
+        # whether IDs were recorded since the last save
+        self._dirty = False
+
+    @classmethod
+    def for_client(cls, client: AsyncClient, directory: Optional[Path],
+                   **kwargs) -> "EventDeduplicator":
+        """
+        Returns
+        -------
+        EventDeduplicator
+            A deduplicator saving to a file for the client's account and device, in directory or the working directory.
+        """
+        return cls(path=client_file_path('seen_events', client, directory),
+                   **kwargs)
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def seen(self, event_id: str) -> bool:
+        """
+        Records an event ID.
+
+        Returns
+        -------
+        boolean
+            True if the ID was recorded before, i.e. the event was already handled.
+        """
+        ids = self._ids
+        if event_id in ids:
+            ids.move_to_end(event_id)
+            return True
+        ids[event_id] = None
+        self._dirty = True
+        if len(ids) > self.size:
+            ids.popitem(last=False)
+        return False
+
+    def load(self) -> bool:
+        """
+        Restores the IDs saved to path.
+
+        Returns
+        -------
+        boolean
+            True if saved IDs were restored.
+        """
+        if self.path is None:
+            return False
+        try:
+            with open(self.path, 'r') as f:
+                ids = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable event IDs {self.path}: {e}")
+            return False
+
+        self._ids = OrderedDict.fromkeys(ids[-self.size:])
+        return True
+
+    def dumps(self) -> str:
+        # oldest first, so loading keeps the order
+        return json.dumps(list(self._ids), separators=(',', ':'))
+
+    def save(self) -> None:
+        """
+        Saves the IDs to path, if set.
+        """
+        self._dirty = False
+        super().save()
+
+    def _saved(self, future: asyncio.Future) -> None:
+        super()._saved(future)
+        if not future.cancelled() and future.exception() is not None:
+            # saved again after the next sync
+            self._dirty = True
+
+    async def sync_callback(self, response) -> None:
+        """
+        Saves the IDs in a thread if new IDs were recorded and save_interval has passed since the last save.
+        If a save is still running, the IDs stay unsaved until the next sync.
+        """
+        if self._dirty and self._save_in_background():
+            self._dirty = False
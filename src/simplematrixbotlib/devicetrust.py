@@ -0,0 +1,89 @@
+from typing import Dict, Iterable, List, Set
+
+from nio import KeysQueryResponse, SyncResponse
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class DeviceTrustCache:
+    """
+    Remembers which devices were already checked for being verified or blacklisted,
+    so unverified devices can be blacklisted without checking every device of every room member again.
+
+    A user is checked again when their number of devices changes, or when a sync or key query
+    reports that their device list changed. Then only their devices that were not checked before are looked at.
+    When the trust of a checked device changes, e.g. it is unverified or unblacklisted, its user has to be forgotten
+    to check all of their devices again. Api does this when sending fails because of an unverified device.
+
+    """
+
+    def __init__(self) -> None:
+        self._checked: Dict[str, Set[str]] = {}
+        self._changed: Set[str] = set()
+
+    def invalidate(self, user_ids: Iterable[str]) -> None:
+        """
+        Marks the device lists of users as changed.
+        """
+        self._changed.update(user_ids)
+
+    def forget(self, user_ids: Iterable[str]) -> None:
+        """
+        Drops users, e.g. because the bot no longer shares a room with them
+        or the trust of one of their devices changed.
+        """
+        for user_id in user_ids:
+            self._checked.pop(user_id, None)
+            self._changed.discard(user_id)
+
+    async def response_callback(self, response) -> None:
+        """
+        Updates the cache from the device list changes in sync and key query responses.
+        """
+        if isinstance(response, SyncResponse):
+            self.invalidate(response.device_list.changed)
+            self.forget(response.device_list.left)
+        elif isinstance(response, KeysQueryResponse):
+            self.invalidate(response.device_keys)
+
+    def blacklist_unverified(self, olm, user_ids: Iterable[str]) -> Dict[str, List[str]]:
+        """
+        Blacklists the devices of users that are neither verified nor blacklisted yet.
+
+        Parameters
+        ----------
+        olm : nio.crypto.Olm
+            The olm machine of the client.
+
+        user_ids : Iterable[str]
+            The users whose devices to check, e.g. the members of a room.
+
+        Returns
+        -------
+        Dict[str, List[str]]
+            The ids of the blacklisted devices, by user id.
+        """
+        blacklisted: Dict[str, List[str]] = {}
+        for user_id in user_ids:
+            devices = olm.device_store[user_id]
+            checked = self._checked.get(user_id)
+            if checked is not None and len(checked) == len(
+                    devices) and user_id not in self._changed:
+                continue
+
+            if checked is None:
+                checked = self._checked[user_id] = set()
+            self._changed.discard(user_id)
+
+            for device_id, device in devices.items():
+                if device_id in checked:
+                    continue
+                checked.add(device_id)
+                if not (olm.is_device_verified(device)
+                        or olm.is_device_blacklisted(device)):
+                    olm.blacklist_device(device)
+                    blacklisted.setdefault(user_id, []).append(device_id)
+
+        return blacklisted
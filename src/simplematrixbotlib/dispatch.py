@@ -0,0 +1,100 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Dispatcher:
+    """
+    Runs event handlers on a pool of worker tasks instead of inside the sync loop.
+
+    Every room has its own queue, so events of a room are handled one after another
+    in the order they were received while different rooms are handled in parallel.
+
+    """
+
+    def __init__(self, workers: int, queue_size: int = 0) -> None:
+        """
+        Parameters
+        ----------
+        workers : int
+            Number of events that may be handled at the same time.
+
+        queue_size : int, optional
+            Maximum number of events waiting to be handled. When the queues are full,
+            submitting waits for space, which slows down the sync loop. 0 means unbounded.
+        """
+        self.workers = workers
+        self.queue_size = queue_size
+        self._rooms: Dict[str, Deque[tuple]] = {}
+        self._ready: asyncio.Queue = None
+        self._space: Optional[asyncio.Semaphore] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self) -> None:
+        """
+        Starts the worker tasks. Must be called from within the running event loop.
+        """
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        if self.queue_size > 0:
+            self._space = asyncio.Semaphore(self.queue_size)
+        self._tasks = [
+            asyncio.ensure_future(self._work()) for _ in range(self.workers)
+        ]
+
+    async def stop(self) -> None:
+        """
+        Stops the worker tasks, dropping events that were not handled yet.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._rooms.clear()
+
+    async def submit(self, room_id: str, handler: Callable[..., Awaitable[Any]],
+                     *args) -> None:
+        """
+        Queues a call of handler with args for the given room.
+        """
+        if self._space is not None:
+            await self._space.acquire()
+        queue = self._rooms.get(room_id)
+        if queue is None:
+            # a room is either idle or in the ready queue/being handled exactly once
+            queue = self._rooms[room_id] = deque()
+            self._ready.put_nowait(room_id)
+        queue.append((handler, args))
+
+    def depth(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The number of events waiting to be handled.
+        """
+        return sum(len(queue) for queue in self._rooms.values())
+
+    async def _work(self) -> None:
+        while True:
+            room_id = await self._ready.get()
+            queue = self._rooms[room_id]
+            handler, args = queue[0]
+            try:
+                await handler(*args)
+            except Exception:
+                logger.exception(f"Error while handling an event in {room_id}")
+            finally:
+                queue.popleft()
+                if self._space is not None:
+                    self._space.release()
+                if not queue:
+                    del self._rooms[room_id]
+                else:
+                    # one event at a time, so busy rooms can't starve the others
+                    self._ready.put_nowait(room_id)
@@ -0,0 +1,168 @@
+import asyncio
+import signal
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional
+
+import aiohttp
+
+from simplematrixbotlib.api import create_http_session
+from simplematrixbotlib.bot import Bot
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class BotGroup:
+    """
+    Runs several bots in one process on one event loop.
+
+    The bots share one pool of HTTP connections, the event loop's thread pool and one process pool.
+    A bot that fails is logged and, if restart_delay is set, started again, without affecting the other bots.
+
+    """
+
+    def __init__(self,
+                 bots: Iterable[Bot] = (),
+                 connection_limit: int = 100,
+                 thread_workers: int = 0,
+                 process_workers: int = 0,
+                 restart_delay: Optional[float] = 5.0,
+                 max_restart_delay: float = 300.0) -> None:
+        """
+        Parameters
+        ----------
+        bots : Iterable[simplematrixbotlib.Bot], optional
+            The bots to run. More can be added with add().
+
+        connection_limit : int, optional
+            Maximum number of simultaneous connections of all bots together. 0 means unlimited.
+
+        thread_workers : int, optional
+            Number of threads of the thread pool, e.g. for handlers with executor="thread".
+            0 uses Python's default.
+
+        process_workers : int, optional
+            Number of processes of the process pool, for handlers with executor="process".
+            0 uses the number of CPUs.
+
+        restart_delay : float, optional
+            Seconds to wait before starting a failed bot again, doubled after every further failure.
+            None doesn't restart failed bots.
+
+        max_restart_delay : float, optional
+            Upper bound of the delay before starting a failed bot again.
+        """
+        self.bots: List[Bot] = []
+        self.connection_limit = connection_limit
+        self.thread_workers = thread_workers
+        self.process_workers = process_workers
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.http_session: aiohttp.ClientSession = None
+        self._process_pool: ProcessPoolExecutor = None
+        self._tasks: Dict[Bot, asyncio.Task] = {}
+        self._stopping: asyncio.Event = None
+        for bot in bots:
+            self.add(bot)
+
+    def add(self, bot: Bot) -> None:
+        """
+        Adds a bot, starting it right away if the group is running.
+        Bots with Config.shard_workers set can't be added, they need a process of their own.
+        """
+        if bot.config.shard_workers > 0:
+            # their workers are forked, which can deadlock while other bots' threads are running
+            raise ValueError(
+                f"Bot {bot.creds.username} has shard_workers set and can't run in a BotGroup"
+            )
+        self.bots.append(bot)
+        if self._stopping is not None and not self._stopping.is_set():
+            self._start(bot)
+
+    def _start(self, bot: Bot) -> None:
+        bot._process_pool = self._process_pool
+        task = self._tasks[bot] = asyncio.ensure_future(self._run_bot(bot))
+        task.add_done_callback(lambda _: self._check_running())
+
+    def _check_running(self) -> None:
+        # cancelled tasks of a requested stop end up here, too
+        if not self._stopping.is_set() and all(
+                task.done() for task in self._tasks.values()):
+            logger.error("All bots stopped")
+            self._stopping.set()
+
+    async def _run_bot(self, bot: Bot) -> None:
+        name = bot.creds.username
+        delay = self.restart_delay
+        while True:
+            bot.api.http_session = self.http_session
+            try:
+                await bot.main()
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception(f"Bot {name} failed")
+            finally:
+                await bot.api.close()
+
+            if delay is None:
+                return
+            logger.info(f"Restarting bot {name} in {delay}s")
+            await bot._reset()
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    def stop(self) -> None:
+        """
+        Stops all bots. Can be called from a handler of one of the bots.
+        """
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def main(self) -> None:
+        """
+        Runs all bots until stop() is called or all of them stopped.
+        """
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        if self.thread_workers > 0:
+            loop.set_default_executor(
+                ThreadPoolExecutor(self.thread_workers))
+        self._process_pool = ProcessPoolExecutor(self.process_workers
+                                                 or None)
+        self.http_session = create_http_session(self.connection_limit)
+
+        try:
+            for bot in self.bots:
+                self._start(bot)
+            if self._tasks:
+                await self._stopping.wait()
+        finally:
+            logger.info("Stopping all bots")
+            for task in self._tasks.values():
+                task.cancel()
+            await asyncio.gather(*self._tasks.values(),
+                                 return_exceptions=True)
+            self._tasks.clear()
+            await self.http_session.close()
+            self._process_pool.shutdown(wait=False, cancel_futures=True)
+
+    def run(self) -> None:
+        """
+        Runs all bots. Stops them gracefully on SIGINT or SIGTERM.
+
+        """
+
+        async def main():
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                try:
+                    loop.add_signal_handler(sig, self.stop)
+                except (NotImplementedError, RuntimeError):
+                    # not supported on Windows or outside the main thread
+                    pass
+            await self.main()
+
+        asyncio.run(main())
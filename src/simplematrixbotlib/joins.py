@@ -0,0 +1,134 @@
+import asyncio
+import random
+from typing import Any, Awaitable, Callable, Dict
+
+from nio import JoinResponse
+
+from simplematrixbotlib.ratelimit import RateLimitPause, concurrency_limit
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JoinScheduler:
+    """
+    Joins rooms in the background, at most one join per room at a time.
+
+    Failed joins are retried after a random delay that grows exponentially with every try.
+    When the homeserver responds with M_LIMIT_EXCEEDED, all joins are paused for the
+    requested time and the join is retried without counting it as a failed try.
+
+    """
+
+    def __init__(self,
+                 join: Callable[[str], Awaitable[Any]],
+                 concurrency: int = 5,
+                 tries: int = 3,
+                 base_delay: float = 1.0,
+                 max_delay: float = 60.0) -> None:
+        """
+        Parameters
+        ----------
+        join : Callable[[str], Awaitable[Any]]
+            Coroutine function called with a room id to join it, e.g. nio.AsyncClient.join.
+
+        concurrency : int, optional
+            Number of rooms that may be joined at the same time. 0 means unlimited.
+
+        tries : int, optional
+            Number of failed tries after which joining a room is given up.
+
+        base_delay : float, optional
+            Maximum delay in seconds before the second try. Doubles with every further try.
+
+        max_delay : float, optional
+            Upper bound of the maximum delay in seconds.
+        """
+        self._join = join
+        self._limit = concurrency_limit(concurrency)
+        self.tries = tries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._pending: Dict[str, asyncio.Task] = {}
+        self._pause = RateLimitPause()
+
+    def schedule(self, room_id: str) -> asyncio.Task:
+        """
+        Starts joining a room, unless it is already being joined.
+
+        Returns
+        -------
+        asyncio.Task
+            Resolves to True once the room was joined, or False if joining it was given up.
+        """
+        task = self._pending.get(room_id)
+        if task is None:
+            task = self._pending[room_id] = asyncio.ensure_future(
+                self._run(room_id))
+        return task
+
+    def pending(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The number of rooms being joined.
+        """
+        return len(self._pending)
+
+    async def stop(self) -> None:
+        """
+        Cancels all pending joins.
+        """
+        tasks = list(self._pending.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._pending.clear()
+
+    def backoff(self, failures: int) -> float:
+        """
+        Returns
+        -------
+        float
+            A random delay in seconds before the next try after failures failed tries.
+        """
+        return random.uniform(
+            0, min(self.max_delay, self.base_delay * 2**(failures - 1)))
+
+    async def _try(self, room_id: str) -> Any:
+        await self._pause.wait()
+        async with self._limit:
+            return await self._join(room_id)
+
+    async def _run(self, room_id: str) -> bool:
+        try:
+            return await self._join_with_retries(room_id)
+        finally:
+            self._pending.pop(room_id, None)
+
+    async def _join_with_retries(self, room_id: str) -> bool:
+        failures = 0
+        while True:
+            try:
+                response = await self._try(room_id)
+            except Exception as e:
+                response = e
+
+            if isinstance(response, JoinResponse):
+                logger.info(f"Joined {room_id}")
+                return True
+
+            if self._pause.check(response, f"joining {room_id}"):
+                continue
+
+            failures += 1
+            logger.warning(f"Error joining {room_id}: {response}")
+            if failures >= self.tries:
+                logger.error(
+                    f"Failed to join {room_id} after {failures} tries")
+                return False
+            delay = self.backoff(failures)
+            logger.debug(f"Trying again in {delay:.1f}s...")
+            await asyncio.sleep(delay)
@@ -1,7 +1,11 @@
-from typing import TYPE_CHECKING, Callable
+import functools
+import inspect
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional
 
 from nio import Event, MatrixRoom, RoomMessage, RoomMessageText, ReactionEvent
 
+from simplematrixbotlib.match import MessageMatch
+
 if TYPE_CHECKING:
     from simplematrixbotlib.bot import Bot
 
@@ -12,10 +16,18 @@ class Listener:
         self._bot = bot
         self._registry = []
         self._startup_registry = []
+        # prefix -> command name -> handlers, looked up once per message
+        self._command_registry: Dict[str, Dict[str, List[Callable]]] = {}
+        self._command_registry_nocase: Dict[str, Dict[str, List[Callable]]] = {}
 
-    def on_custom_event(self, event: Event) -> Callable[[Callable[..., None]], None]:
+    def on_custom_event(self,
+                        event: Event,
+                        executor: Optional[str] = None
+                        ) -> Callable[[Callable[..., None]], None]:
 
         def wrapper(func):
+            if executor:
+                func = self._in_executor(func, executor)
             if [func, event] in self._registry:
                 func()
             else:
@@ -23,7 +35,30 @@ class Listener:
 
         return wrapper
 
-    def on_message_event(self, func: Callable[[MatrixRoom, RoomMessageText], None]) -> None:
+    def on_message_event(self,
+                         func: Optional[Callable[[MatrixRoom, RoomMessageText], None]] = None,
+                         executor: Optional[str] = None):
+        """
+        Register a handler for messages. Can be used as @on_message_event or @on_message_event(executor=...).
+
+        Parameters
+        ----------
+        func : Callable[[MatrixRoom, RoomMessageText], None]
+            The handler.
+
+        executor : str, optional
+            Run the handler outside of the event loop, for CPU-bound handlers.
+            "thread" runs it in a thread pool, "process" in a process pool.
+            The handler must then be a regular function instead of a coroutine function.
+            If it returns an awaitable, e.g. a call of bot.api.send_text_message,
+            it is awaited on the event loop, which is only possible with "thread".
+            Handlers run in a process pool must be picklable, i.e. defined at module level.
+        """
+        if func is None:
+            return lambda func: self.on_message_event(func, executor)
+
+        if executor:
+            func = self._in_executor(func, executor)
         if [func, RoomMessageText] in self._registry:
             func()
         else:
@@ -31,6 +66,7 @@ class Listener:
 
     def on_reaction_event(self, func: Callable[[MatrixRoom, ReactionEvent, str], None]) -> None:
 
+        @functools.wraps(func)
         async def wrapper(room, event):
             await func(room, event, event.key)
 
@@ -40,4 +76,92 @@ class Listener:
         if func in self._startup_registry:
             func()
         else:
-            self._startup_registry.append(func)
\ No newline at end of file
+            self._startup_registry.append(func)
+
+    def _in_executor(self, func: Callable, executor: str) -> Callable:
+        if executor not in ("thread", "process"):
+            raise ValueError(
+                f"Unknown executor '{executor}', use 'thread' or 'process'")
+        if inspect.iscoroutinefunction(func):
+            raise ValueError(
+                "Handlers run in an executor must be regular functions, not coroutine functions"
+            )
+
+        @functools.wraps(func)
+        async def wrapper(*args):
+            result = await self._bot.run_in_executor(func, *args,
+                                                     executor=executor)
+            if inspect.isawaitable(result):
+                await result
+
+        return wrapper
+
+    def command(self,
+                name: str,
+                aliases: Optional[Iterable[str]] = None,
+                prefix: str = "",
+                case_sensitive: bool = True
+                ) -> Callable[[Callable[[MatrixRoom, RoomMessageText], None]], Callable]:
+        """
+        Register a handler for a command, e.g. "!help".
+
+        All commands share a single message listener which parses each
+        message once and looks the command up in a table, so the cost of
+        handling a message does not grow with the number of commands.
+
+        Parameters
+        ----------
+        name : str
+            The command, i.e. the first word of the message after the prefix.
+
+        aliases : Iterable[str], optional
+            Other names the command can be invoked with.
+
+        prefix : str, optional
+            The prefix that messages must begin with, usually "!", "/" or similar.
+
+        case_sensitive : bool, optional
+            Whether the command should be matched case sensitive.
+        """
+
+        registry = (self._command_registry
+                    if case_sensitive else self._command_registry_nocase)
+
+        def wrapper(func):
+            if not (self._command_registry or self._command_registry_nocase):
+                self._registry.append([self._dispatch_command, RoomMessageText])
+
+            commands = registry.setdefault(prefix, {})
+            for command in [name, *(aliases or [])]:
+                if not case_sensitive:
+                    command = command.lower()
+                handlers = commands.setdefault(command, [])
+                if func not in handlers:
+                    handlers.append(func)
+            return func
+
+        return wrapper
+
+    def _command_handlers(self, room: MatrixRoom, event: RoomMessageText) -> List[Callable]:
+        handlers = []
+        prefixes = dict.fromkeys([*self._command_registry, *self._command_registry_nocase])
+        for prefix in prefixes:
+            match = MessageMatch(room, event, self._bot, prefix)
+            if not match.prefix():
+                continue
+            try:
+                command = match.command()
+            except IndexError:
+                # the message consists of the prefix and whitespace only
+                continue
+            if not command:
+                continue
+
+            handlers += self._command_registry.get(prefix, {}).get(command, [])
+            handlers += self._command_registry_nocase.get(
+                prefix, {}).get(command.lower(), [])
+        return handlers
+
+    async def _dispatch_command(self, room: MatrixRoom, event: RoomMessageText) -> None:
+        for handler in self._command_handlers(room, event):
+            await handler(room, event)
@@ -1,5 +1,72 @@
 import re
 
+_REPLY_PATTERN = re.compile(r'<mx-reply>.*?</mx-reply>')
+# attribute of an event holding its parsed view
+_PARSED_ATTRIBUTE = '_simplematrixbotlib_parsed'
+
+
+class _ParsedMessage:
+    """
+    Prefix-independent view of a message event, shared by all MessageMatch objects of the same event.
+
+    """
+
+    __slots__ = ('body', 'formatted_body', 'text', 'words', '_commands')
+
+    def __init__(self, event) -> None:
+        self.body = event.body
+
+        formatted_body = event.formatted_body
+        if formatted_body:
+            if "<mx-reply>" in formatted_body:
+                formatted_body = _REPLY_PATTERN.sub('', formatted_body)
+            self.formatted_body = formatted_body
+        else:
+            self.formatted_body = None
+
+        self.text = formatted_body[1:] if self.formatted_body else self.body
+        self.words = self.text.split()
+        self._commands = {}
+
+    def command(self, prefix):
+        """
+        Returns the command for the given prefix, computed at most once per prefix.
+        Raises IndexError if the message consists of the prefix and whitespace only.
+        """
+        try:
+            command = self._commands[prefix]
+        except KeyError:
+            command = self._commands[prefix] = self._parse_command(prefix)
+        if command is None:
+            raise IndexError("message has no command")
+        return command
+
+    def _parse_command(self, prefix):
+        if prefix == self.body[0:len(prefix)]:
+            body_without_prefix = self.body[len(prefix):]
+        else:
+            body_without_prefix = self.body
+
+        if not body_without_prefix:
+            return []
+
+        words = self.words if self.formatted_body else body_without_prefix.split()
+        return words[0] if words else None
+
+
+def _parse(event) -> _ParsedMessage:
+    # kept on the event itself, so it lives exactly as long as the event and needs no locking;
+    # threads parsing the same event at once just store equal views
+    parsed = getattr(event, _PARSED_ATTRIBUTE, None)
+    if parsed is None or parsed.body is not event.body:
+        parsed = _ParsedMessage(event)
+        try:
+            setattr(event, _PARSED_ATTRIBUTE, parsed)
+        except AttributeError:
+            pass
+    return parsed
+
+
 class Match:
     """
     Class with methods to filter events
@@ -51,23 +118,7 @@ class Match:
         boolean
             Returns True if the event was sent from an allowed userid
         """
-        allowlist = self._bot.config.allowlist
-        blocklist = self._bot.config.blocklist
-        sender = self.event.sender
-        # if there is no explicit allowlist, default to allow
-        is_allowed = False if len(allowlist) > 0 else True
-
-        for regex in allowlist:
-            if regex.fullmatch(sender):
-                is_allowed = True
-                break
-
-        for regex in blocklist:
-            if regex.fullmatch(sender):
-                is_allowed = False
-                break
-
-        return is_allowed
+        return self._bot.config._is_allowed_user(self.event.sender)
 
     def is_not_from_this_bot(self):
         """
@@ -111,6 +162,12 @@ class MessageMatch(Match):
         """
         super().__init__(room, event, bot)
         self._prefix = prefix
+        self._parsed = None
+
+    def _view(self) -> _ParsedMessage:
+        if self._parsed is None:
+            self._parsed = _parse(self.event)
+        return self._parsed
 
     def formatted_body(self):
         """
@@ -120,13 +177,8 @@ class MessageMatch(Match):
         Optional[str]
             Returns the string after removing html balise used for a reply.
         """
-                
-        if self.event.formatted_body:
-            if "<mx-reply>" in self.event.formatted_body:
-                return re.sub(r'<mx-reply>.*?</mx-reply>', '', self.event.formatted_body)
-            else:
-                return self.event.formatted_body
-        return None
+
+        return self._view().formatted_body
 
     def command(self, command=None, case_sensitive=True):
         """
@@ -147,24 +199,16 @@ class MessageMatch(Match):
             Returns the string after the prefix and before the first space if no arg is passed to this method.
         """
 
-        if self._prefix == self.event.body[0:len(self._prefix)]:
-            body_without_prefix = self.event.body[len(self._prefix):]
-        else:
-            body_without_prefix = self.event.body
+        parsed_command = self._view().command(self._prefix)
 
-        if not body_without_prefix:
-            return []
-        
-        loc = self.formatted_body()
-        if loc:
-            body_without_prefix = loc[1:]
+        if not parsed_command:
+            return parsed_command
 
         if command:
-            return (body_without_prefix.split()[0] == command
-                    if case_sensitive else
-                    body_without_prefix.split()[0].lower() == command.lower())
+            return (parsed_command == command if case_sensitive else
+                    parsed_command.lower() == command.lower())
         else:
-            return body_without_prefix.split()[0]
+            return parsed_command
 
     def prefix(self):
         """
@@ -175,11 +219,11 @@ class MessageMatch(Match):
             Returns True if the message begins with the prefix, and False otherwise. If there is no prefix specified during the creation of this MessageMatch object, then return True.
         """
 
-        loc = self.formatted_body()
-        if loc:
-            return loc.startswith(self._prefix)
+        parsed = self._view()
+        if parsed.formatted_body:
+            return parsed.formatted_body.startswith(self._prefix)
 
-        return self.event.body.startswith(self._prefix)
+        return parsed.body.startswith(self._prefix)
 
     def args(self):
         """
@@ -189,12 +233,8 @@ class MessageMatch(Match):
         list
             Returns a list of strings that are the "words" of the message, except for the first "word", which would be the command.
         """
-            
-        loc = self.formatted_body()
-        if loc:
-            return loc[1:].split()[1:]
 
-        return self.event.body.split()[1:]
+        return self._view().words[1:]
 
     def contains(self, string):
         """
@@ -205,8 +245,5 @@ class MessageMatch(Match):
             Returns True if the string argument is found within the body of the message.
         """
 
-        loc = self.formatted_body()
-        if loc:
-            return string in loc[1:]
+        return string in self._view().text
 
-        return string in self.event.body
@@ -0,0 +1,273 @@
+import abc
+import bisect
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"'
+                          for name, value in zip(names, values)) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric(abc.ABC):
+    kind = ''
+
+    def __init__(self, name: str, help: str,
+                 labelnames: Sequence[str] = ()) -> None:
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+
+    def _header(self) -> List[str]:
+        return [
+            f'# HELP {self.name} {_escape(self.help)}',
+            f'# TYPE {self.name} {self.kind}'
+        ]
+
+    @abc.abstractmethod
+    def render(self) -> List[str]:
+        ...
+
+
+class Counter(_Metric):
+    """
+    A value that only goes up, e.g. the number of handled events, per combination of label values.
+
+    """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str,
+                 labelnames: Sequence[str] = ()) -> None:
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(
+                f'{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+            )
+        return lines
+
+
+class Histogram(_Metric):
+    """
+    Counts observed values, e.g. durations, in buckets, per combination of label values.
+
+    """
+
+    kind = 'histogram'
+
+    def __init__(self,
+                 name: str,
+                 help: str,
+                 labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS) -> None:
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # bucket counts (not cumulative), sum
+        self._values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, *labels: str) -> None:
+        entry = self._values.get(labels)
+        if entry is None:
+            entry = self._values[labels] = ([0] *
+                                            (len(self.buckets) + 1), [0.0])
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def count(self, *labels: str) -> int:
+        entry = self._values.get(labels)
+        return sum(entry[0]) if entry else 0
+
+    def render(self) -> List[str]:
+        lines = self._header()
+        for labels, (counts, total) in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'), ),
+                                    counts):
+                cumulative += count
+                bucket_labels = _format_labels(
+                    self.labelnames + ('le', ),
+                    labels + (_format_value(bound), ))
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            formatted = _format_labels(self.labelnames, labels)
+            lines.append(
+                f'{self.name}_sum{formatted} {_format_value(total[0])}')
+            lines.append(f'{self.name}_count{formatted} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """
+    A value that is read when the metrics are collected, e.g. the length of a queue.
+
+    """
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str,
+                 func: Callable[[], Optional[float]]) -> None:
+        """
+        Parameters
+        ----------
+        func : Callable[[], Optional[float]]
+            Returns the current value, or None if there is none, e.g. because a queue was not created yet.
+        """
+        super().__init__(name, help)
+        self._func = func
+
+    def render(self) -> List[str]:
+        try:
+            value = self._func()
+        except Exception:
+            logger.exception(f"Error while collecting {self.name}")
+            value = None
+        if value is None:
+            return []
+        return self._header() + [f'{self.name} {_format_value(value)}']
+
+
+class MetricsRegistry:
+    """
+    Holds metrics and renders them in the Prometheus text format.
+
+    """
+
+    def __init__(self, prefix: str = '') -> None:
+        self.prefix = prefix
+        self._metrics: Dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self,
+                name: str,
+                help: str,
+                labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self.prefix + name, help, labelnames))
+
+    def histogram(self,
+                  name: str,
+                  help: str,
+                  labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(
+            Histogram(self.prefix + name, help, labelnames, buckets))
+
+    def gauge(self, name: str, help: str,
+              func: Callable[[], Optional[float]]) -> Gauge:
+        return self._register(Gauge(self.prefix + name, help, func))
+
+    def render(self) -> str:
+        """
+        Returns
+        -------
+        str
+            All metrics in the Prometheus text exposition format.
+        """
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class BotMetrics(MetricsRegistry):
+    """
+    The metrics collected by a bot when Config.metrics_port is set.
+
+    """
+
+    def __init__(self) -> None:
+        super().__init__('simplematrixbotlib_')
+        self.events_received = self.counter(
+            'events_received_total',
+            'Room events received for the listener, by event type.',
+            ('type', ))
+        self.handler_calls = self.counter(
+            'handler_calls_total', 'Calls of listener handlers, by handler.',
+            ('handler', ))
+        self.handler_errors = self.counter(
+            'handler_errors_total',
+            'Listener handler calls that raised an exception, by handler.',
+            ('handler', ))
+        self.handler_duration = self.histogram(
+            'handler_duration_seconds',
+            'Time spent in listener handlers, by handler.', ('handler', ))
+        self.send_duration = self.histogram(
+            'send_duration_seconds',
+            'Time until an event sent to a room was accepted or rejected, including time spent in the send queue.'
+        )
+        self.send_failures = self.counter(
+            'send_failures_total',
+            'Events that could not be sent to a room.')
+        self.sync_duration = self.histogram(
+            'sync_duration_seconds',
+            'Time from receiving a sync response until its callbacks returned, i.e. reading, parsing and handling it, '
+            'without the time the homeserver waited for new events.'
+        )
+
+    async def start_server(self, host: str, port: int):
+        """
+        Serves the metrics on http://host:port/metrics.
+
+        Returns
+        -------
+        aiohttp.web.AppRunner
+            The runner of the server, to stop it with cleanup().
+        """
+        from aiohttp import web
+
+        async def handle(request):
+            return web.Response(text=self.render(),
+                                content_type='text/plain',
+                                charset='utf-8',
+                                headers={'X-Content-Type-Options': 'nosniff'})
+
+        app = web.Application()
+        app.router.add_get('/metrics', handle)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+        return runner
+
+
+def handler_name(handler: Union[Callable, object]) -> str:
+    """
+    Returns
+    -------
+    str
+        The qualified name of a handler, used as its label.
+    """
+    return getattr(handler, '__qualname__', None) or repr(handler)
@@ -0,0 +1,204 @@
+import cProfile
+import heapq
+import itertools
+import time
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, NamedTuple, Optional
+
+from simplematrixbotlib.metrics import handler_name
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HandlerStats(NamedTuple):
+    handler: str
+    calls: int
+    wall_time: float
+    cpu_time: float
+    max_wall_time: float
+
+
+class HandlerCall(NamedTuple):
+    """
+    A profiled call of a handler.
+
+    Attributes
+    ----------
+    profile : Optional[cProfile.Profile]
+        The profile of the call, only of the handler's own code, not of other tasks
+        that ran while it was waiting.
+    """
+    wall_time: float
+    cpu_time: float
+    handler: str
+    room_id: Optional[str]
+    event_id: Optional[str]
+    profile: Optional[cProfile.Profile]
+
+
+class _Timed:
+    """
+    Awaits a coroutine, measuring the CPU time spent in the coroutine itself
+    and optionally profiling it, without counting other tasks that run while it is suspended.
+
+    """
+
+    __slots__ = ('_coroutine', '_profile', 'cpu_time')
+
+    def __init__(self, awaitable, profile: Optional[cProfile.Profile]) -> None:
+        self._coroutine = awaitable if hasattr(
+            awaitable, 'throw') else awaitable.__await__()
+        self._profile = profile
+        self.cpu_time = 0.0
+
+    def _step(self, method, arg):
+        profile = self._profile
+        start = time.thread_time()
+        if profile is not None:
+            try:
+                profile.enable()
+            except ValueError:
+                # another profiler is active, e.g. a profiled handler calling a profiled handler
+                profile = None
+        try:
+            return method(arg)
+        finally:
+            if profile is not None:
+                profile.disable()
+            self.cpu_time += time.thread_time() - start
+
+    def __await__(self):
+        coroutine = self._coroutine
+        method, arg = coroutine.send, None
+        while True:
+            try:
+                future = self._step(method, arg)
+            except StopIteration as e:
+                return e.value
+            try:
+                arg = yield future
+                method = coroutine.send
+            except GeneratorExit:
+                if hasattr(coroutine, 'close'):
+                    coroutine.close()
+                raise
+            except BaseException as e:
+                method, arg = coroutine.throw, e
+
+
+class HandlerProfiler:
+    """
+    Records the wall and CPU time of handler calls, logs calls that take longer than a threshold
+    and keeps a cProfile profile of the slowest calls.
+
+    """
+
+    def __init__(self, threshold: float = 1.0, keep_slowest: int = 0) -> None:
+        """
+        Parameters
+        ----------
+        threshold : float, optional
+            Calls taking longer than this many seconds are logged. 0 disables logging.
+
+        keep_slowest : int, optional
+            Number of slowest calls to keep a cProfile profile of. 0 disables profiling,
+            which makes calls much cheaper.
+        """
+        self.threshold = threshold
+        self.keep_slowest = keep_slowest
+        self._stats: Dict[str, List[float]] = {}
+        # min-heap of (wall time, tie breaker, call), so the fastest kept call is replaced first
+        self._slowest: List[tuple] = []
+        self._counter = itertools.count()
+
+    async def run(self,
+                  handler: Callable[..., Awaitable[Any]],
+                  *args,
+                  room_id: Optional[str] = None,
+                  event_id: Optional[str] = None) -> Any:
+        """
+        Calls and awaits handler with args, recording its time.
+        """
+        profile = cProfile.Profile() if self.keep_slowest > 0 else None
+        timed = _Timed(handler(*args), profile)
+        start = time.perf_counter()
+        try:
+            return await timed
+        finally:
+            self._record(handler_name(handler),
+                         time.perf_counter() - start, timed.cpu_time,
+                         room_id, event_id, profile)
+
+    def _record(self, name: str, wall_time: float, cpu_time: float,
+                room_id: Optional[str], event_id: Optional[str],
+                profile: Optional[cProfile.Profile]) -> None:
+        stats = self._stats.get(name)
+        if stats is None:
+            stats = self._stats[name] = [0, 0.0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += wall_time
+        stats[2] += cpu_time
+        stats[3] = max(stats[3], wall_time)
+
+        if self.threshold > 0 and wall_time > self.threshold:
+            logger.warning(
+                f"Slow handler {name} took {wall_time:.3f}s ({cpu_time:.3f}s CPU) "
+                f"in room {room_id}, event {event_id}")
+
+        if profile is not None:
+            entry = (wall_time, next(self._counter),
+                     HandlerCall(wall_time, cpu_time, name, room_id,
+                                 event_id, profile))
+            if len(self._slowest) < self.keep_slowest:
+                heapq.heappush(self._slowest, entry)
+            elif wall_time > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def stats(self) -> List[HandlerStats]:
+        """
+        Returns
+        -------
+        List[HandlerStats]
+            Calls, total wall and CPU time and longest wall time of every handler,
+            the handlers with the most total wall time first.
+        """
+        return sorted((HandlerStats(name, *stats)
+                       for name, stats in self._stats.items()),
+                      key=lambda stats: stats.wall_time,
+                      reverse=True)
+
+    def slowest(self) -> List[HandlerCall]:
+        """
+        Returns
+        -------
+        List[HandlerCall]
+            The kept slowest calls, the slowest first.
+        """
+        return [
+            call for _, _, call in sorted(self._slowest, reverse=True)
+        ]
+
+    def dump_slowest(self, directory: Path) -> List[Path]:
+        """
+        Writes the profiles of the slowest calls to files, which can be read with pstats or e.g. snakeviz.
+
+        Returns
+        -------
+        List[Path]
+            The written files, the slowest call first.
+        """
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        paths = []
+        for rank, call in enumerate(self.slowest(), 1):
+            name = ''.join(c if c.isalnum() else '_' for c in call.handler)
+            path = directory.joinpath(f"{rank:03}_{name}.prof")
+            call.profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def reset(self) -> None:
+        self._stats.clear()
+        self._slowest.clear()
@@ -0,0 +1,279 @@
+import asyncio
+import time
+from collections import deque
+from typing import Any, AsyncContextManager, Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+
+from nio import ErrorResponse
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_RETRY_AFTER_MS = 5000
+
+
+def retry_after(response) -> Optional[float]:
+    """
+    Returns
+    -------
+    Optional[float]
+        The number of seconds to wait before retrying if the response is a rate limit error, otherwise None.
+    """
+    if isinstance(response, ErrorResponse) and response.status_code in (
+            "M_LIMIT_EXCEEDED", 429):
+        return (response.retry_after_ms or DEFAULT_RETRY_AFTER_MS) / 1000
+    return None
+
+
+class _Unlimited:
+
+    async def __aenter__(self) -> None:
+        pass
+
+    async def __aexit__(self, *exc_info) -> None:
+        pass
+
+
+_UNLIMITED = _Unlimited()
+
+
+def concurrency_limit(limit: int) -> AsyncContextManager:
+    """
+    Returns
+    -------
+    AsyncContextManager
+        A semaphore letting limit tasks in at the same time, or a context manager that doesn't limit if limit is 0.
+    """
+    return asyncio.Semaphore(limit) if limit > 0 else _UNLIMITED
+
+
+class RateLimitPause:
+    """
+    Pauses all requests of a kind, e.g. all sends, for the time the homeserver asked for in a rate limit error.
+
+    """
+
+    __slots__ = ('_until', )
+
+    def __init__(self) -> None:
+        self._until = 0.0
+
+    async def wait(self) -> None:
+        """
+        Waits until the pause is over.
+        """
+        while (delay := self._until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+
+    def check(self, response, action: str) -> bool:
+        """
+        Starts a pause if the response is a rate limit error.
+
+        Parameters
+        ----------
+        response
+            The response of a request, or an exception raised by it.
+
+        action : str
+            What was rate limited, for the log, e.g. "sending to !room:example.org".
+
+        Returns
+        -------
+        boolean
+            True if the response is a rate limit error, i.e. the request should be retried after wait().
+        """
+        delay = retry_after(response)
+        if delay is None:
+            return False
+        logger.warning(f"Rate limited while {action}, retrying in {delay}s")
+        self._until = max(self._until, time.monotonic() + delay)
+        return True
+
+
+class TokenBucket:
+    """
+    A token bucket allowing bursts of up to burst requests, refilled at rate tokens per second.
+    A rate of 0 disables limiting.
+
+    """
+
+    __slots__ = ('rate', 'burst', '_tokens', '_updated')
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        """
+        Takes a token if one is available.
+
+        Returns
+        -------
+        float
+            0 if a token was taken, otherwise the number of seconds until one is available.
+        """
+        if self.rate <= 0:
+            return 0
+
+        now = time.monotonic()
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def full(self) -> bool:
+        """
+        Returns
+        -------
+        boolean
+            True if a burst is available again, i.e. a new bucket would behave the same.
+        """
+        return self.rate <= 0 or self._tokens + (
+            time.monotonic() - self._updated) * self.rate >= self.burst
+
+    async def acquire(self) -> None:
+        while (delay := self.take()) > 0:
+            await asyncio.sleep(delay)
+
+
+class SendQueue:
+    """
+    Schedules outgoing events so that they respect a global and a per-room rate limit.
+
+    Events for the same room are sent one after another in the order they were submitted,
+    while different rooms are served concurrently. When the homeserver responds with
+    M_LIMIT_EXCEEDED, all sending is paused for the requested time and the event is retried.
+
+    """
+
+    def __init__(self,
+                 send: Callable[..., Awaitable[Any]],
+                 rate: float,
+                 burst: int,
+                 room_rate: float,
+                 room_burst: int) -> None:
+        """
+        Parameters
+        ----------
+        send : Callable[..., Awaitable[Any]]
+            Coroutine function called with the room id and the submitted arguments to send an event.
+            Returns the homeserver's response.
+
+        rate : float
+            Events per second that may be sent in total.
+
+        burst : int
+            Events that may be sent in total at once before rate applies.
+
+        room_rate : float
+            Events per second that may be sent to a single room.
+
+        room_burst : int
+            Events that may be sent to a single room at once before room_rate applies.
+        """
+        self._send = send
+        self._bucket = TokenBucket(rate, burst)
+        self._room_rate = room_rate
+        self._room_burst = room_burst
+        self._room_buckets: Dict[str, TokenBucket] = {}
+        self._queues: Dict[str, Deque[Tuple[tuple, asyncio.Future]]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._pause = RateLimitPause()
+        # number of room buckets at which idle ones are dropped
+        self._prune_at = 1000
+
+    def submit(self, room_id: str, *args) -> asyncio.Future:
+        """
+        Queues an event to be sent to a room.
+
+        Returns
+        -------
+        asyncio.Future
+            Resolves to the homeserver's response once the event was sent.
+        """
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(room_id)
+        if queue is None:
+            if len(self._room_buckets) >= self._prune_at:
+                self._prune()
+            queue = self._queues[room_id] = deque()
+            task = asyncio.ensure_future(self._drain(room_id, queue))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        queue.append((args, future))
+        return future
+
+    def _prune(self) -> None:
+        for room_id in [
+                room_id for room_id, bucket in self._room_buckets.items()
+                if room_id not in self._queues and bucket.full()
+        ]:
+            del self._room_buckets[room_id]
+        # amortized, rooms that are still limited are not checked again on every submit
+        self._prune_at = max(1000, 2 * len(self._room_buckets))
+
+    async def stop(self) -> None:
+        """
+        Stops sending. Events that were not sent yet are cancelled.
+        """
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        # queues whose task was cancelled before it started
+        for queue in self._queues.values():
+            for _, future in queue:
+                future.cancel()
+        self._queues.clear()
+
+    def depth(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The number of events waiting to be sent.
+        """
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def _wait(self, room_bucket: TokenBucket) -> None:
+        await room_bucket.acquire()
+        await self._pause.wait()
+        await self._bucket.acquire()
+
+    async def _drain(self, room_id: str, queue: Deque) -> None:
+        room_bucket = self._room_buckets.get(room_id)
+        if room_bucket is None:
+            room_bucket = self._room_buckets[room_id] = TokenBucket(
+                self._room_rate, self._room_burst)
+
+        try:
+            while queue:
+                args, future = queue[0]
+                if future.done():
+                    queue.popleft()
+                    continue
+
+                await self._wait(room_bucket)
+                try:
+                    response = await self._send(room_id, *args)
+                except Exception as e:
+                    queue.popleft()
+                    if not future.done():
+                        future.set_exception(e)
+                    continue
+
+                if self._pause.check(response, f"sending to {room_id}"):
+                    continue
+
+                queue.popleft()
+                if not future.done():
+                    future.set_result(response)
+        finally:
+            del self._queues[room_id]
+            for _, future in queue:
+                future.cancel()
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+import markdown
+
+
+class CacheInfo(NamedTuple):
+    hits: int
+    misses: int
+    size: int
+    max_size: int
+
+
+class MarkdownRenderer:
+    """
+    Renders Markdown to HTML, reusing one markdown.Markdown instance per thread
+    and caching the HTML of recently rendered messages.
+
+    """
+
+    extensions = ['fenced_code', 'nl2br']
+
+    def __init__(self, max_size: int = 256, max_message_size: int = 65536) -> None:
+        """
+        Parameters
+        ----------
+        max_size : int, optional
+            Maximum number of rendered messages to keep. 0 disables caching.
+
+        max_message_size : int, optional
+            Messages longer than this many characters are not cached.
+        """
+        self.max_size = max_size
+        self.max_message_size = max_message_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def lookup(self, message: str) -> Optional[str]:
+        """
+        Returns
+        -------
+        Optional[str]
+            The cached HTML of the message, or None if it has not been rendered recently.
+        """
+        with self._lock:
+            html = self._cache.get(message)
+            if html is not None:
+                self._cache.move_to_end(message)
+                self.hits += 1
+            return html
+
+    def render(self, message: str) -> str:
+        """
+        Returns
+        -------
+        str
+            The message rendered as HTML. Thread-safe.
+        """
+        html = self.lookup(message)
+        if html is not None:
+            return html
+
+        md = getattr(self._local, 'markdown', None)
+        if md is None:
+            md = self._local.markdown = markdown.Markdown(
+                extensions=self.extensions)
+        html = md.reset().convert(message)
+
+        with self._lock:
+            self.misses += 1
+            if self.max_size > 0 and len(message) <= self.max_message_size:
+                self._cache[message] = html
+                if len(self._cache) > self.max_size:
+                    self._cache.popitem(last=False)
+        return html
+
+    def cache_info(self) -> CacheInfo:
+        """
+        Returns
+        -------
+        CacheInfo
+            Hits, misses, current and maximum size of the cache.
+        """
+        with self._lock:
+            return CacheInfo(self.hits, self.misses, len(self._cache),
+                             self.max_size)
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._cache.clear()
+            self.hits = 0
+            self.misses = 0
@@ -0,0 +1,263 @@
+import asyncio
+import gzip
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+from nio import AsyncClient, RoomSendResponse, SyncResponse
+
+import logging
+
+if TYPE_CHECKING:
+    from simplematrixbotlib.bot import Bot
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+
+def _redact(value: Any, keys: frozenset) -> Any:
+    if isinstance(value, dict):
+        return {
+            key: ('x' * len(item) if key in keys and isinstance(item, str)
+                  else _redact(item, keys))
+            for key, item in value.items()
+        }
+    if isinstance(value, list):
+        return [_redact(item, keys) for item in value]
+    return value
+
+
+class SyncRecorder:
+    """
+    Writes the raw sync responses of a client to a gzip-compressed file with one JSON object per line,
+    to replay them later with simplematrixbotlib.replay.replay.
+
+    The first line holds the account the responses were recorded with, every further line the time
+    a response was received and the response itself.
+
+    """
+
+    def __init__(self,
+                 path: Path,
+                 redact: Iterable[str] = ("body", "formatted_body")) -> None:
+        """
+        Parameters
+        ----------
+        path : Path
+            The file to write to. An existing file is overwritten.
+
+        redact : Iterable[str], optional
+            Keys whose string values are replaced with as many x's wherever they appear in a response,
+            by default the text of messages.
+        """
+        self.path = Path(path)
+        self.redact = frozenset(redact)
+        self._file = None
+        # a single thread, so responses are written in the order they were received
+        self._executor: ThreadPoolExecutor = None
+
+    def open(self, client: AsyncClient) -> None:
+        self._executor = ThreadPoolExecutor(
+            1, thread_name_prefix='sync-recorder')
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._write({
+            'version': FORMAT_VERSION,
+            'user_id': client.user_id,
+            'device_id': client.device_id,
+            'homeserver': client.homeserver,
+        })
+
+    def close(self) -> None:
+        """
+        Closes the file once the responses recorded so far are written.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _write(self, record: dict) -> None:
+        self._file.write(json.dumps(record, separators=(',', ':')))
+        self._file.write('\n')
+
+    def _write_response(self, data: bytes, received: float,
+                        initial: bool) -> None:
+        body = json.loads(data)
+        if self.redact:
+            body = _redact(body, self.redact)
+        self._write({'time': received, 'initial': initial, 'sync': body})
+
+    def _written(self, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                f"Could not record a sync response: {future.exception()!r}")
+
+    async def record(self, response: SyncResponse,
+                     initial: bool = False) -> None:
+        """
+        Writes a sync response. Parsing, redacting and compressing it happen in a thread,
+        so the sync loop doesn't wait for them.
+
+        Parameters
+        ----------
+        initial : bool, optional
+            Whether this is the sync before the bot's callbacks are set up, whose events are not passed to listeners.
+        """
+        if self._file is None or response.transport_response is None:
+            return
+        # the body was already read by nio, this returns it from memory
+        data = await response.transport_response.read()
+        if self._executor is None:
+            # closed meanwhile
+            return
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, self._write_response, data, time.time(), initial)
+        future.add_done_callback(self._written)
+
+    async def sync_callback(self, response: SyncResponse) -> None:
+        await self.record(response)
+
+
+def read_recording(path: Path) -> Tuple[dict, Iterator[dict]]:
+    """
+    Returns
+    -------
+    Tuple[dict, Iterator[dict]]
+        The account a recording was made with, and its records, read lazily.
+    """
+    file = gzip.open(path, 'rt', encoding='utf-8')
+    header = json.loads(file.readline())
+    if header.get('version') != FORMAT_VERSION:
+        file.close()
+        raise ValueError(f"Unsupported recording format in {path}")
+
+    def records():
+        with file:
+            for line in file:
+                yield json.loads(line)
+
+    return header, records()
+
+
+class ReplayClient(AsyncClient):
+    """
+    A client that answers requests without a homeserver, so handlers can run against a recording.
+    Sent events are accepted and kept in sent, all other requests fail.
+
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.sent: List[Tuple[str, str]] = []
+
+    async def _send(self,
+                    response_class: type,
+                    method: str,
+                    path: str,
+                    data=None,
+                    response_data: Optional[tuple] = None,
+                    **kwargs):
+        if response_class is RoomSendResponse:
+            self.sent.append((response_data[0], data))
+            response = RoomSendResponse(f"$replay{len(self.sent)}",
+                                        response_data[0])
+        else:
+            response = response_class.from_dict(
+                {
+                    'errcode': 'M_UNKNOWN',
+                    'error': 'Not available while replaying'
+                }, *(response_data or ()))
+        await self.receive_response(response)
+        return response
+
+
+class ReplayStats(NamedTuple):
+    responses: int
+    seconds: float
+    sent: int
+
+
+async def replay(bot: "Bot",
+                 path: Path,
+                 speed: Optional[float] = None) -> ReplayStats:
+    """
+    Feeds a recording made with Config.record_sync_path through the bot's callbacks and listener,
+    without connecting to a homeserver.
+
+    Events sent by handlers are accepted without being sent, and can be inspected in
+    bot.async_client.sent. Other requests, e.g. joining rooms, fail.
+
+    Parameters
+    ----------
+    bot : simplematrixbotlib.Bot
+        The bot whose handlers to run. Must not be running.
+
+    path : Path
+        The recording.
+
+    speed : float, optional
+        If given, responses are replayed at their original timing, sped up by this factor, e.g. 1.0 for real time
+        or 2.0 for twice as fast.
+        By default they are replayed as fast as possible.
+
+    Returns
+    -------
+    ReplayStats
+        The number of replayed responses, how long replaying took and the number of events sent by handlers.
+    """
+    import simplematrixbotlib as botlib
+
+    header, records = read_recording(path)
+    client = ReplayClient(header['homeserver'], header['user_id'],
+                          header['device_id'])
+    client.user_id = header['user_id']
+    client.access_token = 'replay'
+    bot.async_client = bot.api.async_client = client
+
+    if bot._need_allow_homeserver_users:
+        _, hs = botlib.api.split_mxid(client.user_id)
+        bot.config.allowlist = set([f"(.+):{hs}"])
+
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    # recorded time and loop time of the first replayed response
+    first_time = first_replayed = None
+    responses = 0
+    for record in records:
+        if record['initial']:
+            await client.receive_response(SyncResponse.from_dict(
+                record['sync']))
+            continue
+
+        if bot.callbacks is None:
+            bot.callbacks = botlib.Callbacks(client, bot)
+            await bot.callbacks.setup_callbacks()
+
+        if speed is not None:
+            if first_time is None:
+                first_time, first_replayed = record['time'], loop.time()
+            delay = (record['time'] - first_time) / speed - (loop.time() -
+                                                             first_replayed)
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+        response = SyncResponse.from_dict(record['sync'])
+        if not isinstance(response, SyncResponse):
+            logger.warning(f"Skipping unreadable sync response: {response}")
+            continue
+        await client.receive_response(response)
+        await client.run_response_callbacks([response])
+        responses += 1
+
+    dispatcher = bot.callbacks and bot.callbacks.dispatcher
+    if dispatcher is not None:
+        while dispatcher.depth():
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+
+    return ReplayStats(responses, loop.time() - start, len(client.sent))
@@ -0,0 +1,490 @@
+import asyncio
+import bisect
+import copy
+import hashlib
+import inspect
+import itertools
+import multiprocessing
+import pickle
+import signal
+import socket
+import struct
+import threading
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Set
+
+from nio import Event, SyncResponse
+
+from simplematrixbotlib.callbacks import Callbacks
+from simplematrixbotlib.dispatch import Dispatcher
+from simplematrixbotlib.metrics import BotMetrics
+from simplematrixbotlib.profiling import HandlerProfiler
+
+import logging
+
+if TYPE_CHECKING:
+    from simplematrixbotlib.bot import Bot
+
+logger = logging.getLogger(__name__)
+
+_HEADER = struct.Struct('!I')
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(
+        hashlib.blake2b(key.encode(), digest_size=8).digest(), 'big')
+
+
+class ShardRing:
+    """
+    Maps rooms to shards by consistent hashing, so the same room always goes to the same shard,
+    across restarts, and changing the number of shards moves only a small share of the rooms.
+
+    """
+
+    def __init__(self, shards: int, replicas: int = 100) -> None:
+        """
+        Parameters
+        ----------
+        shards : int
+            Number of shards.
+
+        replicas : int, optional
+            Points per shard on the ring. More points spread the rooms more evenly.
+        """
+        points = sorted((_hash(f"{shard}:{replica}"), shard)
+                        for shard in range(shards)
+                        for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard(self, room_id: str) -> int:
+        index = bisect.bisect(self._hashes, _hash(room_id))
+        return self._shards[index % len(self._shards)]
+
+
+class _Channel:
+    """
+    Sends pickled messages over a stream socket, each prefixed with its length.
+
+    """
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._drain = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, sock: socket.socket) -> "_Channel":
+        return cls(*await asyncio.open_connection(sock=sock))
+
+    async def send(self, message: tuple) -> None:
+        data = pickle.dumps(message, pickle.HIGHEST_PROTOCOL)
+        # written in one call, so messages sent by different tasks don't interleave
+        self._writer.writelines([_HEADER.pack(len(data)), data])
+        async with self._drain:
+            await self._writer.drain()
+
+    async def receive(self) -> Optional[tuple]:
+        """
+        Returns
+        -------
+        Optional[tuple]
+            The next message, or None once the other side closed the connection.
+        """
+        try:
+            header = await self._reader.readexactly(_HEADER.size)
+            return pickle.loads(await self._reader.readexactly(
+                _HEADER.unpack(header)[0]))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return None
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+def _portable(value: Any) -> Any:
+    # nio responses keep the aiohttp response they were read from, which can't be pickled
+    if getattr(value, 'transport_response', None) is not None:
+        value = copy.copy(value)
+        value.transport_response = None
+    return value
+
+
+class ShardPool:
+    """
+    Runs the listener's handlers in worker processes when Config.shard_workers is set.
+
+    The process that syncs passes every room event to the worker that owns its room, chosen with a ShardRing.
+    Each worker runs the handlers of its events, one event per room at a time, on its own event loop.
+    Calls of bot.api and bot.async_client in a worker are made by the process that syncs,
+    so all workers share its connections, send queue and encryption keys.
+
+    A worker keeps a copy of each of its rooms, which is sent along with an event only when the room
+    is new to the worker or its state changed, as sending a room with thousands of members takes milliseconds.
+    Timings of handler calls are sent back with every handled event, to be recorded in the bot's metrics.
+
+    """
+
+    def __init__(self, bot: "Bot", workers: int,
+                 max_pending: int = 100) -> None:
+        """
+        Parameters
+        ----------
+        bot : simplematrixbotlib.Bot
+            The bot whose handlers to run.
+
+        workers : int
+            Number of worker processes.
+
+        max_pending : int, optional
+            Maximum number of events passed to a worker and not handled yet.
+            When it is reached, passing further events waits, which slows down the sync loop.
+        """
+        self.bot = bot
+        self.workers = workers
+        self.max_pending = max_pending
+        self._ring = ShardRing(workers)
+        self._sockets: List[socket.socket] = []
+        self._processes: List[multiprocessing.Process] = []
+        self._channels: List[Optional[_Channel]] = []
+        self._space: List[asyncio.Semaphore] = []
+        self._pending: List[int] = []
+        self._readers: List[asyncio.Task] = []
+        self._calls: Set[asyncio.Task] = set()
+        # rooms whose current state a worker has, by worker
+        self._sent_rooms: List[Set[str]] = [set() for _ in range(workers)]
+        self._stopping = False
+
+    def start(self) -> None:
+        """
+        Starts the worker processes as copies of this process, including the handlers registered with the listener.
+        Should be called before other threads are started, e.g. before logging in.
+        """
+        try:
+            context = multiprocessing.get_context('fork')
+        except ValueError:
+            raise RuntimeError(
+                "shard_workers needs the fork start method, which is not available on this platform"
+            ) from None
+        for index in range(self.workers):
+            parent, child = socket.socketpair()
+            process = context.Process(target=_worker_main,
+                                      args=(self.bot, index, child,
+                                            self._sockets + [parent]),
+                                      name=f"shard-{index}")
+            process.start()
+            child.close()
+            self._sockets.append(parent)
+            self._processes.append(process)
+
+    async def connect(self, client) -> None:
+        """
+        Passes the account and configuration to the workers, once logged in.
+        """
+        state = {
+            'user_id': client.user_id,
+            'device_id': client.device_id,
+            'homeserver': client.homeserver,
+            'config': self.bot.config,
+        }
+        client.add_event_callback(self._event_callback, Event)
+        client.add_response_callback(self._sync_callback, SyncResponse)
+        for index, sock in enumerate(self._sockets):
+            channel = await _Channel.open(sock)
+            self._channels.append(channel)
+            self._space.append(asyncio.Semaphore(self.max_pending))
+            self._pending.append(0)
+            self._readers.append(asyncio.ensure_future(self._read(index)))
+            await channel.send(('setup', state))
+
+    def _room_changed(self, room_id: str) -> None:
+        self._sent_rooms[self._ring.shard(room_id)].discard(room_id)
+
+    async def _event_callback(self, room, event) -> None:
+        # runs before the handlers' callback, so a state event is passed along with the changed room
+        if event.source.get('state_key') is not None:
+            self._room_changed(room.room_id)
+
+    async def _sync_callback(self, response: SyncResponse) -> None:
+        # state outside of the timeline, e.g. after a gap, reaches a worker with the room's next event
+        for room_id, info in response.rooms.join.items():
+            if info.state:
+                self._room_changed(room_id)
+        for room_id in response.rooms.leave:
+            self._room_changed(room_id)
+
+    def depth(self) -> int:
+        """
+        Returns
+        -------
+        int
+            The number of events passed to the workers and not handled yet.
+        """
+        return sum(self._pending)
+
+    async def submit(self, room, event) -> None:
+        """
+        Passes a room event to the worker that owns the room.
+        """
+        index = self._ring.shard(room.room_id)
+        await self._space[index].acquire()
+        channel = self._channels[index]
+        if channel is None:
+            logger.debug(
+                f"Dropping an event in {room.room_id}, shard worker {index} stopped"
+            )
+            self._space[index].release()
+            return
+        self._pending[index] += 1
+        sent_rooms = self._sent_rooms[index]
+        snapshot = None if room.room_id in sent_rooms else room
+        try:
+            await channel.send(('event', room.room_id, event, snapshot))
+            sent_rooms.add(room.room_id)
+        except Exception:
+            self._pending[index] -= 1
+            self._space[index].release()
+            logger.exception(
+                f"Could not pass an event in {room.room_id} to shard worker {index}"
+            )
+
+    async def _read(self, index: int) -> None:
+        channel = self._channels[index]
+        while True:
+            message = await channel.receive()
+            if message is None:
+                break
+            if message[0] == 'done':
+                self._pending[index] -= 1
+                self._space[index].release()
+                callbacks = self.bot.callbacks
+                if self.bot.metrics is not None and callbacks is not None:
+                    for name, duration, failed in message[1]:
+                        callbacks._observe_handler(name, duration, failed)
+            else:
+                task = asyncio.ensure_future(self._serve(channel,
+                                                         *message[1:]))
+                self._calls.add(task)
+                task.add_done_callback(self._calls.discard)
+
+        if not self._stopping:
+            logger.error(
+                f"Shard worker {index} stopped, events of its rooms are dropped"
+            )
+        self._channels[index] = None
+        # wake up everyone waiting to pass an event to this worker
+        for _ in range(self.max_pending):
+            self._space[index].release()
+
+    async def _serve(self, channel: _Channel, call_id: int, target: str,
+                     name: str, args: tuple, kwargs: dict) -> None:
+        try:
+            if name.startswith('_'):
+                raise AttributeError(name)
+            obj = self.bot.api if target == 'api' else self.bot.async_client
+            result = getattr(obj, name)(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            message = ('result', call_id, _portable(result))
+        except Exception as e:
+            message = ('error', call_id, e)
+
+        try:
+            await channel.send(message)
+        except ConnectionError:
+            pass
+        except Exception:
+            await channel.send(('error', call_id,
+                                RuntimeError(
+                                    f"{name} returned a value that can't be passed to a worker: {message[2]!r}"
+                                )))
+
+    async def stop(self) -> None:
+        """
+        Stops the workers. Events they did not handle yet are dropped.
+        """
+        self._stopping = True
+        if self._channels:
+            for channel in self._channels:
+                if channel is not None:
+                    channel.close()
+        else:
+            # not connected yet
+            for sock in self._sockets:
+                sock.close()
+        for task in self._calls:
+            task.cancel()
+        await asyncio.gather(*self._readers, *self._calls,
+                             return_exceptions=True)
+
+        def join():
+            for process in self._processes:
+                process.join(10)
+                if process.is_alive():
+                    logger.warning(
+                        f"Shard worker {process.name} did not stop, terminating it"
+                    )
+                    process.terminate()
+                    process.join()
+
+        await asyncio.get_running_loop().run_in_executor(None, join)
+
+
+class _Remote:
+    """
+    Forwards calls of coroutine methods to the same object in the process that syncs.
+
+    """
+
+    def __init__(self, worker: "_ShardWorker", target: str) -> None:
+        self._worker = worker
+        self._target = target
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+
+        async def call(*args, **kwargs):
+            return await self._worker.call(self._target, name, args, kwargs)
+
+        call.__name__ = name
+        return call
+
+
+class ShardClient(_Remote):
+    """
+    Stands in for bot.async_client in a shard worker. Its coroutine methods, e.g. room_get_state,
+    are called on the client of the process that syncs, with picklable arguments and return values.
+
+    Attributes
+    ----------
+    rooms : Dict[str, nio.rooms.MatrixRoom]
+        Copies of the rooms of the events the worker handled, updated when their state changes.
+    """
+
+    def __init__(self, worker: "_ShardWorker") -> None:
+        super().__init__(worker, 'client')
+        self.user_id: str = None
+        self.device_id: str = None
+        self.homeserver: str = None
+        self.rooms: Dict[str, Any] = {}
+
+
+class _WorkerCallbacks(Callbacks):
+    """
+    Collects the timings of handler calls instead of recording them, to send them to the process that syncs.
+
+    """
+
+    def __init__(self, async_client, bot) -> None:
+        super().__init__(async_client, bot)
+        self.observed: List[tuple] = []
+
+    def _observe_handler(self, name: str, duration: float,
+                         failed: bool) -> None:
+        self.observed.append((name, duration, failed))
+
+
+class _ShardWorker:
+
+    def __init__(self, bot: "Bot", index: int) -> None:
+        self.bot = bot
+        self.index = index
+        self._channel: _Channel = None
+        self._calls: Dict[int, asyncio.Future] = {}
+        self._ids = itertools.count()
+
+    async def call(self, target: str, name: str, args: tuple,
+                   kwargs: dict) -> Any:
+        call_id = next(self._ids)
+        future = self._calls[call_id] = asyncio.get_running_loop(
+        ).create_future()
+        try:
+            await self._channel.send(
+                ('call', call_id, target, name, args, kwargs))
+            return await future
+        finally:
+            self._calls.pop(call_id, None)
+
+    def _setup(self, state: dict) -> Dispatcher:
+        bot = self.bot
+        bot.config = state['config']
+        client = ShardClient(self)
+        client.user_id = state['user_id']
+        client.device_id = state['device_id']
+        client.homeserver = state['homeserver']
+        api = _Remote(self, 'api')
+        api.creds, api.config, api.async_client = bot.creds, bot.config, client
+        bot.api = api
+        bot.async_client = client
+        # only to enable timing handlers, they are recorded by the process that syncs
+        bot.metrics = BotMetrics() if bot.config.metrics_port else None
+        if bot.config.profile_handlers:
+            bot.profiler = HandlerProfiler(bot.config.slow_handler_threshold,
+                                           bot.config.profile_slowest)
+        bot.callbacks = _WorkerCallbacks(client, bot)
+        # unbounded, the process that syncs limits the events passed to a worker
+        dispatcher = Dispatcher(max(bot.config.dispatch_workers, 1))
+        dispatcher.start()
+        return dispatcher
+
+    async def _handle(self, room, event) -> None:
+        callbacks = self.bot.callbacks
+        try:
+            await callbacks._run_handlers(room, event)
+        finally:
+            observed, callbacks.observed = callbacks.observed, []
+            await self._channel.send(('done', observed))
+
+    async def main(self, sock: socket.socket) -> None:
+        self._channel = await _Channel.open(sock)
+        dispatcher = None
+        try:
+            while True:
+                message = await self._channel.receive()
+                if message is None:
+                    break
+                kind = message[0]
+                if kind == 'event':
+                    _, room_id, event, snapshot = message
+                    rooms = self.bot.async_client.rooms
+                    if snapshot is not None:
+                        rooms[room_id] = snapshot
+                    room = rooms[room_id]
+                    await dispatcher.submit(room_id, self._handle, room,
+                                            event)
+                elif kind in ('result', 'error'):
+                    future = self._calls.get(message[1])
+                    if future is None or future.done():
+                        continue
+                    if kind == 'result':
+                        future.set_result(message[2])
+                    else:
+                        future.set_exception(message[2])
+                elif kind == 'setup':
+                    dispatcher = self._setup(message[1])
+        finally:
+            if dispatcher is not None:
+                await dispatcher.stop()
+            self._channel.close()
+
+
+def _worker_main(bot: "Bot", index: int, sock: socket.socket,
+                 parent_sockets: List[socket.socket]) -> None:
+    # otherwise closing them in the parent wouldn't stop the workers
+    for parent in parent_sockets:
+        parent.close()
+    # the process that syncs stops the workers by closing the connection
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    try:
+        signal.set_wakeup_fd(-1)
+    except ValueError:
+        pass
+    # the parent's event loop was copied into this process and counts as running,
+    # so the worker's loop runs in a new thread
+    thread = threading.Thread(target=asyncio.run,
+                              args=(_ShardWorker(bot, index).main(sock), ),
+                              name=f"shard-{index}")
+    thread.start()
+    thread.join()
@@ -0,0 +1,103 @@
+import abc
+import asyncio
+import os
+import time
+from pathlib import Path
+from typing import Optional
+
+from nio import AsyncClient
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def client_file_path(prefix: str, client: AsyncClient,
+                     directory: Optional[Path]) -> Path:
+    """
+    Returns
+    -------
+    Path
+        A JSON file for the client's account and device, in directory or the working directory.
+    """
+    name = f"{prefix}_{client.user_id}_{client.device_id}.json".replace(
+        ':', '_')
+    return Path(directory or '.').joinpath(name)
+
+
+class StateFile(abc.ABC):
+    """
+    State of a bot saved to a file, which is replaced atomically on every save.
+    Saves after syncs are written in a thread, one at a time.
+
+    """
+
+    def __init__(self, path: Optional[Path], save_interval: float) -> None:
+        """
+        Parameters
+        ----------
+        path : Path, optional
+            The file to save to and load from. None doesn't save.
+
+        save_interval : float
+            Minimum number of seconds between saves after syncs.
+        """
+        self.path = None if path is None else Path(path)
+        self.save_interval = save_interval
+        self._saved_at = 0.0
+        self._saving: Optional[asyncio.Future] = None
+
+    @abc.abstractmethod
+    def dumps(self) -> str:
+        pass
+
+    def write(self, data: str) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.path)
+
+    def save(self) -> None:
+        """
+        Saves the state to path, if set.
+        """
+        if self.path is not None:
+            self.write(self.dumps())
+            self._saved_at = time.monotonic()
+
+    async def close(self) -> None:
+        """
+        Saves the state once a save started after a sync has finished, so it can't overwrite this one.
+        """
+        if self._saving is not None:
+            await asyncio.gather(self._saving, return_exceptions=True)
+            self._saving = None
+        self.save()
+
+    def _save_in_background(self) -> bool:
+        """
+        Saves the state in a thread, unless save_interval hasn't passed since the last save or a save is still running.
+
+        Returns
+        -------
+        boolean
+            True if a save was started.
+        """
+        if self.path is None or time.monotonic(
+        ) - self._saved_at < self.save_interval:
+            return False
+        if self._saving is not None and not self._saving.done():
+            return False
+        self._saved_at = time.monotonic()
+        # serialised on the loop, as the state changes while syncing
+        data = self.dumps()
+        self._saving = asyncio.get_running_loop().run_in_executor(
+            None, self.write, data)
+        self._saving.add_done_callback(self._saved)
+        return True
+
+    def _saved(self, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(
+                f"Could not save {self.path}: {future.exception()!r}")
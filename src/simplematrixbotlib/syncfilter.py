@@ -0,0 +1,105 @@
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+import nio
+from nio import (CallEvent, InviteEvent, MegolmEvent, PowerLevelsEvent,
+                 ReactionEvent, RedactionEvent, RoomAliasEvent,
+                 RoomAvatarEvent, RoomCreateEvent, RoomEncryptionEvent,
+                 RoomGuestAccessEvent, RoomHistoryVisibilityEvent,
+                 RoomJoinRulesEvent, RoomMemberEvent, RoomMessage,
+                 RoomNameEvent, RoomSpaceChildEvent, RoomSpaceParentEvent,
+                 RoomTopicEvent, RoomUpgradeEvent, StickerEvent)
+
+if TYPE_CHECKING:
+    from simplematrixbotlib.bot import Bot
+
+# state events in the timeline, which nio needs to keep room state and encryption up to date
+_STATE_EVENT_TYPES = [
+    (RoomCreateEvent, "m.room.create"),
+    (RoomMemberEvent, "m.room.member"),
+    (PowerLevelsEvent, "m.room.power_levels"),
+    (RoomJoinRulesEvent, "m.room.join_rules"),
+    (RoomHistoryVisibilityEvent, "m.room.history_visibility"),
+    (RoomGuestAccessEvent, "m.room.guest_access"),
+    (RoomEncryptionEvent, "m.room.encryption"),
+    (RoomNameEvent, "m.room.name"),
+    (RoomTopicEvent, "m.room.topic"),
+    (RoomAvatarEvent, "m.room.avatar"),
+    (RoomAliasEvent, "m.room.canonical_alias"),
+    (RoomUpgradeEvent, "m.room.tombstone"),
+    (RoomSpaceChildEvent, "m.space.child"),
+    (RoomSpaceParentEvent, "m.space.parent"),
+]
+
+# event types of listeners that a sync filter can be restricted to
+_EVENT_TYPES = _STATE_EVENT_TYPES + [
+    (RoomMessage, "m.room.message"),
+    (ReactionEvent, "m.reaction"),
+    (MegolmEvent, "m.room.encrypted"),
+    (RedactionEvent, "m.room.redaction"),
+    (StickerEvent, "m.sticker"),
+    (CallEvent, "m.call.*"),
+]
+
+
+def _timeline_types(event_types: List[type]) -> Optional[List[str]]:
+    types = [matrix_type for _, matrix_type in _STATE_EVENT_TYPES]
+    # undecryptable events are always passed to the decryption failure callback
+    types.append("m.room.encrypted")
+
+    for event_type in event_types:
+        if issubclass(event_type, InviteEvent):
+            # invites are not subject to the timeline filter
+            continue
+        if issubclass(event_type, nio.events.to_device.ToDeviceEvent):
+            continue
+        for handled_type, matrix_type in _EVENT_TYPES:
+            if issubclass(event_type, handled_type):
+                if matrix_type not in types:
+                    types.append(matrix_type)
+                break
+        else:
+            # a listener for e.g. all events or unknown events, which can't be filtered
+            return None
+
+    return types
+
+
+def build_sync_filter(bot: "Bot") -> Dict[str, Any]:
+    """
+    Builds a sync filter that only requests the events the bot's listeners and callbacks handle.
+
+    Presence, typing notifications, read receipts and account data are never
+    requested. Room members are loaded lazily. Timeline events are restricted
+    to the types of the registered listeners and the state events needed to
+    keep track of rooms, unless a listener handles events that can't be
+    restricted by type, e.g. nio.Event or nio.UnknownEvent.
+
+    Parameters
+    ----------
+    bot : simplematrixbotlib.Bot
+
+    Returns
+    -------
+    Dict[str, Any]
+        Keyword arguments for nio.AsyncClient.upload_filter.
+    """
+    nothing = {"not_types": ["*"]}
+    timeline: Dict[str, Any] = {"lazy_load_members": True}
+
+    types = _timeline_types(
+        [event_type for _, event_type in bot.listener._registry])
+    if types is not None:
+        timeline["types"] = types
+
+    return {
+        "presence": nothing,
+        "account_data": nothing,
+        "room": {
+            "state": {
+                "lazy_load_members": True
+            },
+            "timeline": timeline,
+            "ephemeral": nothing,
+            "account_data": nothing,
+        },
+    }
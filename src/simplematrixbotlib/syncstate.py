@@ -0,0 +1,140 @@
+import json
+from pathlib import Path
+from typing import Any, Dict, Optional
+
+from nio import AsyncClient, MatrixRoom
+from nio.rooms import RoomSummary
+
+from simplematrixbotlib.statefile import StateFile, client_file_path
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+
+# room attributes kept across restarts; members are fetched again by nio when needed
+_ROOM_ATTRIBUTES = ('name', 'canonical_alias', 'topic', 'room_version',
+                    'room_type', 'join_rule', 'room_avatar_url')
+
+
+def _snapshot_room(room: MatrixRoom) -> Dict[str, Any]:
+    snapshot = {
+        attribute: getattr(room, attribute)
+        for attribute in _ROOM_ATTRIBUTES
+        if getattr(room, attribute, None) is not None
+    }
+    snapshot['encrypted'] = room.encrypted
+    snapshot['summary'] = [
+        room.summary.invited_member_count, room.summary.joined_member_count,
+        room.summary.heroes
+    ] if room.summary else None
+    return snapshot
+
+
+def _restore_room(room_id: str, own_user_id: str,
+                  snapshot: Dict[str, Any]) -> MatrixRoom:
+    room = MatrixRoom(room_id, own_user_id, snapshot.get('encrypted', False))
+    for attribute in _ROOM_ATTRIBUTES:
+        if attribute in snapshot:
+            setattr(room, attribute, snapshot[attribute])
+    if snapshot.get('summary'):
+        room.summary = RoomSummary(*snapshot['summary'])
+    return room
+
+
+class SyncState(StateFile):
+    """
+    Saves the sync token and a compact snapshot of the joined rooms of a client to a file,
+    so the bot can resume with an incremental sync after a restart.
+
+    """
+
+    def __init__(self,
+                 client: AsyncClient,
+                 path: Path,
+                 save_interval: float = 60) -> None:
+        """
+        Parameters
+        ----------
+        client : nio.AsyncClient
+            The client whose state to save and restore.
+
+        path : Path
+            The file to save to and load from.
+
+        save_interval : float, optional
+            Minimum number of seconds between saves after syncs.
+        """
+        super().__init__(path, save_interval)
+        self.client = client
+
+    @classmethod
+    def for_client(cls, client: AsyncClient, directory: Optional[Path],
+                   **kwargs) -> "SyncState":
+        """
+        Returns
+        -------
+        SyncState
+            The sync state of the client's account and device, stored in directory or the working directory.
+        """
+        return cls(client, client_file_path('sync_state', client, directory),
+                   **kwargs)
+
+    def load(self) -> bool:
+        """
+        Restores the sync token and the joined rooms of the client.
+
+        Returns
+        -------
+        boolean
+            True if a saved state was restored.
+        """
+        client = self.client
+        try:
+            with open(self.path, 'r') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable sync state {self.path}: {e}")
+            return False
+
+        if state.get('version') != FORMAT_VERSION or state.get(
+                'user_id') != client.user_id or not state.get('next_batch'):
+            return False
+
+        for room_id, snapshot in state['rooms'].items():
+            client.rooms[room_id] = _restore_room(room_id, client.user_id,
+                                                  snapshot)
+            if snapshot.get('encrypted'):
+                client.encrypted_rooms.add(room_id)
+        client.next_batch = state['next_batch']
+        return True
+
+    def dumps(self) -> str:
+        client = self.client
+        return json.dumps(
+            {
+                'version': FORMAT_VERSION,
+                'user_id': client.user_id,
+                'next_batch': client.next_batch,
+                'rooms': {
+                    room_id: _snapshot_room(room)
+                    for room_id, room in client.rooms.items()
+                },
+            },
+            separators=(',', ':'))
+
+    def save(self) -> None:
+        """
+        Saves the sync token and joined rooms of the client.
+        """
+        if self.client.next_batch:
+            super().save()
+
+    async def sync_callback(self, response) -> None:
+        """
+        Saves the state in a thread if save_interval has passed since the last save.
+        """
+        self._save_in_background()
@@ -0,0 +1,88 @@
+import asyncio
+from unittest import mock
+from nio import RoomSendError, RoomSendResponse
+import simplematrixbotlib as botlib
+
+
+def test_http_session():
+    config = botlib.Config()
+    config.http_connection_limit = 7
+    api = botlib.Api(botlib.Creds("https://example.org", "user", "pass"),
+                     config)
+
+    async def main():
+        session = api.http_session
+        assert session is api.http_session
+        assert session.connector.limit == 7
+        # set up like nio's own session
+        assert session.timeout.total == 60
+        assert session.trace_configs
+        await api.close()
+        assert session.closed
+
+    asyncio.run(main())
+
+
+def test_broadcast():
+    api = botlib.Api(botlib.Creds("https://example.org", "user", "pass"),
+                     botlib.Config())
+    api.async_client = mock.MagicMock()
+    api.async_client.olm = None
+    attempts = []
+    running = 0
+    max_running = 0
+
+    async def room_send(room_id, message_type, content,
+                        ignore_unverified_devices):
+        nonlocal running, max_running
+        attempts.append(room_id)
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        if room_id == "!limited" and attempts.count(room_id) == 1:
+            return RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 10)
+        if room_id == "!forbidden":
+            return RoomSendError("Forbidden", "M_FORBIDDEN")
+        if room_id == "!broken":
+            raise ValueError(room_id)
+        return RoomSendResponse(f"${room_id}", room_id)
+
+    api.async_client.room_send = room_send
+    room_ids = [f"!room{i}" for i in range(20)
+                ] + ["!limited", "!forbidden", "!broken", "!room0"]
+
+    report = asyncio.run(
+        api.broadcast(room_ids, {
+            "msgtype": "m.text",
+            "body": "hello"
+        },
+                      concurrency=4))
+
+    assert max_running <= 4
+    assert len(report.sent) == 21
+    assert report.sent["!limited"] == "$!limited"
+    assert attempts.count("!limited") == 2
+    assert attempts.count("!room0") == 1
+    assert report.failed["!forbidden"].status_code == "M_FORBIDDEN"
+    assert isinstance(report.failed["!broken"], ValueError)
+
+
+def test_room_send_rechecks_unverified_device():
+    from nio.exceptions import OlmUnverifiedDeviceError
+
+    api = botlib.Api(botlib.Creds("https://example.org", "user", "pass"),
+                     botlib.Config())
+    api.async_client = mock.MagicMock()
+    device = mock.MagicMock(user_id="@alice:example.org", device_id="A1")
+    api.async_client.room_send = mock.AsyncMock(side_effect=[
+        OlmUnverifiedDeviceError(device),
+        RoomSendResponse("$1", "!room")
+    ])
+    api.async_client.rooms = {"!room": mock.MagicMock(users=[])}
+    api.device_trust._checked["@alice:example.org"] = {"A1"}
+
+    response = asyncio.run(api._room_send("!room", {}, "m.room.message",
+                                          False))
+    assert response.event_id == "$1"
+    assert "@alice:example.org" not in api.device_trust._checked
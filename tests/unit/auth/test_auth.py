@@ -0,0 +1,23 @@
+import asyncio
+import pytest
+from simplematrixbotlib.auth import Creds
+from simplematrixbotlib.crypto import Wrapper
+
+
+def test_lazy_key(tmp_path):
+    session_file = str(tmp_path / "session.txt")
+    creds = Creds("https://example.org", "user", "pass", session_stored_file=session_file)
+    assert creds._session_key is None
+
+    key = asyncio.run(creds.derive_key())
+    assert key == Wrapper.key_from_pass("pass")
+
+    creds.device_id, creds.access_token = "DEVICE", "token"
+    creds.session_write_file()
+
+    creds = Creds("https://example.org", "user", "pass", session_stored_file=session_file, session_key=key)
+    creds.session_read_file()
+    assert (creds.device_id, creds.access_token) == ("DEVICE", "token")
+
+    with pytest.raises(ValueError):
+        Creds("https://example.org", "user")
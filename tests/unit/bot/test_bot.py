@@ -0,0 +1,117 @@
+import asyncio
+from unittest import mock
+from simplematrixbotlib.bot import Bot
+from simplematrixbotlib.config import Config
+from simplematrixbotlib.listener import Listener
+
+
+def test_startup_actions():
+    bot = mock.MagicMock()
+    bot.config = Config()
+    bot.config.startup_concurrency = 2
+    bot.profiler = None
+    bot.listener = Listener(bot)
+    bot.async_client.rooms = {f"!room{i}": None for i in range(6)}
+    running = []
+    peak = []
+    done = []
+
+    @bot.listener.on_startup
+    async def action(room_id):
+        running.append(room_id)
+        peak.append(len(running))
+        await asyncio.sleep(0.01)
+        running.remove(room_id)
+        if room_id == "!room3":
+            raise RuntimeError("failure in a single room")
+        done.append(room_id)
+
+    asyncio.run(Bot._run_startup_actions(bot))
+
+    assert max(peak) == 2
+    assert sorted(done) == ["!room0", "!room1", "!room2", "!room4", "!room5"]
+
+
+def test_run_shuts_down_process_pool():
+    bot = mock.MagicMock()
+    pool = bot._process_pool = mock.MagicMock()
+
+    async def main():
+        raise RuntimeError("stopped")
+
+    bot.main = main
+    try:
+        Bot.run(bot)
+    except RuntimeError:
+        pass
+    pool.shutdown.assert_called_once_with(cancel_futures=True)
+    assert bot._process_pool is None
+
+
+def test_metrics_server_stopped_when_login_fails():
+    from simplematrixbotlib.auth import Creds
+
+    config = Config()
+    config.metrics_port = 9100
+    bot = Bot(Creds("https://example.org", "user", "pass"), config)
+    runner = mock.MagicMock()
+    runner.cleanup = mock.AsyncMock()
+
+    async def start_metrics():
+        bot._metrics_runner = runner
+
+    async def login_fails():
+        raise ValueError("Invalid Homeserver")
+
+    bot._start_metrics = start_metrics
+    bot._main = login_fails
+    try:
+        asyncio.run(bot.main())
+    except ValueError:
+        pass
+    runner.cleanup.assert_awaited_once()
+    assert bot._metrics_runner is None
+
+
+def test_reset():
+    from simplematrixbotlib.auth import Creds
+    from simplematrixbotlib.dispatch import Dispatcher
+
+    bot = Bot(Creds("https://example.org", "user", "pass"), Config())
+
+    async def main():
+        dispatcher = Dispatcher(2)
+        dispatcher.start()
+        bot.callbacks = mock.MagicMock(dispatcher=dispatcher,
+                                       join_scheduler=None,
+                                       decryption_failures=None)
+        bot.metrics = bot.api.metrics = mock.MagicMock()
+        bot.profiler = mock.MagicMock()
+        await bot._reset()
+        assert not dispatcher._tasks
+        assert bot.callbacks is None and bot.metrics is None
+        assert bot.api.metrics is None and bot.profiler is None
+
+    asyncio.run(main())
+
+
+def test_observe_sync():
+    from simplematrixbotlib.api import _on_request_end
+    from simplematrixbotlib.metrics import BotMetrics
+
+    bot = mock.MagicMock()
+    bot.metrics = BotMetrics()
+    response = mock.MagicMock()
+    transport_response = mock.MagicMock()
+
+    async def main():
+        await _on_request_end(None, None,
+                              mock.MagicMock(response=transport_response))
+        response.transport_response = transport_response
+        await Bot._observe_sync(bot, response)
+        # responses without a receive time, e.g. replayed ones, are not observed
+        response.transport_response = None
+        await Bot._observe_sync(bot, response)
+
+    asyncio.run(main())
+    assert bot.metrics.sync_duration.count() == 1
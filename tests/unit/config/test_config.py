@@ -107,7 +107,35 @@ def test_write_toml():
         "ignore_unverified_devices = true\n"
         "allowlist = []\n"
         "blocklist = []\n"
-        "first_sync_full = false\n")
+        "first_sync_full = false\n"
+        "send_queue = false\n"
+        "send_rate = 0.2\n"
+        "send_burst = 10\n"
+        "room_send_rate = 1.0\n"
+        "room_send_burst = 5\n"
+        "dispatch_workers = 0\n"
+        "dispatch_queue_size = 1000\n"
+        "process_workers = 0\n"
+        "markdown_executor_threshold = 4096\n"
+        "markdown_cache_size = 256\n"
+        "startup_concurrency = 10\n"
+        "startup_in_background = false\n"
+        "http_connection_limit = 100\n"
+        "sync_timeout = 30000\n"
+        "sync_full_state = false\n"
+        "sync_filter = true\n"
+        "warm_restart = false\n"
+        "join_concurrency = 5\n"
+        "decryption_failure_window = 60.0\n"
+        "metrics_port = 0\n"
+        "metrics_host = \"127.0.0.1\"\n"
+        "profile_handlers = false\n"
+        "slow_handler_threshold = 1.0\n"
+        "profile_slowest = 0\n"
+        "record_sync_redact = [ \"body\", \"formatted_body\",]\n"
+        "shard_workers = 0\n"
+        "event_dedup_size = 10000\n"
+        "event_dedup_persist = false\n")
     assert os.path.isfile(tmp_file)
     with open(tmp_file, 'r') as f:
         assert f.read() == default_values
@@ -177,3 +205,23 @@ def test_manual_set():
     config = UpperConfig()
     config.simple_setting = "test"
     assert config.simple_setting == "TEST"
+
+
+def test_allowed_user():
+    config = botlib.Config()
+    assert config._is_allowed_user("@anyone:example.org")
+
+    config.allowlist = {'.*:example\\.org', '@test:matrix\\.org'}
+    config.blocklist = {'@spam:example\\.org'}
+    assert config._is_allowed_user("@test:example.org")
+    assert config._is_allowed_user("@test:matrix.org")
+    assert not config._is_allowed_user("@test2:matrix.org")
+    assert not config._is_allowed_user("@spam:example.org")
+    # cached decisions are dropped when the lists change
+    config.remove_blocklist({'@spam:example\\.org'})
+    assert config._is_allowed_user("@spam:example.org")
+    config.add_blocklist({'@(.+):example\\.org'})
+    assert not config._is_allowed_user("@test:example.org")
+    config.allowlist = {'(@.)\\1:matrix\\.org'}
+    assert config._is_allowed_user("@a@a:matrix.org")
+    assert not config._is_allowed_user("@test:matrix.org")
@@ -0,0 +1,45 @@
+import asyncio
+from unittest import mock
+from simplematrixbotlib.decryption import DecryptionFailures
+
+
+def make_event(event_id, session_id):
+    event = mock.MagicMock()
+    event.event_id = event_id
+    event.session_id = session_id
+    return event
+
+
+def test_decryption_failures():
+    reports = []
+    requests = []
+
+    async def report(room_id, session_id, events):
+        reports.append((room_id, session_id, len(events)))
+
+    async def request_key(event):
+        requests.append(event.session_id)
+        if event.session_id == "s2":
+            raise Exception("A key sharing request is already sent out")
+
+    async def main():
+        failures = DecryptionFailures(report, request_key, window=0.01)
+        for i in range(10):
+            failures.add("!a", make_event(f"$a{i}", "s1"))
+        failures.add("!a", make_event("$a10", "s2"))
+        failures.add("!b", make_event("$b0", "s3"))
+        assert failures.pending() == 12
+        assert reports == []
+
+        await asyncio.sleep(0.05)
+        assert failures.pending() == 0
+        assert sorted(reports) == [("!a", "s1", 10), ("!a", "s2", 1),
+                                   ("!b", "s3", 1)]
+        assert sorted(requests) == ["s1", "s2", "s3"]
+
+        # a new window starts with the next failure
+        failures.add("!a", make_event("$a11", "s1"))
+        await asyncio.sleep(0.05)
+        assert reports[-1] == ("!a", "s1", 1)
+
+    asyncio.run(main())
@@ -0,0 +1,78 @@
+import asyncio
+from unittest import mock
+
+from simplematrixbotlib.callbacks import Callbacks
+from simplematrixbotlib.dedup import EventDeduplicator
+
+
+def test_event_deduplicator(tmp_path):
+    dedup = EventDeduplicator(size=3)
+    assert not dedup.seen("$1")
+    assert not dedup.seen("$2")
+    assert dedup.seen("$1")
+    assert not dedup.seen("$3")
+    # the least recently seen ID is forgotten
+    assert not dedup.seen("$4")
+    assert len(dedup) == 3
+    assert dedup.seen("$1")
+    assert not dedup.seen("$2")
+
+    client = mock.MagicMock(user_id="@bot:example.org", device_id="DEVICE")
+    saved = EventDeduplicator.for_client(client, tmp_path, size=3)
+    assert saved.path.name == "seen_events_@bot_example.org_DEVICE.json"
+    assert not saved.load()
+    for event_id in ("$1", "$2", "$3", "$4"):
+        saved.seen(event_id)
+    saved.save()
+
+    restored = EventDeduplicator.for_client(client, tmp_path, size=2)
+    assert restored.load()
+    assert len(restored) == 2
+    assert restored.seen("$4")
+    assert not restored.seen("$2")
+
+
+def test_event_callback_dedup():
+    bot = mock.MagicMock()
+    bot.metrics = None
+    bot.profiler = None
+    bot.shards = None
+    handled = []
+
+    async def handler(room, event):
+        handled.append(event.event_id)
+
+    bot.listener._registry = [[handler, object]]
+    callbacks = Callbacks(mock.MagicMock(), bot)
+    callbacks.dedup = EventDeduplicator()
+
+    async def main():
+        for event_id in ("$1", "$2", "$1"):
+            await callbacks.event_callback(mock.MagicMock(),
+                                           mock.MagicMock(event_id=event_id))
+
+    asyncio.run(main())
+    assert handled == ["$1", "$2"]
+
+
+def test_save_after_sync(tmp_path):
+    client = mock.MagicMock(user_id="@bot:example.org", device_id="DEVICE")
+    dedup = EventDeduplicator.for_client(client, tmp_path)
+
+    async def main():
+        # nothing new, nothing to save
+        await dedup.sync_callback(None)
+        assert dedup._saving is None
+
+        dedup.seen("$1")
+        await dedup.sync_callback(None)
+        saving = dedup._saving
+        dedup.seen("$2")
+        # waits for the save started after the sync, then saves the newer IDs
+        await dedup.close()
+        assert saving.done()
+
+    asyncio.run(main())
+    restored = EventDeduplicator(path=dedup.path)
+    assert restored.load()
+    assert restored.seen("$1") and restored.seen("$2")
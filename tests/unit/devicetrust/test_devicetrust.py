@@ -0,0 +1,89 @@
+import asyncio
+from unittest import mock
+from nio import SyncResponse
+from nio.responses import DeviceList
+from simplematrixbotlib.devicetrust import DeviceTrustCache
+
+
+class FakeOlm:
+
+    def __init__(self, devices):
+        self.device_store = devices
+        self.verified = set()
+        self.blacklisted = set()
+        self.checks = 0
+
+    def is_device_verified(self, device):
+        self.checks += 1
+        return device in self.verified
+
+    def is_device_blacklisted(self, device):
+        return device in self.blacklisted
+
+    def blacklist_device(self, device):
+        self.blacklisted.add(device)
+
+
+def test_blacklist_unverified():
+    olm = FakeOlm({
+        "@alice:example.org": {
+            "A1": "alice1",
+            "A2": "alice2"
+        },
+        "@bob:example.org": {
+            "B1": "bob1"
+        },
+    })
+    olm.verified.add("alice1")
+    cache = DeviceTrustCache()
+    users = ["@alice:example.org", "@bob:example.org"]
+
+    assert cache.blacklist_unverified(olm, users) == {
+        "@alice:example.org": ["A2"],
+        "@bob:example.org": ["B1"]
+    }
+    assert olm.blacklisted == {"alice2", "bob1"}
+
+    # nothing changed, so no device is looked at again
+    olm.checks = 0
+    assert cache.blacklist_unverified(olm, users) == {}
+    assert olm.checks == 0
+
+    # only the new device is looked at
+    olm.device_store["@bob:example.org"]["B2"] = "bob2"
+    assert cache.blacklist_unverified(olm, users) == {
+        "@bob:example.org": ["B2"]
+    }
+    assert olm.checks == 1
+
+
+def test_response_callback():
+    cache = DeviceTrustCache()
+    olm = FakeOlm({"@alice:example.org": {"A1": "alice1"}})
+    cache.blacklist_unverified(olm, ["@alice:example.org"])
+
+    response = mock.MagicMock(spec=SyncResponse)
+    response.device_list = DeviceList(["@alice:example.org"],
+                                      ["@bob:example.org"])
+    asyncio.run(cache.response_callback(response))
+    assert "@alice:example.org" in cache._changed
+
+    olm.checks = 0
+    cache.blacklist_unverified(olm, ["@alice:example.org"])
+    assert "@alice:example.org" not in cache._changed
+    assert olm.checks == 0
+
+
+def test_trust_changed():
+    cache = DeviceTrustCache()
+    olm = FakeOlm({"@alice:example.org": {"A1": "alice1"}})
+    olm.verified.add("alice1")
+    assert cache.blacklist_unverified(olm, ["@alice:example.org"]) == {}
+
+    # unverified later, checked again once the user is forgotten
+    olm.verified.clear()
+    assert cache.blacklist_unverified(olm, ["@alice:example.org"]) == {}
+    cache.forget(["@alice:example.org"])
+    assert cache.blacklist_unverified(olm, ["@alice:example.org"]) == {
+        "@alice:example.org": ["A1"]
+    }
@@ -0,0 +1,26 @@
+import asyncio
+from simplematrixbotlib.dispatch import Dispatcher
+
+
+def test_dispatcher():
+    handled = []
+
+    async def handler(room_id, number, delay):
+        await asyncio.sleep(delay)
+        handled.append((room_id, number))
+
+    async def main():
+        dispatcher = Dispatcher(workers=2, queue_size=3)
+        dispatcher.start()
+        await dispatcher.submit("!slow", handler, "!slow", 1, 0.05)
+        await dispatcher.submit("!slow", handler, "!slow", 2, 0)
+        await dispatcher.submit("!fast", handler, "!fast", 1, 0)
+        await dispatcher.submit("!fast", handler, "!fast", 2, 0)
+        while dispatcher.depth():
+            await asyncio.sleep(0.01)
+        await dispatcher.stop()
+
+    asyncio.run(main())
+
+    assert handled[:2] == [("!fast", 1), ("!fast", 2)]
+    assert handled[2:] == [("!slow", 1), ("!slow", 2)]
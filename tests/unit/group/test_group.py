@@ -0,0 +1,84 @@
+import asyncio
+from unittest import mock
+
+import pytest
+
+from simplematrixbotlib.group import BotGroup
+
+
+def make_bot(username, main):
+    bot = mock.MagicMock()
+    bot.creds.username = username
+    bot.config.shard_workers = 0
+    bot.main = main
+    bot.api.close = mock.AsyncMock()
+    bot._reset = mock.AsyncMock()
+    return bot
+
+
+def test_group(caplog):
+    started = {"failing": 0, "stable": 0}
+
+    async def failing_main():
+        started["failing"] += 1
+        if started["failing"] == 1:
+            raise ConnectionError()
+        await asyncio.sleep(3600)
+
+    async def stable_main():
+        started["stable"] += 1
+        await asyncio.sleep(3600)
+
+    failing = make_bot("failing", failing_main)
+    stable = make_bot("stable", stable_main)
+    group = BotGroup([failing, stable], restart_delay=0.01)
+
+    async def main():
+        running = asyncio.ensure_future(group.main())
+        while started["failing"] < 2:
+            await asyncio.sleep(0.01)
+        session = group.http_session
+        # the failing bot was restarted without affecting the other one
+        assert started == {"failing": 2, "stable": 1}
+        assert failing.api.http_session is session
+        assert stable.api.http_session is session
+        assert failing._process_pool is stable._process_pool
+
+        group.stop()
+        await running
+        assert session.closed
+        assert failing.api.close.await_count == 2
+        assert stable.api.close.await_count == 1
+        # the state of the failed run was dropped before restarting
+        assert failing._reset.await_count == 1
+        assert stable._reset.await_count == 0
+
+    asyncio.run(main())
+    # a requested stop is not an error
+    assert "All bots stopped" not in caplog.text
+
+
+def test_group_all_stopped():
+
+    async def failing_main():
+        raise ConnectionError()
+
+    bots = [make_bot(f"bot{i}", failing_main) for i in range(2)]
+    group = BotGroup(bots, restart_delay=None)
+    # returns once no bot is running anymore
+    asyncio.run(asyncio.wait_for(group.main(), 5))
+    assert all(bot.api.close.await_count == 1 for bot in bots)
+
+
+def test_group_rejects_sharded_bots():
+    async def main():
+        pass
+
+    sharded = make_bot("sharded", main)
+    sharded.config.shard_workers = 2
+    with pytest.raises(ValueError):
+        BotGroup([sharded])
+    group = BotGroup([make_bot("plain", main)])
+    with pytest.raises(ValueError):
+        group.add(sharded)
+    assert len(group.bots) == 1
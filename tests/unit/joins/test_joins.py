@@ -0,0 +1,58 @@
+import asyncio
+from nio import JoinError, JoinResponse
+from simplematrixbotlib.joins import JoinScheduler
+
+
+def test_join_scheduler():
+    calls = []
+    running = 0
+    max_running = 0
+
+    async def join(room_id):
+        nonlocal running, max_running
+        calls.append(room_id)
+        running += 1
+        max_running = max(max_running, running)
+        await asyncio.sleep(0.001)
+        running -= 1
+        if room_id == "!limited" and calls.count(room_id) <= 2:
+            return JoinError("Too many requests", "M_LIMIT_EXCEEDED", 10)
+        if room_id == "!flaky" and calls.count(room_id) == 1:
+            raise ConnectionError()
+        if room_id == "!forbidden":
+            return JoinError("Forbidden", "M_FORBIDDEN")
+        return JoinResponse(room_id)
+
+    async def main():
+        scheduler = JoinScheduler(join,
+                                  concurrency=2,
+                                  tries=3,
+                                  base_delay=0.01)
+        tasks = [scheduler.schedule(f"!room{i}") for i in range(6)]
+        # the same room is only joined once
+        assert scheduler.schedule("!room0") is tasks[0]
+        limited = scheduler.schedule("!limited")
+        flaky = scheduler.schedule("!flaky")
+        forbidden = scheduler.schedule("!forbidden")
+        assert scheduler.pending() == 9
+
+        assert all(await asyncio.gather(*tasks))
+        assert await limited
+        assert await flaky
+        assert not await forbidden
+        assert scheduler.pending() == 0
+
+    asyncio.run(main())
+    assert max_running <= 2
+    assert calls.count("!room0") == 1
+    # rate limit responses are not counted as failed tries
+    assert calls.count("!limited") == 3
+    assert calls.count("!flaky") == 2
+    assert calls.count("!forbidden") == 3
+
+
+def test_backoff():
+    scheduler = JoinScheduler(None, base_delay=1, max_delay=10)
+    assert all(0 <= scheduler.backoff(1) <= 1 for _ in range(100))
+    assert all(0 <= scheduler.backoff(3) <= 4 for _ in range(100))
+    assert all(0 <= scheduler.backoff(10) <= 10 for _ in range(100))
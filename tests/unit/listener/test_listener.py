@@ -1,4 +1,10 @@
+import asyncio
+import functools
+import threading
 from typing import List
+
+import pytest
+from simplematrixbotlib.bot import Bot
 from simplematrixbotlib.listener import Listener
 from unittest import mock
 from nio import RoomMessageText
@@ -60,3 +66,60 @@ def test_on_startup():
         return False
 
     assert check()
+
+
+def test_command():
+    command_listener = Listener(mock_bot)
+    called = []
+
+    @command_listener.command("high_five", aliases=["hf"], prefix="!")
+    async def high_five(room, message):
+        called.append(("high_five", message.body))
+
+    @command_listener.command("help", prefix="!", case_sensitive=False)
+    async def bot_help(room, message):
+        called.append(("help", message.body))
+
+    assert command_listener._registry == [[
+        command_listener._dispatch_command, RoomMessageText
+    ]]
+
+    def dispatch(body):
+        message = mock.MagicMock()
+        message.body = body
+        message.formatted_body = None
+        asyncio.run(command_listener._dispatch_command(mock.MagicMock(), message))
+
+    dispatch("!hf now")
+    dispatch("!HELP me")
+    dispatch("!High_five")
+    dispatch("hf")
+    dispatch("! ")
+    dispatch("!count")
+
+    assert called == [("high_five", "!hf now"), ("help", "!HELP me")]
+
+
+def test_on_message_event_executor():
+    executor_bot = mock.MagicMock()
+    executor_bot.run_in_executor = functools.partial(Bot.run_in_executor,
+                                                     executor_bot)
+    executor_listener = Listener(executor_bot)
+    threads = []
+
+    async def reply(thread):
+        threads.append(thread)
+
+    @executor_listener.on_message_event(executor="thread")
+    def heavy(room, message):
+        return reply(threading.current_thread())
+
+    with pytest.raises(ValueError):
+        executor_listener.on_message_event(reply, executor="thread")
+    with pytest.raises(ValueError):
+        executor_listener.on_message_event(lambda room, message: None,
+                                           executor="gpu")
+
+    handler = executor_listener._registry[0][0]
+    asyncio.run(handler(mock.MagicMock(), mock.MagicMock()))
+    assert threads and threads[0] is not threading.current_thread()
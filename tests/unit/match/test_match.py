@@ -48,3 +48,29 @@ def test_allow_block():
 
 def test_is_not_from_this_bot():
     assert match.is_not_from_this_bot()
+
+
+def test_message_match_shares_parse():
+    from nio import RoomMessageText
+    from simplematrixbotlib.match import MessageMatch
+
+    event = RoomMessageText.from_dict({
+        'type': 'm.room.message',
+        'event_id': '$1',
+        'sender': '@test:example.org',
+        'origin_server_ts': 1,
+        'content': {
+            'msgtype': 'm.text',
+            'body': '!help me'
+        }
+    })
+    first = MessageMatch(mock_room, event, mock_bot, "!")
+    second = MessageMatch(mock_room, event, mock_bot, "/")
+    assert first.command("help")
+    assert second.args() == ["me"]
+    assert first._view() is second._view()
+    # match objects accept attributes set by handlers
+    first.note = "handled"
+
+    event.body = "!other"
+    assert MessageMatch(mock_room, event, mock_bot, "!").command() == "other"
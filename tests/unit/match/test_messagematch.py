@@ -41,3 +41,17 @@ match = MessageMatch(mock_room, mock_event, mock_bot, prefix)
 def test_init():
     assert issubclass(MessageMatch, Match)
     assert match._prefix == prefix
+
+
+def test_parsed_once():
+    event = mock.MagicMock()
+    event.body = "!roll 2 d6"
+    event.formatted_body = None
+
+    first = MessageMatch(mock_room, event, mock_bot, "!")
+    second = MessageMatch(mock_room, event, mock_bot, "?")
+
+    assert first.command() == "roll"
+    assert first.args() == ["2", "d6"]
+    assert not second.prefix()
+    assert first._parsed is second._view()
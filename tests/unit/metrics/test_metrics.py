@@ -0,0 +1,67 @@
+import asyncio
+from unittest import mock
+import pytest
+from simplematrixbotlib.callbacks import Callbacks
+from simplematrixbotlib.metrics import BotMetrics, MetricsRegistry
+
+
+def test_render():
+    registry = MetricsRegistry('test_')
+    counter = registry.counter('events_total', 'Events.', ('type', ))
+    histogram = registry.histogram('duration_seconds',
+                                   'Duration.',
+                                   buckets=(0.1, 1))
+    registry.gauge('depth', 'Depth.', lambda: 3)
+    registry.gauge('missing', 'Missing.', lambda: None)
+
+    counter.inc('RoomMessageText')
+    counter.inc('RoomMessageText')
+    counter.inc('Say "hi"\n')
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+
+    assert registry.render() == (
+        '# HELP test_events_total Events.\n'
+        '# TYPE test_events_total counter\n'
+        'test_events_total{type="RoomMessageText"} 2\n'
+        'test_events_total{type="Say \\"hi\\"\\n"} 1\n'
+        '# HELP test_duration_seconds Duration.\n'
+        '# TYPE test_duration_seconds histogram\n'
+        'test_duration_seconds_bucket{le="0.1"} 1\n'
+        'test_duration_seconds_bucket{le="1"} 2\n'
+        'test_duration_seconds_bucket{le="+Inf"} 3\n'
+        'test_duration_seconds_sum 5.55\n'
+        'test_duration_seconds_count 3\n'
+        '# HELP test_depth Depth.\n'
+        '# TYPE test_depth gauge\n'
+        'test_depth 3\n')
+
+    with pytest.raises(ValueError):
+        registry.counter('events_total', 'Events.')
+
+
+def test_handler_metrics():
+    bot = mock.MagicMock()
+    bot.metrics = BotMetrics()
+    bot.profiler = None
+    bot.shards = None
+
+    async def ok(room, event):
+        pass
+
+    async def broken(room, event):
+        raise ValueError()
+
+    bot.listener._registry = [[ok, object], [broken, object]]
+    callbacks = Callbacks(mock.MagicMock(), bot)
+    callbacks.dispatcher = None
+
+    with pytest.raises(ValueError):
+        asyncio.run(callbacks.event_callback(mock.MagicMock(), object()))
+
+    assert bot.metrics.events_received.get('object') == 1
+    assert bot.metrics.handler_calls.get(ok.__qualname__) == 1
+    assert bot.metrics.handler_errors.get(ok.__qualname__) == 0
+    assert bot.metrics.handler_errors.get(broken.__qualname__) == 1
+    assert bot.metrics.handler_duration.count(broken.__qualname__) == 1
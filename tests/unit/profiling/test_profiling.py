@@ -0,0 +1,103 @@
+import asyncio
+import pstats
+import time
+from unittest import mock
+import pytest
+from nio import RoomMessageText
+from simplematrixbotlib.callbacks import Callbacks
+from simplematrixbotlib.listener import Listener
+from simplematrixbotlib.metrics import BotMetrics
+from simplematrixbotlib.profiling import HandlerProfiler
+
+
+def busy(seconds):
+    end = time.thread_time() + seconds
+    while time.thread_time() < end:
+        pass
+
+
+async def slow(room_id):
+    busy(0.02)
+    await asyncio.sleep(0.05)
+
+
+async def fast(room_id):
+    pass
+
+
+async def broken(room_id):
+    raise ValueError(room_id)
+
+
+def test_profiler(tmp_path, caplog):
+    profiler = HandlerProfiler(threshold=0.03, keep_slowest=2)
+
+    async def other():
+        # runs while slow is waiting, which must not count as slow's CPU time
+        await asyncio.sleep(0.01)
+        busy(0.03)
+
+    async def main():
+        await asyncio.gather(
+            profiler.run(slow, "!a", room_id="!a", event_id="$1"),
+            *(profiler.run(fast, "!b", room_id="!b") for _ in range(3)),
+            other())
+        with pytest.raises(ValueError):
+            await profiler.run(broken, "!c", room_id="!c")
+
+    asyncio.run(main())
+
+    stats = {stats.handler: stats for stats in profiler.stats()}
+    assert profiler.stats()[0].handler == slow.__qualname__
+    assert stats[slow.__qualname__].calls == 1
+    assert stats[slow.__qualname__].wall_time >= 0.07
+    assert 0.02 <= stats[slow.__qualname__].cpu_time < 0.05
+    assert stats[fast.__qualname__].calls == 3
+    assert stats[broken.__qualname__].calls == 1
+
+    assert "Slow handler" in caplog.text
+    assert "!a" in caplog.text and "$1" in caplog.text
+
+    slowest = profiler.slowest()
+    assert len(slowest) == 2
+    assert slowest[0].handler == slow.__qualname__
+    assert slowest[0].event_id == "$1"
+
+    paths = profiler.dump_slowest(tmp_path)
+    assert len(paths) == 2
+    assert any("busy" in func[2]
+               for func in pstats.Stats(str(paths[0])).stats)
+
+
+def test_command_handlers_profiled_separately():
+    bot = mock.MagicMock()
+    bot.metrics = BotMetrics()
+    bot.profiler = HandlerProfiler()
+    bot.shards = None
+    bot.listener = Listener(bot)
+
+    @bot.listener.command("a", prefix="!")
+    async def command_a(room, event):
+        pass
+
+    @bot.listener.command("b", prefix="!")
+    async def command_b(room, event):
+        pass
+
+    callbacks = Callbacks(mock.MagicMock(), bot)
+    event = RoomMessageText.from_dict({
+        "event_id": "$1",
+        "sender": "@alice:example.org",
+        "origin_server_ts": 0,
+        "type": "m.room.message",
+        "content": {
+            "msgtype": "m.text",
+            "body": "!a"
+        }
+    })
+    asyncio.run(callbacks._run_handlers(mock.MagicMock(), event))
+
+    assert [stats.handler
+            for stats in bot.profiler.stats()] == [command_a.__qualname__]
+    assert bot.metrics.handler_calls.get(command_a.__qualname__) == 1
+    assert bot.metrics.handler_calls.get(command_b.__qualname__) == 0
@@ -0,0 +1,116 @@
+import asyncio
+from nio import RoomSendError, RoomSendResponse
+import time
+from simplematrixbotlib.ratelimit import (RateLimitPause, SendQueue,
+                                          TokenBucket, concurrency_limit,
+                                          retry_after)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=1, burst=2)
+    assert bucket.take() == 0
+    assert bucket.take() == 0
+    assert bucket.take() > 0
+
+    assert TokenBucket(rate=0, burst=1).take() == 0
+
+
+def test_retry_after():
+    assert retry_after(RoomSendResponse("$event", "!room")) is None
+    assert retry_after(
+        RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 20)) == 0.02
+    assert retry_after(RoomSendError("Forbidden", "M_FORBIDDEN")) is None
+
+
+def test_rate_limit_pause():
+    pause = RateLimitPause()
+    assert not pause.check(RoomSendResponse("$1", "!a"), "sending to !a")
+    limited = RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 50)
+    assert pause.check(limited, "sending to !a")
+
+    async def main():
+        start = time.monotonic()
+        await pause.wait()
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.04
+
+
+def test_concurrency_limit():
+    running = 0
+    peak = 0
+
+    async def task(limit):
+        nonlocal running, peak
+        async with limit:
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+
+    async def main(concurrency):
+        limit = concurrency_limit(concurrency)
+        await asyncio.gather(*(task(limit) for _ in range(5)))
+
+    asyncio.run(main(2))
+    assert peak == 2
+    peak = 0
+    asyncio.run(main(0))
+    assert peak == 5
+
+
+def test_send_queue():
+    sent = []
+    limited = []
+
+    async def send(room_id, body):
+        if body == "limited" and not limited:
+            limited.append(body)
+            return RoomSendError("Too many requests", "M_LIMIT_EXCEEDED", 10)
+        sent.append((room_id, body))
+        return RoomSendResponse(f"${body}", room_id)
+
+    async def main():
+        queue = SendQueue(send, rate=0, burst=1, room_rate=0, room_burst=1)
+        futures = [
+            queue.submit("!a", "first"),
+            queue.submit("!a", "limited"),
+            queue.submit("!a", "last"),
+            queue.submit("!b", "other"),
+        ]
+        responses = await asyncio.gather(*futures)
+        assert queue.depth() == 0
+        return responses
+
+    responses = asyncio.run(main())
+
+    assert [response.event_id for response in responses
+            ] == ["$first", "$limited", "$last", "$other"]
+    assert [body for room_id, body in sent if room_id == "!a"
+            ] == ["first", "limited", "last"]
+    assert limited == ["limited"]
+
+
+def test_send_queue_prune_and_stop():
+
+    async def send(room_id, body):
+        if body == "slow":
+            await asyncio.sleep(3600)
+        return RoomSendResponse(f"${body}", room_id)
+
+    async def main():
+        queue = SendQueue(send, rate=0, burst=1, room_rate=0, room_burst=1)
+        queue._prune_at = 3
+        for i in range(3):
+            await queue.submit(f"!room{i}", "hi")
+        # idle rooms are forgotten
+        slow = queue.submit("!slow", "slow")
+        assert list(queue._room_buckets) == []
+
+        await asyncio.sleep(0)
+        waiting = queue.submit("!slow", "waiting")
+        await queue.stop()
+        assert slow.cancelled() and waiting.cancelled()
+        assert queue.depth() == 0 and not queue._tasks
+
+    asyncio.run(main())
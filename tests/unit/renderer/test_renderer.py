@@ -0,0 +1,23 @@
+import markdown
+from simplematrixbotlib.renderer import MarkdownRenderer
+
+message = "# Help\n```\n!roll\n```\nline one\nline two"
+
+
+def test_render():
+    renderer = MarkdownRenderer(max_size=1)
+    expected = markdown.markdown(message, extensions=['fenced_code', 'nl2br'])
+
+    assert renderer.render(message) == expected
+    assert renderer.render(message) == expected
+    assert renderer.lookup("*other*") is None
+    assert renderer.render("*other*") == "<p><em>other</em></p>"
+    assert renderer.render(message) == expected
+    assert tuple(renderer.cache_info()) == (1, 3, 1, 1)
+
+
+def test_no_cache():
+    renderer = MarkdownRenderer(max_size=10, max_message_size=5)
+    renderer.render(message)
+    renderer.render(message)
+    assert tuple(renderer.cache_info()) == (0, 2, 0, 10)
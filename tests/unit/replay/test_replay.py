@@ -0,0 +1,100 @@
+import asyncio
+import json
+from unittest import mock
+import simplematrixbotlib as botlib
+from simplematrixbotlib.replay import SyncRecorder, read_recording, replay
+
+
+def make_response(next_batch, events):
+    body = {
+        "next_batch": next_batch,
+        "rooms": {
+            "join": {
+                "!room:example.org": {
+                    "timeline": {
+                        "events": events,
+                        "limited": False
+                    }
+                }
+            }
+        },
+    }
+    response = mock.MagicMock()
+    response.transport_response.read = mock.AsyncMock(
+        return_value=json.dumps(body).encode())
+    return response
+
+
+def message(event_id, body):
+    return {
+        "type": "m.room.message",
+        "event_id": event_id,
+        "sender": "@alice:example.org",
+        "origin_server_ts": 0,
+        "content": {
+            "msgtype": "m.text",
+            "body": body
+        },
+    }
+
+
+def record(path, redact=()):
+    client = mock.MagicMock()
+    client.user_id = "@bot:example.org"
+    client.device_id = "DEVICE"
+    client.homeserver = "https://example.org"
+    recorder = SyncRecorder(path, redact)
+
+    async def main():
+        recorder.open(client)
+        await recorder.record(make_response("s1", [message("$old", "!ping")]),
+                              initial=True)
+        await recorder.record(make_response("s2", [message("$1", "!ping")]))
+        await recorder.record(
+            make_response("s3", [message("$2", "hello"),
+                                 message("$3", "!ping")]))
+        recorder.close()
+
+    asyncio.run(main())
+
+
+def test_redaction(tmp_path):
+    path = tmp_path.joinpath("sync.jsonl.gz")
+    record(path, redact=["body"])
+    header, records = read_recording(path)
+    assert header["user_id"] == "@bot:example.org"
+    records = list(records)
+    assert len(records) == 3
+    assert records[0]["initial"]
+    content = records[1]["sync"]["rooms"]["join"]["!room:example.org"][
+        "timeline"]["events"][0]["content"]
+    assert content == {"msgtype": "m.text", "body": "xxxxx"}
+
+
+def test_replay(tmp_path):
+    path = tmp_path.joinpath("sync.jsonl.gz")
+    record(path)
+
+    config = botlib.Config()
+    config.encryption_enabled = False
+    bot = botlib.Bot(
+        botlib.Creds("https://example.org", "bot", "pass",
+                     session_stored_file=None), config)
+    handled = []
+
+    @bot.listener.on_message_event
+    async def pong(room, event):
+        handled.append(event.event_id)
+        if event.body == "!ping":
+            await bot.api.send_text_message(room.room_id, "pong")
+
+    stats = asyncio.run(replay(bot, path))
+
+    # events of the initial sync are not passed to listeners, like when running the bot
+    assert handled == ["$1", "$2", "$3"]
+    assert stats.responses == 2
+    assert stats.sent == 2
+    room_id, data = bot.async_client.sent[0]
+    assert room_id == "!room:example.org"
+    assert json.loads(data)["body"] == "pong"
+    assert "!room:example.org" in bot.async_client.rooms
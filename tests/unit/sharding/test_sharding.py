@@ -0,0 +1,116 @@
+import asyncio
+import os
+import sys
+from unittest import mock
+
+import pytest
+from nio import MatrixRoom, RoomMessageText, RoomSendResponse
+
+import simplematrixbotlib as botlib
+from simplematrixbotlib.callbacks import Callbacks
+from simplematrixbotlib.metrics import BotMetrics
+from simplematrixbotlib.sharding import ShardPool, ShardRing
+
+
+def test_shard_ring():
+    rooms = [f"!room{i}:example.org" for i in range(1000)]
+    ring = ShardRing(4)
+    shards = [ring.shard(room_id) for room_id in rooms]
+    # stable, and every shard gets a fair share of the rooms
+    assert shards == [ShardRing(4).shard(room_id) for room_id in rooms]
+    assert all(150 < shards.count(shard) < 350 for shard in range(4))
+
+    # adding a shard only moves rooms to the new shard
+    grown = [ShardRing(5).shard(room_id) for room_id in rooms]
+    moved = [(old, new) for old, new in zip(shards, grown) if old != new]
+    assert all(new == 4 for _, new in moved)
+    assert len(moved) < 350
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="needs fork")
+def test_shard_pool():
+    creds = botlib.Creds("https://example.org", "bot", "password")
+    config = botlib.Config()
+    config.dispatch_workers = 2
+    # handler timings are sent back to the process that syncs
+    config.metrics_port = 9100
+    bot = botlib.Bot(creds, config)
+
+    @bot.listener.on_message_event
+    async def echo(room, message):
+        await bot.api.send_text_message(
+            room.room_id, f"{os.getpid()} {message.body} {room.name}")
+
+    sent = []
+
+    async def send_text_message(room_id, text):
+        sent.append((room_id, text))
+        return RoomSendResponse(f"$sent{len(sent)}", room_id)
+
+    async def main():
+        pool = ShardPool(bot, 2, max_pending=5)
+        pool.start()
+        try:
+            bot.api = mock.MagicMock()
+            bot.api.send_text_message = send_text_message
+            bot.metrics = BotMetrics()
+            bot.callbacks = Callbacks(mock.MagicMock(), bot)
+            await pool.connect(
+                mock.MagicMock(user_id="@bot:example.org",
+                               device_id="DEVICE",
+                               homeserver="https://example.org"))
+            rooms = [
+                MatrixRoom(f"!room{i}:example.org", "@bot:example.org")
+                for i in range(8)
+            ]
+            for i in range(40):
+                room = rooms[i % 8]
+                if i == 20:
+                    # a changed room is sent to its worker again
+                    room.name = "renamed"
+                    await pool._event_callback(
+                        room, mock.MagicMock(source={'state_key': ''}))
+                    assert room.room_id not in pool._sent_rooms[
+                        pool._ring.shard(room.room_id)]
+                event = RoomMessageText.from_dict({
+                    'type': 'm.room.message',
+                    'event_id': f"$event{i}",
+                    'sender': "@user:example.org",
+                    'origin_server_ts': i,
+                    'content': {
+                        'msgtype': 'm.text',
+                        'body': str(i)
+                    }
+                })
+                await pool.submit(room, event)
+            for _ in range(500):
+                if len(sent) == 40 and pool.depth() == 0:
+                    break
+                await asyncio.sleep(0.01)
+            assert pool.depth() == 0
+            # rooms were sent once and are now known to their workers
+            assert sum(len(sent_rooms)
+                       for sent_rooms in pool._sent_rooms) == 8
+            assert bot.metrics.handler_calls.get(
+                "test_shard_pool.<locals>.echo") == 40
+        finally:
+            await pool.stop()
+        assert not any(process.is_alive() for process in pool._processes)
+        return pool
+
+    pool = asyncio.run(main())
+
+    assert len(sent) == 40
+    pids = {}
+    for room_id, text in sent:
+        pid, body, name = text.split()
+        # handlers see the room as of their event
+        assert (name == "renamed") == (int(body) >= 20
+                                       and room_id == "!room4:example.org")
+        # every room is handled by one worker, in order
+        assert pids.setdefault(room_id, pid) == pid
+    assert len(set(pids.values())) == 2
+    for room_id in pids:
+        bodies = [int(text.split()[1]) for r, text in sent if r == room_id]
+        assert bodies == sorted(bodies)
+    assert os.getpid() not in {int(pid) for pid in pids.values()}
@@ -0,0 +1,44 @@
+from unittest import mock
+from nio import Event, InviteMemberEvent, UnknownEvent
+from simplematrixbotlib.listener import Listener
+from simplematrixbotlib.syncfilter import build_sync_filter
+
+
+def make_bot():
+    bot = mock.MagicMock()
+    bot.listener = Listener(bot)
+    return bot
+
+
+def test_build_sync_filter():
+    bot = make_bot()
+
+    @bot.listener.on_message_event
+    async def message(room, event):
+        pass
+
+    @bot.listener.on_reaction_event
+    async def reaction(room, event, key):
+        pass
+
+    @bot.listener.on_custom_event(InviteMemberEvent)
+    async def invite(room, event):
+        pass
+
+    sync_filter = build_sync_filter(bot)
+    assert sync_filter["presence"] == {"not_types": ["*"]}
+    assert sync_filter["room"]["ephemeral"] == {"not_types": ["*"]}
+    assert sync_filter["room"]["state"]["lazy_load_members"]
+
+    types = sync_filter["room"]["timeline"]["types"]
+    for event_type in ("m.room.message", "m.reaction", "m.room.encrypted",
+                       "m.room.member", "m.room.encryption"):
+        assert event_type in types
+    assert "m.sticker" not in types
+
+
+def test_unfiltered_timeline():
+    for event_type in (Event, UnknownEvent):
+        bot = make_bot()
+        bot.listener.on_custom_event(event_type)(mock.MagicMock())
+        assert "types" not in build_sync_filter(bot)["room"]["timeline"]
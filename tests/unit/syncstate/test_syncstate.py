@@ -0,0 +1,85 @@
+import asyncio
+import json
+from nio import AsyncClient, MatrixRoom, SyncResponse
+from nio.rooms import RoomSummary
+from simplematrixbotlib.syncstate import SyncState
+
+
+def make_client():
+    client = AsyncClient("https://example.org", "@bot:example.org", "DEVICE")
+    return client
+
+
+def test_save_and_load(tmp_path):
+    client = make_client()
+    client.next_batch = "s72595_4483_1934"
+    room = MatrixRoom("!room:example.org", client.user_id, encrypted=True)
+    room.name = "Room"
+    room.topic = "A topic"
+    room.summary = RoomSummary(0, 3, ["@alice:example.org"])
+    client.rooms[room.room_id] = room
+
+    state = SyncState.for_client(client, tmp_path)
+    assert state.path.parent == tmp_path
+    assert ":" not in state.path.name
+    state.save()
+
+    restored = make_client()
+    assert SyncState.for_client(restored, tmp_path).load()
+    assert restored.next_batch == "s72595_4483_1934"
+    restored_room = restored.rooms["!room:example.org"]
+    assert restored_room.name == "Room"
+    assert restored_room.topic == "A topic"
+    assert restored_room.encrypted
+    assert restored_room.summary.joined_member_count == 3
+    assert restored_room.summary.heroes == ["@alice:example.org"]
+    assert not restored_room.members_synced
+    assert "!room:example.org" in restored.encrypted_rooms
+
+
+def test_load_ignores_missing_and_foreign_state(tmp_path):
+    client = make_client()
+    state = SyncState(client, tmp_path.joinpath("state.json"))
+    assert not state.load()
+
+    state.path.write_text("not json")
+    assert not state.load()
+
+    state.path.write_text(
+        json.dumps({
+            "version": 1,
+            "user_id": "@other:example.org",
+            "next_batch": "s1",
+            "rooms": {}
+        }))
+    assert not state.load()
+    assert not client.next_batch
+
+
+def test_save_without_token(tmp_path):
+    client = make_client()
+    state = SyncState(client, tmp_path.joinpath("state.json"))
+    state.save()
+    assert not state.path.exists()
+
+
+def test_save_after_sync(tmp_path):
+    client = make_client()
+    state = SyncState.for_client(client, tmp_path)
+    client.add_response_callback(state.sync_callback, SyncResponse)
+
+    async def main():
+        client.next_batch = "s1"
+        await client.run_response_callbacks(
+            [SyncResponse("s1", None, None, None, [], [])])
+        saving = state._saving
+        assert saving is not None
+        client.next_batch = "s2"
+        # waits for the save started after the sync, then saves the newer token
+        await state.close()
+        assert saving.done()
+
+    asyncio.run(main())
+    restored = make_client()
+    assert SyncState.for_client(restored, tmp_path).load()
+    assert restored.next_batch == "s2"
@@ -0,0 +1,21 @@
+import os
+import subprocess
+import sys
+
+
+def test_lazy_import():
+    code = ("import sys, simplematrixbotlib\n"
+            "from simplematrixbotlib import MessageMatch, Config\n"
+            "print(' '.join(sorted(sys.modules)))")
+    result = subprocess.run([sys.executable, "-c", code],
+                            capture_output=True,
+                            text=True,
+                            check=True,
+                            env={
+                                **os.environ, "PYTHONPATH":
+                                os.pathsep.join(sys.path)
+                            })
+    modules = result.stdout.split()
+
+    for heavy_module in ("nio", "aiohttp", "markdown", "cryptography", "toml"):
+        assert heavy_module not in modules